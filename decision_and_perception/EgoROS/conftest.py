@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import textwrap
+from typing import Dict, List
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Runs the given node files in a new instance for some seconds
+RUNNER = '''
+import sys
+from egoros.instance import EgoInstance
+EgoInstance(sys.argv[2:]).spin(float(sys.argv[1]))
+'''
+
+
+@pytest.fixture
+def run_nodes(tmp_path):
+    """
+    Runs nodes in a new instance (in its own process) and returns what they printed
+    @details The fixture is a function receiving a dictionary of node file names to their source and the
+    seconds to run
+    """
+    def run(nodes: Dict[str, str], duration: float = 2.0, timeout: float = 60.0) -> List[str]:
+        files = []
+        for name, source in nodes.items():
+            path = tmp_path / name
+            path.write_text(textwrap.dedent(source))
+            files.append(str(path))
+        result = subprocess.run(
+            [sys.executable, '-c', RUNNER, str(duration), *files],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=timeout
+        )
+        return result.stdout.splitlines()
+    return run
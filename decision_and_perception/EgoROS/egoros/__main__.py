@@ -7,6 +7,7 @@ from . import node
 import logging
 from functools import reduce
 from . import instance
+from . import cli
 import traceback
 
 
@@ -29,8 +30,71 @@ parser.add_argument(
     help='Enables hot reloading for all of the nodes'
 )
 
+parser.add_argument(
+    '-l', '--preload',
+    action='store',
+    default='',
+    metavar='MODULES',
+    help='Comma separated modules imported once before forking the node workers (for example "numpy,cv2")'
+)
+
+parser.add_argument(
+    '-s', '--simulate',
+    action='store',
+    type=float,
+    metavar='SECONDS',
+    help='Runs the nodes in lockstep with a simulated clock for the specified simulated time'
+)
+
+parser.add_argument(
+    '-c', '--checkpoints',
+    action='store',
+    metavar='FOLDER',
+    default='./checkpoints',
+    help='Folder where the nodes with a checkpoint period store their state, restored when the instance starts (default: "./checkpoints")'
+)
+
+parser.add_argument(
+    '-t', '--trace',
+    action='store',
+    metavar='FILE',
+    help='Records the ticks, callbacks, publications and queue waits of all the nodes into a Chrome trace (open it with Perfetto)'
+)
+
+parser.add_argument(
+    '-o', '--offload-workers',
+    action='store',
+    type=int,
+    metavar='N',
+    help='Number of processes of the pool where the nodes offload CPU-bound work (default: number of CPUs)'
+)
+
+parser.add_argument(
+    '--offload-timeout',
+    action='store',
+    type=float,
+    metavar='SECONDS',
+    help='Seconds an offloaded function can run before its worker is killed and replaced (default: no limit)'
+)
+
+subparsers = parser.add_subparsers(
+    dest='command',
+    help='Tools to interact with a running instance (a new instance is run if no command is given)'
+)
+cli.add_param_parser(subparsers)
+cli.add_record_parser(subparsers)
+cli.add_topic_parser(subparsers)
+cli.add_soak_parser(subparsers)
+
 args = parser.parse_args()
 
+if args.command is not None:
+    try:
+        exit(args.handler(args))
+    except FileNotFoundError as e:
+        log.critical(e)
+        exit(1)
+
 # Get nodes
 try:
     filenames = utils.get_node_filenames_from_path(args.path)
@@ -47,9 +111,18 @@ try:
     ''')
 
     ego = instance.EgoInstance(
-        node_filanames=filenames
+        node_filanames=filenames,
+        preload=[module for module in args.preload.split(',') if module],
+        checkpoint_dir=args.checkpoints,
+        trace=args.trace,
+        offload_workers=args.offload_workers,
+        offload_timeout=args.offload_timeout
     )
 
+    if args.simulate is not None:
+        ego.run_lockstep(args.simulate)
+        exit(0)
+
     if args.enable_hot_reload:
         log.info('Enabling hot reload...')
         ego.enable_hot_reloading()
@@ -0,0 +1,274 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+import logging
+import multiprocessing
+import os
+import numpy as np
+from . import clock
+from . import pubsub
+from .pubsub import FlowControl, MessageContext, PublishStatus, Topic
+
+log = logging.getLogger('egoros')
+
+# Every slot has a header with its sequence number and its publication timestamp (ns)
+SLOT_HEADER_FIELDS = 2
+ALIGNMENT = 64
+
+
+class ArrayFrame:
+    """
+    Frame received from an array topic
+    @details
+    The array is a read-only view of the shared memory slot, so it's only valid until the publisher
+    wraps around the ring. valid() tells if the slot still holds this frame (copy the array if it
+    has to be kept).
+    """
+
+    def __init__(self, topic: 'ArrayTopic', array: np.ndarray, seq: int) -> None:
+        """
+        Constructor for the ArrayFrame class
+        @param topic: Topic of the frame
+        @param array: View of the slot holding the frame
+        @param seq: Sequence number of the frame (starting at 1)
+        """
+        self.topic = topic
+        self.array = array
+        self.seq = seq
+
+    def valid(self) -> bool:
+        """
+        Checks if the frame has not been overwritten
+        """
+        return self.topic.slot_seq(self.seq) == self.seq
+
+
+class ArrayTopic(Topic):
+    """
+    Topic of fixed shape arrays backed by a shared memory ring
+    @details
+    Publishers copy the array directly into the next slot of the ring (without allocating or pickling)
+    and wake up the subscribers, which receive ArrayFrame views of the slots.
+    Publishing never takes a lock: every reader has its own wakeup semaphore, which the publisher posts.
+    The ring and its readers have to be declared before the node processes are launched (in the init of the nodes).
+    The ring has a single publisher process: the first worker that publishes owns the topic, other processes
+    can only publish once it has exited (the process that created the topic can publish during the init).
+    """
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: Any, slots: int = 8) -> None:
+        """
+        Constructor for the ArrayTopic class
+        @param name: The name of the topic
+        @param shape: Shape of the published arrays
+        @param dtype: Data type of the published arrays
+        @param slots: Number of frames kept in the ring
+        """
+        super().__init__(name)
+        self.type = np.ndarray
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+
+        frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.slot_stride = -(-frame_size // ALIGNMENT) * ALIGNMENT
+        header_size = (1 + SLOT_HEADER_FIELDS * slots) * 8
+        self.data_offset = -(-header_size // ALIGNMENT) * ALIGNMENT
+        self.shm = SharedMemory(create=True, size=self.data_offset + slots * self.slot_stride)
+
+        # header[0] is the last committed sequence, followed by the (seq, timestamp) pair of every slot
+        self.header = np.ndarray((1 + SLOT_HEADER_FIELDS * slots,), dtype=np.uint64, buffer=self.shm.buf)
+        self.header[:] = 0
+        self.views = [
+            np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf, offset=self.data_offset + i * self.slot_stride)
+            for i in range(slots)
+        ]
+        self.readonly_views = []
+        for view in self.views:
+            readonly = view.view()
+            readonly.flags.writeable = False
+            self.readonly_views.append(readonly)
+
+        # Wakeup of every reader, holding at most one pending notification
+        self.wakeups: List[Any] = []
+        # Frames every reader missed because they were overwritten, shared so any process can read them
+        self.dropped: List[Any] = []
+        # Process id of the worker publishing to the ring (0 until a worker publishes)
+        self.creator = os.getpid()
+        self.owner = multiprocessing.Value('q', 0)
+        # Last process of this copy of the topic that took the ring, so publishing does not take the lock
+        self.owned_by = 0
+
+    def matches(self, shape: Tuple[int, ...], dtype: Any, slots: int) -> bool:
+        """
+        Checks if a declaration is compatible with the topic
+        @param shape: Declared shape of the arrays
+        @param dtype: Declared data type of the arrays
+        @param slots: Declared number of slots
+        """
+        return self.shape == tuple(shape) and self.dtype == np.dtype(dtype) and self.slots == slots
+
+    def claim(self) -> np.ndarray:
+        """
+        Gets the slot where the next frame will be written
+        @return: Writable view of the slot, call commit() once it has been filled
+        @details The slot is marked as invalid until the frame is committed
+        """
+        pid = os.getpid()
+        if self.owned_by != pid and pid != self.creator:
+            self.__take_ownership(pid)
+        seq = int(self.header[0]) + 1
+        slot = (seq - 1) % self.slots
+        self.header[1 + SLOT_HEADER_FIELDS * slot] = 0
+        return self.views[slot]
+
+    def __take_ownership(self, pid: int):
+        """
+        Makes a process the publisher of the ring
+        @param pid: Process id of the publisher
+        @details Raises RuntimeError if another process that is still running publishes to the ring
+        """
+        with self.owner.get_lock():
+            owner = self.owner.value
+            if owner != 0:
+                try:
+                    os.kill(owner, 0)
+                except ProcessLookupError:
+                    owner = 0 # The previous publisher exited (the node was restarted)
+            if owner != 0:
+                msg = f'''
+    Process {pid} tried to publish to the array topic "{self.name}", which is published by process {owner}.
+    Array topics only support one publisher process
+                '''
+                log.error(msg)
+                raise RuntimeError(msg)
+            self.owner.value = pid
+        self.owned_by = pid
+
+    def commit(self, stamp: Optional[int] = None):
+        """
+        Publishes the frame written in the claimed slot
+        @param stamp: Publication time in nanoseconds since the epoch (the current time of the clock by default)
+        @details Observers (tap, tracing...) receive a read-only view of the slot, they have to copy what they keep
+        """
+        seq = int(self.header[0]) + 1
+        slot = (seq - 1) % self.slots
+        stamp = clock.get_clock().stamp() if stamp is None else stamp
+        self.header[2 + SLOT_HEADER_FIELDS * slot] = stamp
+        self.header[1 + SLOT_HEADER_FIELDS * slot] = seq
+        self.header[0] = seq
+        for wakeup in self.wakeups:
+            try:
+                wakeup.release()
+            except ValueError:
+                pass # The reader has not consumed its previous notification yet
+        if pubsub.observers:
+            ctx = MessageContext(stamp, self.name)
+            for observer in pubsub.observers:
+                observer(self.name, self.readonly_views[slot], ctx)
+
+    def publish(
+            self,
+            data: Any,
+            block: bool = False,
+            timeout: Optional[float] = None,
+            stamp: Optional[int] = None
+        ) -> PublishStatus:
+        """
+        Copies an array into the next slot of the ring and publishes it
+        @param data: The array to publish (it must have the shape of the topic)
+        @param block: Ignored, the ring never waits for its subscribers (they skip the overwritten frames)
+        @param timeout: Ignored
+        @param stamp: Publication time in nanoseconds since the epoch (the current time of the clock by default)
+        @return: The state of the subscribers (array topics never run out of credits)
+        """
+        if not isinstance(data, np.ndarray) or data.shape != self.shape:
+            msg = f'''
+    Tried to publish "{type(data)}" with shape "{getattr(data, 'shape', None)}" to the array topic "{self.name}".
+    The arrays of the topic have shape "{self.shape}" and type "{self.dtype}"
+            '''
+            log.error(msg)
+            raise TypeError(msg)
+
+        np.copyto(self.claim(), data, casting='same_kind')
+        self.commit(stamp)
+        return PublishStatus()
+
+    def subscribe(self, callback: Callable[[Any, MessageContext], None], flow: Optional[FlowControl] = None):
+        """
+        Array topics don't have callbacks, subscribers register with add_reader() and read the frames with frames()
+        """
+        msg = f'''
+    Array topic "{self.name}" can only be read with frames()
+        '''
+        log.error(msg)
+        raise TypeError(msg)
+
+    def add_reader(self) -> int:
+        """
+        Registers a reader of the topic
+        @return: Index of the reader, to be passed to frames()
+        @details Readers have to be registered before the processes that publish are launched
+        """
+        wakeup = multiprocessing.BoundedSemaphore(1)
+        wakeup.acquire()
+        self.wakeups.append(wakeup)
+        self.dropped.append(multiprocessing.Value('Q', 0, lock=False))
+        return len(self.wakeups) - 1
+
+    def dropped_frames(self, reader: Optional[int] = None) -> int:
+        """
+        Gets the number of frames overwritten before being read
+        @param reader: Index of the reader (None adds the frames dropped by all the readers)
+        @details Every reader counts its own frames in shared memory, any process can read them
+        """
+        counters = self.dropped if reader is None else [self.dropped[reader]]
+        return sum(counter.value for counter in counters)
+
+    def slot_seq(self, seq: int) -> int:
+        """
+        Gets the sequence number of the frame stored in the slot of a sequence
+        @param seq: The sequence number
+        """
+        return int(self.header[1 + SLOT_HEADER_FIELDS * ((seq - 1) % self.slots)])
+
+    def frames(self, reader: int, timeout: float = 0.5) -> Iterator[Optional[Tuple[ArrayFrame, MessageContext]]]:
+        """
+        Iterates over the frames published from now on
+        @param reader: Index of the reader (returned by add_reader)
+        @param timeout: Seconds to wait for a frame before yielding None (to let the reader check if it has to stop)
+        @details
+        Frames overwritten before being read are skipped and counted (see dropped_frames)
+        """
+        wakeup = self.wakeups[reader]
+        dropped = self.dropped[reader]
+        last = int(self.header[0])
+        while True:
+            current = int(self.header[0])
+            if current == last:
+                # A notification of frames that were already read only makes the header be checked again
+                if not wakeup.acquire(True, timeout):
+                    yield None
+                continue
+
+            oldest = max(last + 1, current - self.slots + 1)
+            dropped.value += oldest - (last + 1)
+            for seq in range(oldest, current + 1):
+                slot = (seq - 1) % self.slots
+                stamp = int(self.header[2 + SLOT_HEADER_FIELDS * slot])
+                if self.slot_seq(seq) != seq:
+                    dropped.value += 1 # Overwritten while delivering the previous frames
+                    continue
+                yield (
+                    ArrayFrame(self, self.readonly_views[slot], seq),
+                    MessageContext(stamp, self.name)
+                )
+            last = current
+
+    def close(self):
+        """
+        Releases the shared memory ring
+        """
+        self.views.clear()
+        self.readonly_views.clear()
+        del self.header
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,502 @@
+from collections import deque
+from threading import Condition, Thread
+from typing import Any, Callable, Deque, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import socket
+import struct
+import time
+import traceback
+import zlib
+from .router import normalize
+
+log = logging.getLogger('egoros')
+
+# Frames are prefixed with the payload length, a flags byte and the HMAC of the flags and the payload
+DIGEST = hashlib.sha256
+DIGEST_SIZE = DIGEST().digest_size
+FRAME_HEADER = struct.Struct(f'<IB{DIGEST_SIZE}s')
+FLAG_COMPRESSED = 1
+# Maximum payload that fits in a single UDP datagram
+MAX_DATAGRAM = 65000
+
+
+def parse_endpoint(endpoint: str) -> Tuple[str, Any]:
+    """
+    Parses a bridge endpoint
+    @param endpoint: Endpoint with the form tcp://host:port, udp://host:port or unix:///path/to/socket
+    @return: The (scheme, address) pair, where address is ready to be used with a socket
+    """
+    url = urlparse(endpoint)
+    if url.scheme in ('tcp', 'udp'):
+        if url.hostname is None or url.port is None:
+            raise ValueError(f'Endpoint "{endpoint}" needs a host and a port')
+        return url.scheme, (url.hostname, url.port)
+    elif url.scheme == 'unix':
+        return url.scheme, url.path
+
+    raise ValueError(f'Unsupported scheme "{url.scheme}" for bridge endpoint "{endpoint}" (use tcp, udp or unix)')
+
+def create_socket(scheme: str) -> socket.socket:
+    """
+    Creates the socket used for a scheme
+    @param scheme: tcp, udp or unix
+    """
+    if scheme == 'tcp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    elif scheme == 'udp':
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+def check_authkey(authkey: bytes) -> bytes:
+    """
+    Validates the key shared by the senders and the receivers of a bridge
+    @param authkey: The key
+    @return: The key
+    """
+    if not isinstance(authkey, bytes) or not authkey:
+        msg = f'''
+    Bridges need a non empty authkey (bytes) shared by both ends, got {type(authkey)}
+        '''
+        log.error(msg)
+        raise ValueError(msg)
+    return authkey
+
+def sign(authkey: bytes, flags: int, payload: bytes) -> bytes:
+    """
+    Computes the HMAC of a frame
+    @param authkey: Key shared by the senders and the receivers
+    @param flags: The flags of the frame
+    @param payload: The payload bytes
+    """
+    mac = hmac.new(authkey, bytes([flags]), DIGEST)
+    mac.update(payload)
+    return mac.digest()
+
+def encode_batch(batch: List[Tuple[str, Any, int]], compress_threshold: Optional[int], authkey: bytes) -> bytes:
+    """
+    Serializes a batch of messages into a frame
+    @param batch: List of (topic, value, timestamp) tuples
+    @param compress_threshold: Payloads bigger than this number of bytes are compressed (None disables compression)
+    @param authkey: Key the frame is signed with
+    """
+    payload = pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+    flags = 0
+    if compress_threshold is not None and len(payload) > compress_threshold:
+        payload = zlib.compress(payload, 1)
+        flags |= FLAG_COMPRESSED
+    return FRAME_HEADER.pack(len(payload), flags, sign(authkey, flags, payload)) + payload
+
+def decode_payload(payload: bytes, flags: int, digest: bytes, authkey: bytes) -> List[Tuple[str, Any, int]]:
+    """
+    Authenticates and deserializes the payload of a frame
+    @param payload: The payload bytes
+    @param flags: The flags of the frame
+    @param digest: The HMAC sent with the frame
+    @param authkey: Key shared by the senders and the receivers
+    @details The payload is only unpickled once its HMAC has been checked, unpickling runs arbitrary code
+    """
+    if not hmac.compare_digest(digest, sign(authkey, flags, payload)):
+        raise ValueError('Frame failed authentication (the sender uses a different authkey)')
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    batch = pickle.loads(payload)
+    if not isinstance(batch, list):
+        raise ValueError(f'Frame holds a {type(batch)} instead of a batch of messages')
+    return batch
+
+
+class BridgeSender:
+    """
+    Forwards messages to a remote bridge receiver
+    @details
+    Messages are grouped in batches (sent when batch_size messages are pending or after batch_interval
+    seconds). While the connection is down, up to max_pending messages are kept (older ones are dropped)
+    and the sender tries to reconnect with an exponential backoff. Delivery is at-most-once, the
+    batch being written when a connection breaks may be lost.
+    Frames are signed with an HMAC of the authkey, receivers discard the frames they can't authenticate.
+    """
+
+    def __init__(
+            self,
+            endpoint: str,
+            topics: Iterable[str],
+            authkey: bytes,
+            batch_size: int = 64,
+            batch_interval: float = 0.005,
+            compress_threshold: Optional[int] = None,
+            max_pending: int = 10000,
+            max_backoff: float = 5.0
+        ) -> None:
+        """
+        Constructor for the BridgeSender class
+        @param endpoint: Endpoint of the receiver (tcp://host:port, udp://host:port or unix:///path)
+        @param topics: Allow-list of the forwarded topics
+        @param authkey: Key shared with the receiver, frames are signed with it
+        @param batch_size: Maximum number of messages sent in a frame
+        @param batch_interval: Maximum seconds a message waits to be batched
+        @param compress_threshold: Frames bigger than this number of bytes are compressed with zlib (None disables it)
+        @param max_pending: Maximum number of messages kept while the connection is down
+        @param max_backoff: Maximum seconds between reconnection attempts
+        """
+        self.scheme, self.address = parse_endpoint(endpoint)
+        self.endpoint = endpoint
+        self.topics = set(normalize(topic) for topic in topics)
+        self.authkey = check_authkey(authkey)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.compress_threshold = compress_threshold
+        self.max_backoff = max_backoff
+        self.pending: Deque[Tuple[str, Any, int]] = deque(maxlen=max_pending)
+        self.condition = Condition()
+        self.sock: Optional[socket.socket] = None
+        self.running = False
+        self.sent = 0
+        self.dropped = 0
+
+    def forward(self, topic: str, value: Any, timestamp: int):
+        """
+        Queues a message to be forwarded (messages of topics outside of the allow-list are ignored)
+        @param topic: The topic of the message
+        @param value: The message value
+        @param timestamp: Publication time of the message (nanoseconds since the epoch)
+        """
+        if topic not in self.topics:
+            return
+
+        with self.condition:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append((topic, value, timestamp))
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def start(self):
+        """
+        Starts the sender thread
+        """
+        self.running = True
+        Thread(target=self.__sender_worker, daemon=True).start()
+
+    def stop(self):
+        """
+        Stops the sender thread
+        """
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+
+    def __connect(self):
+        """
+        Connects with the receiver, retrying with an exponential backoff until it succeeds
+        """
+        backoff = 0.05
+        while self.running:
+            sock = create_socket(self.scheme)
+            try:
+                sock.connect(self.address)
+                log.info(f'Bridge connected to {self.endpoint}')
+                self.sock = sock
+                return
+            except OSError as e:
+                sock.close()
+                log.debug(f'Bridge could not connect to {self.endpoint} ({e}), retrying in {backoff}s')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def __sender_worker(self):
+        """
+        Worker function that sends the batches
+        """
+        while self.running:
+            with self.condition:
+                if len(self.pending) < self.batch_size:
+                    self.condition.wait(self.batch_interval)
+                batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+
+            if not batch:
+                continue
+
+            while self.running:
+                if self.sock is None:
+                    self.__connect()
+                    continue
+                try:
+                    self.__send(batch)
+                    self.sent += len(batch)
+                    break
+                except OSError as e:
+                    log.warning(f'Bridge connection with {self.endpoint} lost ({e}), reconnecting...')
+                    self.sock.close()
+                    self.sock = None
+
+        if self.sock is not None:
+            self.sock.close()
+
+    def __send(self, batch: List[Tuple[str, Any, int]]):
+        """
+        Sends a batch through the socket
+        @param batch: List of (topic, value, timestamp) tuples
+        """
+        frame = encode_batch(batch, self.compress_threshold, self.authkey)
+        if self.scheme != 'udp':
+            self.sock.sendall(frame)
+        elif len(frame) <= MAX_DATAGRAM:
+            self.sock.send(frame)
+        elif len(batch) > 1:
+            # Split batches that don't fit in a datagram
+            self.__send(batch[:len(batch) // 2])
+            self.__send(batch[len(batch) // 2:])
+        else:
+            self.dropped += 1
+            log.warning(f'Message of topic "{batch[0][0]}" is too big to be bridged through UDP ({len(frame)} bytes)')
+
+
+class BridgeReceiver:
+    """
+    Receives the messages forwarded by remote bridge senders
+    @details
+    Frames that can't be authenticated with the authkey or decoded are discarded (and counted in malformed),
+    they are never unpickled.
+    """
+
+    def __init__(
+            self,
+            endpoint: str,
+            topics: Iterable[str],
+            authkey: bytes,
+            publish: Callable[[str, Any, int], None]
+        ) -> None:
+        """
+        Constructor for the BridgeReceiver class
+        @param endpoint: Endpoint where the receiver listens (tcp://host:port, udp://host:port or unix:///path)
+        @param topics: Allow-list of the accepted topics (messages of other topics are discarded)
+        @param authkey: Key shared with the senders, used to authenticate the frames
+        @param publish: Function called with (topic, value, timestamp) for every received message
+        """
+        self.scheme, self.address = parse_endpoint(endpoint)
+        self.endpoint = endpoint
+        self.topics = set(normalize(topic) for topic in topics)
+        self.authkey = check_authkey(authkey)
+        self.publish = publish
+        self.received = 0
+        self.rejected = 0
+        self.malformed = 0
+        self.closed = False
+        self.connections: List[socket.socket] = []
+        self.sock = create_socket(self.scheme)
+        if self.scheme == 'tcp':
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        elif self.scheme == 'unix' and os.path.exists(self.address):
+            os.remove(self.address) # Left behind by a previous run
+        self.sock.bind(self.address)
+        if self.scheme != 'udp':
+            self.sock.listen()
+
+    def start(self):
+        """
+        Starts receiving in a background thread
+        """
+        target = self.__datagram_worker if self.scheme == 'udp' else self.__accept_worker
+        Thread(target=target, daemon=True).start()
+
+    def close(self):
+        """
+        Stops receiving, closing the connections with the senders
+        """
+        self.closed = True
+        for sock in [self.sock, *self.connections]:
+            try:
+                sock.shutdown(socket.SHUT_RDWR) # Wakes up the threads blocked on the socket
+            except OSError:
+                pass
+            sock.close()
+
+    def __dispatch(self, payload: bytes, flags: int, digest: bytes, source: Any):
+        """
+        Publishes the allowed messages of a frame
+        @param payload: The payload bytes of the frame
+        @param flags: The flags of the frame
+        @param digest: The HMAC sent with the frame
+        @param source: Address of the sender (for the logs)
+        """
+        try:
+            batch = decode_payload(payload, flags, digest, self.authkey)
+            messages = [(topic, value, int(timestamp)) for topic, value, timestamp in batch]
+        except Exception as e:
+            self.malformed += 1
+            log.warning(f'Bridge {self.endpoint} discarded a frame from {source or "a local sender"}: {e}')
+            return
+
+        for topic, value, timestamp in messages:
+            if topic not in self.topics:
+                self.rejected += 1
+                continue
+            self.received += 1
+            try:
+                self.publish(topic, value, timestamp)
+            except Exception:
+                log.warning(f'''
+    Bridge {self.endpoint} could not publish a message of topic "{topic}"
+    Exception:
+        {traceback.format_exc()}
+                ''')
+
+    def __accept_worker(self):
+        """
+        Worker function that accepts the connections of the senders
+        """
+        while True:
+            try:
+                conn, source = self.sock.accept()
+            except OSError:
+                break # Socket was closed
+
+            self.connections.append(conn)
+            Thread(target=self.__stream_worker, args=[conn, source], daemon=True).start()
+
+    def __stream_worker(self, conn: socket.socket, source: Any):
+        """
+        Worker function that reads the frames of a stream connection
+        @param conn: Connection with a sender
+        @param source: Address of the sender
+        """
+        with conn:
+            stream = conn.makefile('rb')
+            while True:
+                header = stream.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break # Sender disconnected
+                length, flags, digest = FRAME_HEADER.unpack(header)
+                payload = stream.read(length)
+                if len(payload) < length:
+                    break
+                self.__dispatch(payload, flags, digest, source)
+        self.connections.remove(conn)
+
+    def __datagram_worker(self):
+        """
+        Worker function that reads the frames received through UDP
+        """
+        while True:
+            try:
+                datagram, source = self.sock.recvfrom(MAX_DATAGRAM + FRAME_HEADER.size)
+            except OSError:
+                break # Socket was closed
+
+            if self.closed:
+                break # Socket was shut down
+            if len(datagram) < FRAME_HEADER.size:
+                self.malformed += 1
+                log.warning(f'Bridge {self.endpoint} discarded a datagram of {len(datagram)} bytes from {source}')
+                continue
+            length, flags, digest = FRAME_HEADER.unpack_from(datagram)
+            payload = datagram[FRAME_HEADER.size:]
+            if len(payload) != length:
+                self.malformed += 1
+                log.warning(f'Bridge {self.endpoint} discarded a truncated datagram from {source}')
+                continue
+            self.__dispatch(payload, flags, digest, source)
+
+
+def forward(node, endpoint: str, topics: Iterable[str], authkey: bytes, **kwargs) -> BridgeSender:
+    """
+    Forwards topics of the instance to a remote bridge receiver
+    @param node: The EgoNode hosting the bridge (call it from the init method of the node)
+    @param endpoint: Endpoint of the receiver (tcp://host:port, udp://host:port or unix:///path)
+    @param topics: Topics to forward
+    @param authkey: Key shared with the receiver
+    @param kwargs: Extra arguments for BridgeSender (batching, compression...)
+    @return: The bridge sender
+    """
+    topics = list(topics)
+    sender = BridgeSender(endpoint, topics, authkey, **kwargs)
+    for topic in topics:
+        node.subscribe(topic, lambda msg, ctx, topic=topic: sender.forward(topic, msg, ctx.stamp))
+    node.add_worker(sender.start)
+    return sender
+
+def receive(node, endpoint: str, topics: Iterable[str], authkey: bytes) -> BridgeReceiver:
+    """
+    Publishes in the instance the topics received from remote bridge senders
+    @param node: The EgoNode hosting the bridge (call it from the init method of the node)
+    @param endpoint: Endpoint where the receiver listens (tcp://host:port, udp://host:port or unix:///path)
+    @param topics: Topics accepted from the senders
+    @param authkey: Key shared with the senders
+    @return: The bridge receiver
+    @details
+    Messages keep the timestamp they were published with in the sending instance.
+    Forwarding a received topic back through another bridge creates a loop, avoid it
+    """
+    receiver = BridgeReceiver(
+        endpoint,
+        topics,
+        authkey,
+        lambda topic, value, timestamp: node.publish(topic, value, stamp=timestamp)
+    )
+    node.add_worker(receiver.start)
+    return receiver
+
+
+if __name__ == "__main__":
+    # Loopback test of the bridge through every transport
+    import tempfile
+
+    authkey = os.urandom(32)
+    for endpoint in ['tcp://127.0.0.1:7411', 'udp://127.0.0.1:7412', f'unix://{tempfile.mkdtemp()}/bridge.sock']:
+        received = []
+        receiver = BridgeReceiver(endpoint, ['odom'], authkey, lambda topic, value, timestamp: received.append(value))
+        receiver.start()
+        sender = BridgeSender(endpoint, ['odom', 'lidar'], authkey, compress_threshold=256)
+        sender.start()
+        for i in range(1000):
+            sender.forward('odom', i, time.time_ns())
+            sender.forward('lidar', bytes(1024), time.time_ns())
+        time.sleep(0.5)
+        # Frames signed with another key and garbage are discarded without stopping the receiver
+        intruder = BridgeSender(endpoint, ['odom'], b'wrong key')
+        intruder.start()
+        intruder.forward('odom', -1, time.time_ns())
+        if endpoint.startswith('udp'):
+            garbage = create_socket('udp')
+            garbage.sendto(b'\0', receiver.address)
+            garbage.sendto(bytes(FRAME_HEADER.size + 8), receiver.address)
+            garbage.close()
+        time.sleep(0.2)
+        sender.forward('odom', 1000, time.time_ns())
+        time.sleep(0.2)
+        intruder.stop()
+        sender.stop()
+        receiver.close()
+        print(
+            f'{endpoint}: received {len(received)} messages, rejected {receiver.rejected}, '
+            f'malformed {receiver.malformed}'
+        )
+        if endpoint.startswith('unix'):
+            os.remove(receiver.address)
+
+    # Reconnection after the receiver restarts
+    endpoint = 'tcp://127.0.0.1:7413'
+    received = []
+    sender = BridgeSender(endpoint, ['odom'], authkey)
+    sender.start()
+    for i in range(100):
+        sender.forward('odom', i, time.time_ns())
+    time.sleep(0.2)
+    receiver = BridgeReceiver(endpoint, ['odom'], authkey, lambda topic, value, timestamp: received.append(value))
+    receiver.start()
+    time.sleep(0.5)
+    receiver.close()
+    receiver = BridgeReceiver(endpoint, ['odom'], authkey, lambda topic, value, timestamp: received.append(value))
+    receiver.start()
+    for i in range(100):
+        sender.forward('odom', i, time.time_ns())
+        time.sleep(0.01)
+    time.sleep(0.5)
+    print(f'{endpoint} (reconnecting): received {len(received)} messages')
@@ -0,0 +1,241 @@
+from typing import Any, Optional, Tuple
+import logging
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+log = logging.getLogger('egoros')
+
+MAGIC = b'EGCK'
+# Magic, slot size
+FILE_HEADER = struct.Struct('<4sQ')
+# Sequence, payload length, payload crc32
+SLOT_HEADER = struct.Struct('<QQI')
+PAGE_SIZE = mmap.PAGESIZE
+
+
+class CheckpointFile:
+    """
+    Memory-mapped file with the two latest checkpoints of a node
+    @details
+    Checkpoints are written alternately into two slots (A/B), so a crash while writing one of them
+    never loses the previous checkpoint. Slots are only modified in the pages that changed since the
+    checkpoint they overwrite, so the kernel only writes back those pages.
+    Slots grow by writing a new file with the latest checkpoint and replacing the old one, so a crash
+    while growing leaves the old file as it was. Other processes map the new file on their next access.
+    """
+
+    def __init__(self, path: str, slot_size: int = 1 << 16) -> None:
+        """
+        Constructor for the CheckpointFile class
+        @param path: Path of the file (it's created if it does not exist)
+        @param slot_size: Initial size of every slot in bytes (slots grow with the checkpoints)
+        """
+        self.path = path
+        self.last_crc: Optional[int] = None
+        if os.path.exists(path) and os.path.getsize(path) >= FILE_HEADER.size:
+            with open(path, 'rb') as file:
+                magic, _ = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+            if magic == MAGIC:
+                self.__map()
+                return
+            log.warning(f'Checkpoint file {path} is not valid, creating it again')
+
+        self.__create(slot_size)
+
+    def __slot_offset(self, slot: int) -> int:
+        """
+        Gets the position of a slot in the file
+        @param slot: The slot (0 or 1)
+        """
+        return PAGE_SIZE + slot * (PAGE_SIZE + self.slot_size)
+
+    def __create(self, slot_size: int, latest: Tuple[int, Optional[bytes]] = (0, None)):
+        """
+        Creates the checkpoint file, replacing the existing one at once
+        @param slot_size: Size of every slot in bytes
+        @param latest: Sequence and payload of the checkpoint stored in the first slot (None for an empty file)
+        """
+        slot_size = -(-slot_size // PAGE_SIZE) * PAGE_SIZE
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.truncate(PAGE_SIZE + 2 * (PAGE_SIZE + slot_size))
+                file.write(FILE_HEADER.pack(MAGIC, slot_size))
+                seq, payload = latest
+                if payload is not None:
+                    file.seek(PAGE_SIZE)
+                    file.write(SLOT_HEADER.pack(seq, len(payload), zlib.crc32(payload)))
+                    file.seek(2 * PAGE_SIZE)
+                    file.write(payload)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.__map()
+
+    def __map(self):
+        """
+        Maps the checkpoint file, with the slot size stored in its header
+        """
+        self.file = open(self.path, 'r+b')
+        self.slot_size = FILE_HEADER.unpack(self.file.read(FILE_HEADER.size))[1]
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def refresh(self) -> bool:
+        """
+        Maps the file again if another process replaced it (to grow its slots)
+        @return: True if the file was mapped again
+        """
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+        if not replaced:
+            return False
+        self.close()
+        self.__map()
+        self.last_crc = None
+        return True
+
+    def __read_slot(self, slot: int) -> Tuple[int, Optional[bytes]]:
+        """
+        Reads a slot
+        @param slot: The slot (0 or 1)
+        @return: The sequence of the slot and its payload (None if the slot is empty or corrupted)
+        """
+        offset = self.__slot_offset(slot)
+        seq, length, crc = SLOT_HEADER.unpack_from(self.map, offset)
+        if seq == 0 or length > self.slot_size:
+            return 0, None
+        payload = self.map[offset + PAGE_SIZE:offset + PAGE_SIZE + length]
+        if zlib.crc32(payload) != crc:
+            return 0, None
+        return seq, payload
+
+    def latest(self) -> Tuple[int, Optional[bytes]]:
+        """
+        Reads the latest valid checkpoint
+        @return: The sequence of the checkpoint and its payload (None if there are no checkpoints)
+        """
+        return max((self.__read_slot(slot) for slot in (0, 1)), key=lambda read: read[0])
+
+    def write(self, payload: bytes) -> bool:
+        """
+        Writes a checkpoint into the oldest slot
+        @param payload: The checkpoint
+        @return: False if the checkpoint did not change since the last one (nothing is written)
+        """
+        crc = zlib.crc32(payload)
+        if crc == self.last_crc:
+            return False
+
+        if len(payload) > self.slot_size:
+            self.__grow(len(payload))
+
+        sequences = [self.__read_slot(slot)[0] for slot in (0, 1)]
+        slot = 0 if sequences[0] <= sequences[1] else 1
+        offset = self.__slot_offset(slot) + PAGE_SIZE
+
+        # Only the pages that changed are touched
+        for start in range(0, len(payload), PAGE_SIZE):
+            page = payload[start:start + PAGE_SIZE]
+            if self.map[offset + start:offset + start + len(page)] != page:
+                self.map[offset + start:offset + start + len(page)] = page
+
+        # The header is written last, a torn write leaves the slot invalid instead of corrupted
+        SLOT_HEADER.pack_into(self.map, offset - PAGE_SIZE, max(sequences) + 1, len(payload), crc)
+        self.map.flush()
+        self.last_crc = crc
+        return True
+
+    def __grow(self, needed: int):
+        """
+        Creates the file again with bigger slots, keeping the latest checkpoint
+        @param needed: Minimum size of the slots
+        """
+        latest = self.latest()
+        slot_size = self.slot_size
+        while slot_size < needed:
+            slot_size *= 2
+        # The old file stays mapped until the new one replaces it (it's kept if growing fails)
+        previous_map, previous_file = self.map, self.file
+        self.__create(slot_size, latest)
+        previous_map.close()
+        previous_file.close()
+        self.last_crc = None
+
+    def close(self):
+        """
+        Unmaps the file
+        """
+        self.map.close()
+        self.file.close()
+
+
+class Checkpointer:
+    """
+    Takes the checkpoints of a node and restores them
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Constructor for the Checkpointer class
+        @param path: Path of the checkpoint file of the node
+        """
+        self.path = path
+        self.file: Optional[CheckpointFile] = None
+        self.file_pid: Optional[int] = None
+
+    def __open(self) -> CheckpointFile:
+        """
+        Opens the checkpoint file in the current process
+        """
+        # Mappings are not shared with the forked workers, every process maps the file again
+        if self.file is None or self.file_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.file = CheckpointFile(self.path)
+            self.file_pid = os.getpid()
+        else:
+            # Another worker may have grown the file since it was mapped
+            self.file.refresh()
+        return self.file
+
+    def save(self, state: Any) -> bool:
+        """
+        Writes a checkpoint of the state of the node
+        @param state: The state returned by the get_state hook of the node
+        @return: False if the state did not change since the last checkpoint
+        """
+        return self.__open().write(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+    def load(self) -> Tuple[bool, Any]:
+        """
+        Reads the latest checkpoint
+        @return: Whether there is a checkpoint and the stored state
+        """
+        if not os.path.exists(self.path):
+            return False, None
+        seq, payload = self.__open().latest()
+        if payload is None:
+            return False, None
+        try:
+            return True, pickle.loads(payload)
+        except Exception as e:
+            log.warning(f'Checkpoint {seq} of {self.path} could not be loaded: {e}')
+            return False, None
+
+
+if __name__ == "__main__":
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'node.ckpt')
+    checkpointer = Checkpointer(path)
+    checkpointer.save({'map': list(range(10)), 'calibration': 1.5})
+    checkpointer.save({'map': list(range(100000)), 'calibration': 2.5})
+    print(checkpointer.save({'map': list(range(100000)), 'calibration': 2.5})) # Unchanged
+    print(Checkpointer(path).load()[1]['calibration'])
@@ -0,0 +1,330 @@
+from collections import deque
+import argparse
+import ast
+import pickle
+import statistics
+import time
+from typing import Any, Deque, Optional
+from . import utils
+from .params import ParameterServer
+from .tap import TapClient
+from . import soak
+
+
+def parse_value(text: str) -> Any:
+    """
+    Parses a value written in the command line
+    @param text Text of the value
+    @return The python literal represented by the text (or the text itself if it's not a literal)
+    """
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+def add_param_parser(subparsers):
+    """
+    Adds the "param" command to the command line parser
+    @param subparsers Subparsers of the main parser
+    """
+    parser = subparsers.add_parser(
+        'param',
+        help='Reads and modifies the parameters of a running instance'
+    )
+    parser.add_argument(
+        '-i', '--instance',
+        type=int,
+        help='Process id of the instance (default: the latest running instance)'
+    )
+    actions = parser.add_subparsers(dest='action', required=True)
+    actions.add_parser('list', help='Lists all the parameters')
+    get = actions.add_parser('get', help='Prints the value of a parameter')
+    get.add_argument('name')
+    set = actions.add_parser('set', help='Sets the value of a parameter')
+    set.add_argument('name')
+    set.add_argument('value', help='Python literal (strings can be written without quotes)')
+    parser.set_defaults(handler=param_command)
+
+def add_record_parser(subparsers):
+    """
+    Adds the "record" command to the command line parser
+    @param subparsers Subparsers of the main parser
+    """
+    parser = subparsers.add_parser(
+        'record',
+        help='Records topics of a running instance (through its tap server)'
+    )
+    parser.add_argument('topics', nargs='+', help='Topics to record')
+    parser.add_argument(
+        '-o', '--output',
+        required=True,
+        help='File where the (topic, value, timestamp) tuples are pickled one after another'
+    )
+    parser.add_argument('-i', '--instance', type=int, help='Process id of the instance (default: the latest running instance)')
+    parser.add_argument('-d', '--decimation', type=int, default=1, help='Records one out of every N messages')
+    parser.add_argument('-m', '--max-rate', type=float, help='Maximum recorded messages per second (per topic)')
+    parser.add_argument('-f', '--fields', help='Comma separated fields to record (for example "pose.x,pose.y")')
+    parser.add_argument('-t', '--duration', type=float, help='Seconds to record (default: until interrupted)')
+    parser.set_defaults(handler=record_command)
+
+def add_topic_parser(subparsers):
+    """
+    Adds the "topic" command to the command line parser
+    @param subparsers Subparsers of the main parser
+    """
+    parser = subparsers.add_parser(
+        'topic',
+        help='Inspects the topics of a running instance (through its tap server)'
+    )
+    parser.add_argument('-i', '--instance', type=int, help='Process id of the instance (default: the latest running instance)')
+    actions = parser.add_subparsers(dest='action', required=True)
+    actions.add_parser('list', help='Lists all the topics')
+    echo = actions.add_parser('echo', help='Prints the messages of a topic')
+    echo.add_argument('topic')
+    echo.add_argument('-f', '--fields', help='Comma separated fields to print (for example "pose.x,pose.y")')
+    echo.add_argument('-n', '--count', type=int, help='Number of messages to print (default: until interrupted)')
+    hz = actions.add_parser('hz', help='Prints the publish rate and jitter of a topic')
+    hz.add_argument('topic')
+    hz.add_argument('-w', '--window', type=int, default=100, help='Number of messages used to measure the rate')
+    bw = actions.add_parser('bw', help='Prints the bandwidth used by a topic')
+    bw.add_argument('topic')
+    bw.add_argument('-w', '--window', type=int, default=100, help='Number of messages used to measure the bandwidth')
+    info = actions.add_parser('info', help='Prints the publishers, the subscribers and the queue depths of a topic')
+    info.add_argument('topic', nargs='?', help='Topic to describe (default: all the topics)')
+    for action in [echo, hz, bw]:
+        action.add_argument('-t', '--duration', type=float, help='Seconds to run (default: until interrupted)')
+    parser.set_defaults(handler=topic_command)
+
+def format_bytes(size: float) -> str:
+    """
+    Formats a size with binary prefixes
+    @param size Size in bytes
+    """
+    for unit in ['B', 'KiB', 'MiB']:
+        if size < 1024:
+            return f'{size:.2f} {unit}'
+        size /= 1024
+    return f'{size:.2f} GiB'
+
+def topic_command(args: argparse.Namespace) -> int:
+    """
+    Runs the "topic" command
+    @param args Parsed command line arguments
+    @return Exit code of the command
+    """
+    client = TapClient(args.instance)
+    try:
+        if args.action == 'list':
+            for topic in client.list_topics():
+                print(topic)
+        elif args.action == 'info':
+            return print_topic_info(client.info(), args.topic)
+        else:
+            fields = args.fields.split(',') if getattr(args, 'fields', None) else None
+            client.subscribe(args.topic, fields=fields)
+            {'echo': echo_topic, 'hz': measure_rate, 'bw': measure_bandwidth}[args.action](client, args)
+        return 0
+    except KeyboardInterrupt:
+        return 0
+    except (EOFError, ConnectionError):
+        print('Lost the connection with the instance, it has probably exited')
+        return 1
+    finally:
+        client.close()
+
+def print_topic_info(described: dict, topic: Optional[str]) -> int:
+    """
+    Prints the publishers and the subscribers of the topics
+    @param described Description of the topics sent by the tap server
+    @param topic Topic to print (None prints all of them)
+    @return Exit code of the command
+    """
+    if topic is not None:
+        if topic not in described:
+            print(f'Topic "{topic}" does not exist')
+            return 1
+        described = {topic: described[topic]}
+
+    for name, info in sorted(described.items()):
+        print(f'{name} ({info["type"] or "unknown type"})')
+        print('  Publishers:')
+        for publisher in info['publishers'] or ['(none declared)']:
+            print(f'    {publisher}')
+        print('  Subscribers:')
+        if not info['subscribers']:
+            print('    (none)')
+        for subscriber, depth in info['subscribers'].items():
+            print(f'    {subscriber} ({"?" if depth is None else depth} queued)')
+    return 0
+
+def receive_until(client: TapClient, duration: Optional[float]):
+    """
+    Yields the messages received from the tap server
+    @param client Connected tap client
+    @param duration Seconds to receive (None receives until interrupted)
+    @return Generator of (topic, value, timestamp) tuples, None every 0.1 s without messages
+    """
+    end = None if duration is None else time.monotonic() + duration
+    while end is None or time.monotonic() < end:
+        yield client.receive(timeout=0.1)
+
+def echo_topic(client: TapClient, args: argparse.Namespace):
+    """
+    Prints the messages of the subscribed topic
+    @param client Connected tap client
+    @param args Parsed command line arguments
+    """
+    printed = 0
+    for message in receive_until(client, args.duration):
+        if message is None:
+            continue
+        _, value, timestamp = message
+        print(f'[{timestamp:.6f}] {value!r}')
+        printed += 1
+        if args.count is not None and printed >= args.count:
+            break
+
+def measure_rate(client: TapClient, args: argparse.Namespace):
+    """
+    Prints the publish rate of the subscribed topic, measured with the publication timestamps
+    @param client Connected tap client
+    @param args Parsed command line arguments
+    """
+    intervals: Deque[float] = deque(maxlen=args.window)
+    last: Optional[float] = None
+    next_report = time.monotonic() + 1.0
+    for message in receive_until(client, args.duration):
+        if message is not None:
+            timestamp = message[2]
+            if last is not None:
+                intervals.append(timestamp - last)
+            last = timestamp
+
+        if time.monotonic() >= next_report:
+            next_report += 1.0
+            if len(intervals) < 2:
+                print('no new messages')
+                continue
+            mean = statistics.fmean(intervals)
+            print(
+                f'average rate: {1.0 / mean:.3f} Hz\n'
+                f'\tmin: {min(intervals):.4f} s max: {max(intervals):.4f} s '
+                f'jitter: {statistics.stdev(intervals):.5f} s window: {len(intervals) + 1}'
+            )
+
+def measure_bandwidth(client: TapClient, args: argparse.Namespace):
+    """
+    Prints the bandwidth used by the subscribed topic (size of the pickled messages)
+    @param client Connected tap client
+    @param args Parsed command line arguments
+    """
+    samples: Deque[tuple] = deque(maxlen=args.window)
+    next_report = time.monotonic() + 1.0
+    for message in receive_until(client, args.duration):
+        if message is not None:
+            samples.append((message[2], len(pickle.dumps(message[1], pickle.HIGHEST_PROTOCOL))))
+
+        if time.monotonic() >= next_report:
+            next_report += 1.0
+            if len(samples) < 2:
+                print('no new messages')
+                continue
+            elapsed = samples[-1][0] - samples[0][0]
+            sizes = [size for _, size in samples]
+            rate = sum(sizes[1:]) / elapsed if elapsed > 0 else 0.0
+            print(
+                f'average: {format_bytes(rate)}/s\n'
+                f'\tmean: {format_bytes(statistics.fmean(sizes))} min: {format_bytes(min(sizes))} '
+                f'max: {format_bytes(max(sizes))} window: {len(samples)}'
+            )
+
+def add_soak_parser(subparsers):
+    """
+    Adds the "soak" command to the command line parser
+    @param subparsers Subparsers of the main parser
+    """
+    parser = subparsers.add_parser(
+        'soak',
+        help='Runs fleets of synthetic nodes of increasing size and reports how the instance scales'
+    )
+    parser.add_argument('-n', '--sizes', default='1,10,25,50,100,200', help='Comma separated number of nodes of every run')
+    parser.add_argument('-t', '--duration', type=float, default=10, help='Seconds measured in every run')
+    parser.add_argument('-w', '--warmup', type=float, default=2, help='Seconds ignored at the start of every run')
+    parser.add_argument('-r', '--rate', type=float, default=10, help='Ticks per second of every node')
+    parser.add_argument('--fan-in', type=int, default=2, help='Topics every node subscribes to')
+    parser.add_argument('--fan-out', type=int, default=1, help='Topics every node publishes')
+    parser.add_argument('--payload', type=int, default=1024, help='Bytes of payload of every message')
+    parser.add_argument('--queue-size', type=int, help='Queue size of the subscriptions (default: unbounded)')
+    parser.set_defaults(handler=soak_command)
+
+def soak_command(args: argparse.Namespace) -> int:
+    """
+    Runs the "soak" command
+    @param args Parsed command line arguments
+    @return Exit code of the command
+    """
+    config = soak.FleetConfig(
+        tick_rate=args.rate,
+        fan_in=args.fan_in,
+        fan_out=args.fan_out,
+        payload=args.payload,
+        queue_size=args.queue_size
+    )
+    print(soak.REPORT_HEADER)
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        report = soak.soak(size, config, args.duration, args.warmup)
+        print(soak.format_report(report), flush=True)
+    return 0
+
+def record_command(args: argparse.Namespace) -> int:
+    """
+    Runs the "record" command
+    @param args Parsed command line arguments
+    @return Exit code of the command
+    """
+    client = TapClient(args.instance)
+    fields = args.fields.split(',') if args.fields else None
+    for topic in args.topics:
+        client.subscribe(topic, decimation=args.decimation, max_rate=args.max_rate, fields=fields)
+
+    recorded = 0
+    end = None if args.duration is None else time.monotonic() + args.duration
+    try:
+        with open(args.output, 'wb') as output:
+            while end is None or time.monotonic() < end:
+                message = client.receive(timeout=0.1)
+                if message is not None:
+                    pickle.dump(message, output)
+                    recorded += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+    print(f'Recorded {recorded} messages into "{args.output}"')
+    return 0
+
+def param_command(args: argparse.Namespace) -> int:
+    """
+    Runs the "param" command
+    @param args Parsed command line arguments
+    @return Exit code of the command
+    """
+    pid = args.instance if args.instance is not None else utils.find_instance_pid()
+    params = ParameterServer(utils.get_runtime_dir(pid), pid)
+    try:
+        if args.action == 'list':
+            for name, value in sorted(params.items().items()):
+                print(f'{name}: {value!r}')
+        elif args.action == 'get':
+            values = params.items()
+            if args.name not in values:
+                print(f'Parameter "{args.name}" is not defined')
+                return 1
+            print(repr(values[args.name]))
+        elif args.action == 'set':
+            version = params.set(args.name, parse_value(args.value))
+            print(f'{args.name} = {params.get(args.name)!r} (version {version})')
+        return 0
+    finally:
+        params.close()
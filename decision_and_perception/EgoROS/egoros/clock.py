@@ -0,0 +1,99 @@
+from datetime import datetime
+import time
+
+
+class Clock:
+    """
+    Source of time for the ticks and the message timestamps
+    """
+
+    def now(self) -> float:
+        """
+        Gets the current time
+        @return: Seconds since the epoch
+        """
+        raise NotImplementedError()
+
+    def sleep(self, seconds: float):
+        """
+        Waits for some time to pass
+        @param seconds: Seconds to wait
+        """
+        raise NotImplementedError()
+
+    def stamp(self) -> int:
+        """
+        Gets the current time as an integer (used for the message contexts)
+        @return: Nanoseconds since the epoch
+        """
+        return int(self.now() * 1_000_000_000)
+
+    def timestamp(self) -> datetime:
+        """
+        Gets the current time as a datetime
+        """
+        return datetime.fromtimestamp(self.now())
+
+
+class WallClock(Clock):
+    """
+    Clock following the real time
+    """
+
+    def now(self) -> float:
+        return time.time()
+
+    def stamp(self) -> int:
+        return time.time_ns()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class SimClock(Clock):
+    """
+    Virtual clock that only moves when it's advanced
+    @details Used by the lockstep mode, where the instance decides when time passes
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        """
+        Constructor for the SimClock class
+        @param start: Initial time (seconds since the epoch)
+        """
+        self.current = start
+
+    def now(self) -> float:
+        return self.current
+
+    def sleep(self, seconds: float):
+        """
+        Sleeping would block the simulation forever, nodes must not sleep in lockstep mode
+        """
+        raise RuntimeError('Nodes can not sleep when running with a simulated clock')
+
+    def advance_to(self, t: float):
+        """
+        Moves the clock forward
+        @param t: The new time (it can't be older than the current one)
+        """
+        if t < self.current:
+            raise ValueError(f'Simulated clock can not go back in time (from {self.current} to {t})')
+        self.current = t
+
+
+clock: Clock = WallClock()
+
+def get_clock() -> Clock:
+    """
+    Gets the clock used by the current process
+    """
+    return clock
+
+def set_clock(new_clock: Clock):
+    """
+    Replaces the clock used by the current process
+    @param new_clock: The clock to use
+    """
+    global clock
+    clock = new_clock
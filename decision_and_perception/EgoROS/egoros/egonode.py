@@ -1,10 +1,32 @@
-from threading import Thread
-from typing import Any, Dict, Callable, List
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+from typing import Any, Dict, Callable, List, Optional, Set, Tuple
+from .arraytopic import ArrayTopic
+from .checkpoint import Checkpointer
 from .node import Node
-from .pubsub import Message, MessageContext, Subscription, Topic
+from .offload import OffloadMetrics, OffloadPool
+from .params import ParameterCallbacks, ParameterServer
+from .router import TopicRouter, is_pattern, normalize
+from .pubsub import FlowControl, MessageContext, PublishStatus, Subscription, Topic
+from .service import ServiceClient, ServiceServer, service_address, wait_all
+from .sync import ApproximateTimeSynchronizer
+from .tap import TopicDirectory
+from .timers import Timer, TimerQueue
 import multiprocessing
+import os
+import pickle
 import sys
-import time
+import traceback
+import logging
+from . import clock
+from . import intraprocess
+from . import tracing
+from . import memory
+from . import pubsub
+from . import tickwatch
+from . import zygote
+
+log = logging.getLogger('egoros')
 
 # FIXME: add init call when reloading the node
 class EgoNode:
@@ -12,17 +34,56 @@ class EgoNode:
     
     '''
 
-    def __init__(self, node: Node, topics: Dict[str, Topic]) -> None:
+    def __init__(self, node: Node, topics: TopicRouter, runtime_dir: str, parameters: ParameterServer) -> None:
         """
         Constructor for the EgoNode class
         @param node: The Node object
-        @param topics: A dictionary of topics
+        @param topics: The topics of the instance
+        @param runtime_dir: Runtime folder of the instance (where the services are reachable)
+        @param parameters: Parameter server of the instance
         """
         self.inner_node = node
         self.running = False
         self.topics = topics
+        self.runtime_dir = runtime_dir
+        self.parameters = parameters
+        self.param_callbacks = ParameterCallbacks(parameters)
         self.subscriptions: Dict[str, Subscription] = {}
         self.pending_subscriptions: multiprocessing.Queue[str] = multiprocessing.Queue()
+        self.services: Dict[str, ServiceServer] = {}
+        self.workers: List[Callable[[], None]] = []
+        self.service_client: Optional[ServiceClient] = None
+        self.service_client_pid: Optional[int] = None
+        self.config = None
+        self.fresh_inputs: Set[str] = set()
+        self.inputs_condition = Condition()
+        # When set, messages are handed to the dispatcher instead of the subscription queues (lockstep mode)
+        self.dispatcher: Optional[Callable[['EgoNode', str, Any, MessageContext], None]] = None
+        self.tick_state = tickwatch.TickState()
+        # Restarts come from several monitors of the instance, only one at a time kills and launches the workers
+        self.restart_lock = Lock()
+        self.timers = TimerQueue()
+        # Current tick rate, it can be changed by the governor of the instance while the node runs
+        self.tick_rate = multiprocessing.Value('d', 0.0, lock=False)
+        # Set by the instance when the state of the node is checkpointed
+        self.checkpointer: Optional[Checkpointer] = None
+        self.next_checkpoint = 0.0
+        # Messages published while the instance is starting (None once they are flushed)
+        self.startup_buffer: Optional[List[Tuple[str, Any, bool, Optional[float], Optional[int]]]] = []
+        self.startup_lock = Lock()
+        # Process pool of the instance for CPU-bound work (set by the instance)
+        self.offload_pool: Optional[OffloadPool] = None
+        # Shared record of the topics published by the nodes, read by the tap server (set by the instance)
+        self.directory: Optional[TopicDirectory] = None
+        # Set by the instance when the node shares its worker process with the other nodes of its process group
+        self.group: Optional['ProcessGroup'] = None
+        # Callbacks of the wildcard subscriptions (with their max_age), and the queue that receives the
+        # messages of the matching topics created once the workers are launched
+        self.pattern_subscriptions: List[Tuple[Callable[[Any, MessageContext], None], Optional[float]]] = []
+        self.pattern_inbox: Optional[multiprocessing.Queue] = None
+        # Process where the node is initialized, and whether its workers have been launched from it
+        self.init_pid = os.getpid()
+        self.launched = False
         pass
 
     def launch(self) -> Callable[[], None]:
@@ -30,18 +91,73 @@ class EgoNode:
         Launches the EgoNode
         @return: A callable function to join the processes
         """
-        # Initialize and get configuration
+        self.init()
+        self.flush_startup()
+        return self.start()
+
+    def init(self):
+        """
+        Initializes the node, getting its configuration
+        @return: The configuration of the node (None if the node crashed)
+        """
         # FIXME: if node crashes when initializing, the __tick thread still launches
         self.config = self.inner_node.init(self)
+        if self.config is not None:
+            self.config.publishes = [normalize(topic) for topic in self.config.publishes]
+            self.config.triggered_by = [normalize(topic) for topic in self.config.triggered_by]
+            self.tick_rate.value = self.config.tick_rate
+            self.parameters.set_defaults(self.config.params)
+            # Triggering topics need a subscription to detect new data
+            for topic in self.config.triggered_by:
+                if topic not in self.subscriptions:
+                    self.subscribe(topic, lambda msg, ctx: None)
+
+        return self.config
+
+    def get_tick_rate(self) -> float:
+        """
+        Gets the current tick rate of the node (lowered by the governor when the machine is overloaded)
+        """
+        return self.tick_rate.value
+
+    def is_triggered(self) -> bool:
+        """
+        Checks if the node ticks when its input topics have new data (instead of at a fixed rate)
+        """
+        return self.config is not None and len(self.config.triggered_by) > 0
+
+    def inputs(self) -> List[str]:
+        """
+        Gets the topics read by the node
+        """
+        return list(self.subscriptions.keys())
+
+    def outputs(self) -> List[str]:
+        """
+        Gets the topics published by the node (as declared in its configuration)
+        @details
+        Topics actually published, including the undeclared ones, are recorded in the directory
+        """
+        return [] if self.config is None else list(self.config.publishes)
 
+    def start(self) -> Callable[[], None]:
+        """
+        Starts the processes of an initialized EgoNode
+        @return: A callable function to join the processes
+        """
         self.running = True
+        self.launched = True
 
-        self.ticker_handler = None
-        self.topic_reader_handler = multiprocessing.Process(target=self.__topic_reader_worker)
-        self.topic_reader_handler.start()
-        if self.inner_node.is_tickable():
-            self.ticker_handler = multiprocessing.Process(target=self.__tick_handler)
-            self.ticker_handler.start()
+        self.ticker_handler: Optional[multiprocessing.Process] = None
+        if self.group is not None:
+            # Grouped nodes read their topics and tick from threads of the worker of the group
+            self.topic_reader_handler = self.group.start()
+            return self.topic_reader_handler.join
+
+        self.topic_reader_handler = zygote.spawn_worker(self.__topic_reader_worker, f'{self.config.name}-reader')
+        # Triggered nodes tick from the reader process, right after their inputs are received
+        if self.inner_node.is_tickable() and not self.is_triggered():
+            self.ticker_handler = zygote.spawn_worker(self.__tick_handler, f'{self.config.name}-ticker')
 
         def join():
             self.topic_reader_handler.join()
@@ -55,30 +171,287 @@ class EgoNode:
         Stops the EgoNode
         """
         self.running = False
+        # Workers don't see the flag of this process, they are terminated
+        for handler in [getattr(self, 'topic_reader_handler', None), getattr(self, 'ticker_handler', None)]:
+            if handler is not None and handler.is_alive():
+                handler.terminate()
+
+    def pids(self) -> List[int]:
+        """
+        Gets the process ids of the running workers of the node
+        """
+        handlers = [getattr(self, 'topic_reader_handler', None), getattr(self, 'ticker_handler', None)]
+        return [h.pid for h in handlers if h is not None and h.is_alive()]
+
+    def restart(self):
+        """
+        Kills the worker processes of a started node and launches them again
+        @details
+        The node is not initialized again, the new workers are forked with the state the node had after init.
+        Messages being delivered to the node when it is killed are lost (their credits are given back),
+        the queued ones are delivered by the new workers.
+        Concurrent restarts (from the memory monitor and the watchdog) are serialized.
+        Grouped nodes restart their whole process group
+        """
+        if self.group is not None:
+            self.group.restart()
+            return
+
+        with self.restart_lock:
+            for handler in [self.topic_reader_handler, self.ticker_handler]:
+                if handler is not None:
+                    handler.kill()
+                    handler.join()
 
-    def subscribe(self, topic: str, callback: Callable[[Any, MessageContext], None]):
+            log.warning(f'Restarting node {self.config.name}')
+            self.recover()
+            self.start()
+
+    def recover(self):
+        """
+        Prepares a node whose workers have been killed to be started again
+        """
+        for subscription in self.subscriptions.values():
+            subscription.reset_reader()
+        self.tick_state.reset()
+        # The new workers are forked from this process, they start from the latest checkpoint
+        self.restore()
+
+    def subscribe(
+            self,
+            topic: str,
+            callback: Callable[[Any, MessageContext], None],
+            queue_size: Optional[int] = None,
+            max_age: Optional[float] = None
+        ):
         """
         Subscribes to a topic with a callback function
         @param topic: The topic to subscribe to
         @param callback: The callback function to be triggered when a message is received
+        @param queue_size: Maximum number of messages waiting to be delivered (None for no limit).
+        Publishers see the remaining credits and drop (or wait) when the queue is full.
+        Only the first subscription of the node to a topic sets its size
+        @param max_age: Seconds after its timestamp a message is still delivered (None for no limit).
+        Older messages are dropped without being unpickled, so a node that falls behind catches up right away.
+        Only the first subscription of the node to a topic sets it
+        @details
+        Subscriptions have to be made in init. Topic names are normalized, "/a/b" and "a/b" are the same topic.
+        Topics named with "*" (one level) or "**" (any number of levels) subscribe to every matching topic,
+        including the ones created later. The callback can tell them apart with ctx.topic.
+        The topics created once the node is running (for example published for the first time from a tick)
+        are received through a single queue of the node, without queue_size
         """
+        if is_pattern(topic):
+            if self.pattern_inbox is None:
+                self.pattern_inbox = multiprocessing.Queue()
+            index = len(self.pattern_subscriptions)
+            self.pattern_subscriptions.append((callback, max_age))
+            self.topics.watch(topic, lambda name, _: self.__match_pattern(index, name, queue_size))
+            return
+
+        topic = normalize(topic)
+
         # TODO: move this to a better location
 
-        # Check if topic already exists
-        if not topic in self.topics:
-            self.topics[topic] = Topic(
-                name=topic
-            )
+        # Nodes are initialized in parallel, topics are created and subscribed to under the lock of the router
+        with self.topics.lock:
+            # Check if topic already exists
+            if not topic in self.topics:
+                self.topics[topic] = Topic(
+                    name=topic
+                )
 
-        # Check if subscription context exists
-        if not topic in self.subscriptions:
-            self.subscriptions[topic] = Subscription()
-            # Create new callback 
-            cb = lambda msg, ctx: self.__enqueue_topic(topic, msg, ctx)
-            self.topics[topic].subscribe(cb)
-            self.pending_subscriptions.put(topic)
+            # Check if subscription context exists
+            if not topic in self.subscriptions:
+                # The lockstep dispatcher delivers everything right away, it never needs credits
+                subscription = Subscription(max_age=max_age)
+                if queue_size is not None and self.dispatcher is None:
+                    subscription.flow = FlowControl(queue_size, subscription.reader_pid)
+                flow = subscription.flow
+                self.subscriptions[topic] = subscription
+                # Array topics are read directly from their ring by the subscription worker
+                if not isinstance(self.topics[topic], ArrayTopic):
+                    # Create new callback 
+                    cb = lambda msg, ctx: self.__enqueue_topic(topic, msg, ctx)
+                    self.topics[topic].subscribe(cb, flow)
+                else:
+                    subscription.array_reader = self.topics[topic].add_reader()
+                self.pending_subscriptions.put(topic)
+
+            self.subscriptions[topic].callbacks.append(callback)
 
-        self.subscriptions[topic].callbacks.append(callback)
+    def __match_pattern(self, index: int, topic: str, queue_size: Optional[int]):
+        """
+        Subscribes a wildcard subscription to a topic that matches it
+        @param index: Index of the wildcard subscription
+        @param topic: The matching topic
+        @param queue_size: Queue size of the wildcard subscription
+        @details
+        Topics that exist before the workers of the node are launched get a regular subscription. The ones
+        created later only exist in the process that creates them (usually a worker of their publisher),
+        which forwards their messages to the pattern inbox of the node
+        """
+        callback, max_age = self.pattern_subscriptions[index]
+        if os.getpid() == self.init_pid and not self.launched:
+            self.subscribe(topic, callback, queue_size, max_age)
+            return
+        self.topics[topic].subscribe(lambda msg, ctx: self.pattern_inbox.put((index, msg, ctx)))
+
+    def subscribe_synchronized(
+            self,
+            topics: List[str],
+            callback: Callable[[Tuple[Any, ...], Tuple[MessageContext, ...]], None],
+            slop: float,
+            queue_size: int = 10
+        ) -> ApproximateTimeSynchronizer:
+        """
+        Subscribes to several topics, triggering the callback with sets of messages matched by timestamp
+        @param topics: The topics to subscribe to
+        @param callback: The callback function triggered with the matched values and their contexts (in the order of topics)
+        @param slop: Maximum time difference (in seconds) between the messages of a set
+        @param queue_size: Maximum number of messages buffered for every topic
+        @return: The synchronizer in charge of matching the messages
+        """
+        synchronizer = ApproximateTimeSynchronizer(topics, callback, slop, queue_size)
+        for index, topic in enumerate(topics):
+            self.subscribe(topic, lambda msg, ctx, index=index: synchronizer.add(index, msg, ctx))
+
+        return synchronizer
+
+    def provide_service(self, name: str, handler: Callable[[Any], Any]):
+        """
+        Provides a service that other nodes can call
+        @param name: The name of the service
+        @param handler: The function that receives the request and returns the reply
+        @details The handler runs in the topic reader process of the node
+        """
+        if name in self.services:
+            msg = f'''
+    Service "{name}" is already provided by node {self.inner_node.filename}
+            '''
+            log.error(msg)
+            raise RuntimeError(msg)
+
+        try:
+            self.services[name] = ServiceServer(name, handler, service_address(self.runtime_dir, name))
+        except OSError:
+            msg = f'''
+    Service "{name}" could not be provided by node {self.inner_node.filename}
+    (another node is probably providing it)
+            '''
+            log.error(msg)
+            raise RuntimeError(msg)
+
+    def call(self, name: str, request: Any, timeout: Optional[float] = None) -> Future:
+        """
+        Calls a service provided by a node
+        @param name: The name of the service
+        @param request: The request passed to the service handler
+        @param timeout: Seconds to wait for the reply (None waits forever)
+        @return: A future resolved with the reply of the service
+        """
+        # Connections can't be shared between processes, every process keeps its own client
+        if self.service_client is None or self.service_client_pid != os.getpid():
+            self.service_client = ServiceClient(self.runtime_dir)
+            self.service_client_pid = os.getpid()
+
+        return self.service_client.call(name, request, timeout)
+
+    def call_all(self, requests: List[Tuple[str, Any]], timeout: Optional[float] = None) -> List[Any]:
+        """
+        Calls several services at once and waits for all the replies
+        @param requests: List of (service name, request) pairs
+        @param timeout: Seconds to wait for all the replies (None waits forever)
+        @return: The replies, in the same order as the requests
+        """
+        futures = [self.call(name, request, timeout) for name, request in requests]
+        return wait_all(futures, timeout)
+
+    def offload(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Runs a CPU-bound function in the process pool of the instance, without holding the GIL of the node
+        @param fn: The function (defined at the top of the node module, lambdas and closures can't be offloaded)
+        @param args: Positional arguments of the function
+        @param kwargs: Keyword arguments of the function
+        @return: A future resolved with the result of the function
+        @details
+        Big arrays in the arguments and in the result travel through shared memory instead of being pickled.
+        In lockstep mode (or without a pool) the function runs right away in the calling thread
+        """
+        if self.offload_pool is None or self.dispatcher is not None:
+            future: Future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.offload_pool.submit(fn, *args, **kwargs)
+
+    def offload_metrics(self) -> OffloadMetrics:
+        """
+        Gets the size of the process pool of the instance and the number of functions in every state
+        """
+        if self.offload_pool is None:
+            return OffloadMetrics()
+        return self.offload_pool.metrics()
+
+    def get_param(self, name: str, default: Any = None) -> Any:
+        """
+        Gets the value of a parameter
+        @param name: The name of the parameter
+        @param default: The value returned if the parameter is not defined
+        @details Reading a parameter that did not change since the last read only costs a memory read
+        """
+        return self.parameters.get(name, default)
+
+    def set_param(self, name: str, value: Any):
+        """
+        Sets the value of a parameter for all the nodes
+        @param name: The name of the parameter
+        @param value: The new value of the parameter
+        """
+        self.parameters.set(name, value)
+
+    def on_param_change(self, name: str, callback: Callable[[Any], None]):
+        """
+        Registers a callback triggered when a parameter changes
+        @param name: The name of the parameter
+        @param callback: The callback function, it receives the new value
+        @details
+        The callback runs in the topic reader process of the node (in the executor in lockstep mode),
+        only for the parameters that changed after the node was started
+        """
+        self.param_callbacks.add(name, callback)
+
+    def array_topic(self, topic: str, shape: Tuple[int, ...], dtype: Any, slots: int = 8) -> ArrayTopic:
+        """
+        Declares a topic of fixed shape arrays backed by a shared memory ring
+        @param topic: The name of the topic
+        @param shape: Shape of the arrays
+        @param dtype: Data type of the arrays
+        @param slots: Number of frames kept in the ring
+        @return: The array topic
+        @details
+        Both publishers and subscribers have to declare the topic in their init method (before subscribing).
+        Only one node can publish to it: publishing from a second worker process raises RuntimeError.
+        Subscribers receive ArrayFrame objects with a read-only view of the slot and its sequence number
+        """
+        topic = normalize(topic)
+        with self.topics.lock:
+            if topic in self.topics:
+                existing = self.topics[topic]
+                if not isinstance(existing, ArrayTopic) or not existing.matches(shape, dtype, slots):
+                    msg = f'''
+    Tried to declare the array topic "{topic}" with shape {shape}, type {dtype} and {slots} slots.
+    The topic was already declared as {existing.shape if isinstance(existing, ArrayTopic) else existing.type}
+                    '''
+                    log.error(msg)
+                    raise TypeError(msg)
+                return existing
+
+            array_topic = ArrayTopic(topic, shape, dtype, slots)
+            self.topics[topic] = array_topic
+            return array_topic
 
     def __enqueue_topic(self, topic, msg, ctx):
         """
@@ -87,47 +460,446 @@ class EgoNode:
         @param msg: The message value
         @param ctx: The message context
         """
-        print (self.subscriptions[topic].msg_queue)
-        self.subscriptions[topic].msg_queue.put(Message(
-            value=msg,
-            ctx=ctx
-        ))
+        if self.dispatcher is not None:
+            self.dispatcher(self, topic, self.freeze(msg), ctx)
+            return
+
+        subscription = self.subscriptions[topic]
+        if subscription.reader_pid.value == os.getpid():
+            # Published from the process reading the subscription (the node itself or a node of its
+            # process group), the message is handed by reference
+            subscription.local.append(pubsub.envelopes.acquire(topic, self.freeze(msg), ctx))
+            subscription.put(intraprocess.LOCAL_TOKEN)
+            return
+
+        payload = None
+        if subscription.ring is not None:
+            payload = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+            if subscription.ring.push(payload, ctx.stamp):
+                return
+
+        # Only the value and the integer timestamp are pickled, the context is rebuilt by the reader
+        if subscription.max_age is None:
+            subscription.put((msg, ctx.stamp))
+            return
+        # The value is pickled on its own, so the reader can check the timestamp before unpickling it
+        subscription.put((payload or pickle.dumps(msg, pickle.HIGHEST_PROTOCOL), ctx.stamp))
 
-    def publish(self, topic: str, value: Any):
+    def freeze(self, msg: Any) -> Any:
+        """
+        Protects a message delivered by reference from being modified by the subscribers of the node
+        @param msg: The message value
+        @return: The read-only message
+        """
+        return intraprocess.freeze(msg, self.config is not None and self.config.freeze_dataclasses)
+
+    def publish(
+            self,
+            topic: str,
+            value: Any,
+            block: bool = False,
+            timeout: Optional[float] = None,
+            stamp: Optional[int] = None
+        ) -> PublishStatus:
         """
         Publishes a message to a topic
         @param topic: The topic to publish to
         @param value: The value to publish
+        @param block: Wait for the subscribers with a full queue instead of dropping the message for them
+        @param timeout: Seconds to wait for the subscribers (None waits forever)
+        @param stamp: Publication time in nanoseconds since the epoch, to keep the time of a message
+        coming from elsewhere (the current time of the clock by default)
+        @return: Credits and backlog of the subscribers, producers can use them to adapt their rate
+        @details
+        Messages published before every node of the instance has been initialized are buffered,
+        they are delivered by flush_startup (the returned status does not count them yet)
         """
+        topic = normalize(topic)
         if not topic in self.topics:
-            self.topics[topic] = Topic(
-                name=topic
-            )
+            with self.topics.lock:
+                if not topic in self.topics:
+                    self.topics[topic] = Topic(
+                        name=topic
+                    )
+        if self.directory is not None and self.config is not None:
+            self.directory.record(topic, self.config.name, type(value))
+
+        if self.startup_buffer is not None:
+            with self.startup_lock:
+                if self.startup_buffer is not None:
+                    self.startup_buffer.append((topic, value, block, timeout, stamp))
+                    return self.topics[topic].status()
+
+        if not tracing.enabled:
+            return self.topics[topic].publish(value, block, timeout, stamp)
 
-        self.topics[topic].publish(value)
+        tracing.begin(topic, 'publish')
+        try:
+            return self.topics[topic].publish(value, block, timeout, stamp)
+        finally:
+            tracing.end(topic, 'publish')
+
+    def flush_startup(self):
+        """
+        Publishes the messages buffered while the nodes of the instance were being initialized
+        @details Messages are published in the order the node published them, later publications are not buffered
+        """
+        with self.startup_lock:
+            buffered, self.startup_buffer = self.startup_buffer, None
+        for topic, value, block, timeout, stamp in buffered or []:
+            self.publish(topic, value, block, timeout, stamp)
+
+    def topic_status(self, topic: str) -> PublishStatus:
+        """
+        Gets the credits and the backlog of the subscribers of a topic
+        @param topic: The topic
+        """
+        topic = normalize(topic)
+        if not topic in self.topics:
+            return PublishStatus()
+        return self.topics[topic].status()
+
+    def stale_messages(self, topic: str) -> int:
+        """
+        Gets the number of messages of a topic dropped by the node for being older than the max_age of its subscription
+        @param topic: The topic
+        """
+        topic = normalize(topic)
+        if not topic in self.subscriptions:
+            return 0
+        return self.subscriptions[topic].stale.value
+
+    def wait_for_credit(self, topic: str, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every subscriber of a topic can receive a message
+        @param topic: The topic
+        @param timeout: Seconds to wait (None waits forever)
+        @return: False if the timeout expired
+        """
+        topic = normalize(topic)
+        if not topic in self.topics:
+            return True
+        return self.topics[topic].wait_for_credit(timeout)
 
     def __topic_subscription_worker(self, topic):
         """
         Worker function for handling topic subscriptions
         @param topic: The topic to handle
         """
-        sub = self.subscriptions[topic]
+        sub = self.subscriptions.get(topic)
+        if sub is None:
+            log.warning(f'''
+    Node {self.config.name} can't read topic "{topic}", it was subscribed to from a worker (subscribe in init)
+            ''')
+            return
+        if isinstance(self.topics[topic], ArrayTopic):
+            return self.__array_subscription_worker(topic)
+
+        sub.reader_pid.value = os.getpid()
+        received = self.__ring_messages(topic, sub) if sub.ring is not None else self.__queue_messages(topic, sub)
+        for value, stamp, pickled in received:
+            sub.inflight.value += 1
+            try:
+                if stamp == intraprocess.LOCAL_STAMP:
+                    if not sub.local:
+                        continue # Published to a previous reader process, which took the message with it
+                    envelope = sub.local.popleft()
+                    value, ctx = envelope.value, envelope.ctx
+                    pubsub.envelopes.release(envelope)
+                    if sub.is_stale(ctx.stamp):
+                        continue
+                else:
+                    if sub.is_stale(stamp):
+                        continue
+                    if pickled:
+                        value = pickle.loads(value)
+                    ctx = MessageContext(stamp, topic)
+                self.deliver(topic, value, ctx)
+            finally:
+                if sub.flow is not None:
+                    sub.flow.consumed()
+                sub.inflight.value -= 1
+
+    def __queue_messages(self, topic: str, sub: Subscription):
+        """
+        Receives the messages of a subscription from its queue
+        @param topic: The topic of the subscription
+        @param sub: The subscription
+        @return: Generator of (value, timestamp, whether the value is still pickled) tuples
+        """
+        pickled = sub.max_age is not None
         while (self.running):
-            msg = sub.msg_queue.get()
-            for callback in sub.callbacks:
-                callback(
-                    msg.value,
-                    msg.ctx
-                )
+            if tracing.enabled:
+                tracing.begin(topic, 'wait')
+                value, stamp = sub.get()
+                tracing.end(topic, 'wait')
+            else:
+                value, stamp = sub.get()
+            yield value, stamp, pickled
+
+    def __ring_messages(self, topic: str, sub: Subscription):
+        """
+        Receives the messages of a subscription from its ring, and from its queue the ones diverted from it
+        (published from other processes than the one of the ring, too big for the ring or published while
+        older messages were still diverted)
+        @param topic: The topic of the subscription
+        @param sub: The subscription
+        @return: Generator of (value, timestamp, whether the value is still pickled) tuples
+        """
+        pickled = sub.max_age is not None
+        while (self.running):
+            # Pushed messages are older than the diverted ones, the ring rejects pushes while they are pending
+            for value, stamp in sub.ring.pop_all():
+                yield value, stamp, True
+            for value, stamp in sub.ring.take_diverted(sub.msg_queue):
+                yield value, stamp, pickled
+            if tracing.enabled:
+                tracing.begin(topic, 'wait')
+                sub.ring.wait()
+                tracing.end(topic, 'wait')
+            else:
+                sub.ring.wait()
+
+    def deliver(self, topic: str, value: Any, ctx: MessageContext):
+        """
+        Runs the callbacks of a subscription in the current thread
+        @param topic: The topic of the message
+        @param value: The message value
+        @param ctx: The message context
+        """
+        for callback in self.subscriptions[topic].callbacks:
+            self.__run_callback(callback, value, ctx)
+        self.__mark_input(topic)
+
+    def __run_callback(self, callback: Callable[[Any, MessageContext], None], value: Any, ctx: MessageContext):
+        """
+        Runs a callback of a subscription
+        @param callback: The callback
+        @param value: The message value
+        @param ctx: The message context
+        """
+        if tracing.enabled:
+            tracing.begin(ctx.topic, 'callback')
+            callback(value, ctx)
+            tracing.end(ctx.topic, 'callback')
+        else:
+            callback(value, ctx)
+
+    def __pattern_worker(self):
+        """
+        Worker function delivering the messages forwarded to the wildcard subscriptions
+        """
+        while self.running:
+            index, value, ctx = self.pattern_inbox.get()
+            callback, max_age = self.pattern_subscriptions[index]
+            if max_age is not None and clock.get_clock().stamp() - ctx.stamp > max_age * 1e9:
+                continue
+            self.__run_callback(callback, value, ctx)
+            self.__mark_input(ctx.topic)
+
+    def __array_subscription_worker(self, topic):
+        """
+        Worker function for handling array topic subscriptions
+        @param topic: The array topic to handle
+        """
+        for received in self.topics[topic].frames(self.subscriptions[topic].array_reader):
+            if not self.running:
+                break
+            if received is None:
+                continue
+            frame, ctx = received
+            if self.subscriptions[topic].is_stale(ctx.stamp):
+                continue
+            self.deliver(topic, frame, ctx)
+
+    def __mark_input(self, topic):
+        """
+        Marks that a triggering topic has new data
+        @param topic: The topic that received data
+        """
+        if self.is_triggered() and topic in self.config.triggered_by:
+            with self.inputs_condition:
+                self.fresh_inputs.add(topic)
+                self.inputs_condition.notify()
+
+    def take_trigger(self) -> bool:
+        """
+        Checks if all the triggering topics have new data, consuming it if so
+        @return: True if the triggered node has to tick
+        """
+        if not self.is_triggered():
+            return False
+
+        with self.inputs_condition:
+            if not set(self.config.triggered_by) <= self.fresh_inputs:
+                return False
+            self.fresh_inputs.clear()
+            return True
+
+    def __trigger_handler(self):
+        """
+        Handler function for ticking a triggered node once all its inputs have new data
+        """
+        triggers = set(self.config.triggered_by)
+        while self.running:
+            with self.inputs_condition:
+                self.inputs_condition.wait_for(lambda: triggers <= self.fresh_inputs)
+                self.fresh_inputs.clear()
+
+            self.tick()
+
+    def tick(self):
+        """
+        Ticks the node, recording its progress for the watchdog
+        @details Used by the ticker and trigger workers and by the lockstep executor
+        """
+        self.tick_state.begin()
+        if tracing.enabled:
+            tracing.begin(self.config.name, 'tick')
+            self.inner_node.tick(self)
+            tracing.end(self.config.name, 'tick')
+        else:
+            self.inner_node.tick(self)
+        self.tick_state.end(self.config.tick_budget)
+        sys.stdout.flush()
+
+        # Checkpoints are taken between ticks, when the state of the node is consistent
+        # (following the clock of the node, so lockstep runs checkpoint at the same simulated times)
+        now = clock.get_clock().now()
+        if self.checkpointer is not None and now >= self.next_checkpoint:
+            self.next_checkpoint = now + self.config.checkpoint_period
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Writes a checkpoint of the state of the node
+        """
+        try:
+            self.checkpointer.save(self.inner_node.get_state(self))
+        except Exception:
+            log.warning(f'''
+    Node {self.config.name} could not write its checkpoint
+    Exception:
+        {traceback.format_exc()}
+            ''')
+
+    def restore(self) -> bool:
+        """
+        Restores the state of the node from its latest checkpoint
+        @return: True if the state was restored
+        """
+        if self.checkpointer is None:
+            return False
+        found, state = self.checkpointer.load()
+        if not found:
+            return False
+        if not self.inner_node.set_state(self, state):
+            return False
+        log.info(f'Restored node {self.config.name} from checkpoint {self.checkpointer.path}')
+        return True
+
+    def __setup_worker(self, role: str):
+        """
+        Applies the configuration of the node to the current worker process
+        @param role: What the worker does (shown in the traces)
+        """
+        if tracing.enabled:
+            tracing.start_worker(self.runtime_dir, f'{self.config.name} ({role})')
+        memory.apply_limits(self.runtime_dir, self.config.memory_limit, self.config.memory_budget)
+        if self.config.watchdog_timeout is not None:
+            tickwatch.register_stack_dump(self.runtime_dir)
+
+    def create_timer(self, period: float, callback: Callable[[], None], oneshot: bool = False) -> Timer:
+        """
+        Creates a timer that runs a callback periodically
+        @param period: Seconds between runs
+        @param callback: The function to run
+        @param oneshot: Run the callback only once, one period from now
+        @return: The timer (it can be stopped with cancel())
+        @details
+        All the timers of the node run in a single thread of the process that creates them: the topic reader
+        process for the timers created in init or in callbacks, the ticker process for the ones created in tick
+        """
+        return self.timers.add(Timer(period, callback, oneshot))
+
+    def add_worker(self, start: Callable[[], None]):
+        """
+        Registers a function run when the node starts, in the topic reader process
+        @param start: The function to run (it should start its own threads if it has to keep running)
+        @details Threads created in the init method of the node don't survive the launch of the node processes
+        """
+        self.workers.append(start)
+
+    def start_services(self):
+        """
+        Starts serving the provided services, watching the parameters and the workers in the current process
+        """
+        for service in self.services.values():
+            service.start()
+        # The lockstep executor dispatches the callbacks itself, following the simulated time
+        if self.dispatcher is None:
+            self.param_callbacks.watch()
+        else:
+            self.param_callbacks.dispatch()
+        for start in self.workers:
+            start()
 
     def __topic_reader_worker(self):
         """
         Worker function for reading topics
         """
+        self.__setup_worker('reader')
+        self.__read_topics()
+
+    def run_grouped(self):
+        """
+        Reads the topics of the node and ticks it from threads of the worker process of its group
+        @details The worker of the group applies the configuration of all its nodes before running them
+        """
+        ticker = None
+        if self.inner_node.is_tickable() and not self.is_triggered():
+            ticker = Thread(target=self.__tick_loop, name=f'{self.config.name}-ticker')
+            ticker.start()
+        self.__read_topics()
+        if ticker is not None:
+            ticker.join()
+
+    def __read_topics(self):
+        """
+        Starts the services and the timers of the node and delivers its subscriptions until it stops
+        """
+        self.start_services()
+        # Nodes that don't tick are checkpointed from a timer
+        if self.checkpointer is not None and not self.inner_node.is_tickable():
+            self.create_timer(self.config.checkpoint_period, self.checkpoint)
+        self.timers.start()
 
         handlers: List[Thread] = []
+        if self.inner_node.is_tickable() and self.is_triggered():
+            handler = Thread(target=self.__trigger_handler)
+            handlers.append(handler)
+            handler.start()
+
+        if self.pattern_inbox is not None:
+            handler = Thread(target=self.__pattern_worker)
+            handlers.append(handler)
+            handler.start()
+
+        # Subscriptions made in init are read straight away (a restarted worker won't find them pending)
+        started = set(self.subscriptions.keys())
+        for topic in started:
+            handler = Thread(
+                target=self.__topic_subscription_worker,
+                args=[topic]
+            )
+            handlers.append(handler)
+            handler.start()
+
         while self.running:
             new_subscriber = self.pending_subscriptions.get()
+            if new_subscriber in started:
+                continue
+            started.add(new_subscriber)
             # Launch new thread
 
             handler = Thread(
@@ -153,16 +925,101 @@ class EgoNode:
     {self}, with inner node: {self.inner_node.filename}
             ''')
 
-        dt = 1.0 / self.config.tick_rate
-        last_tick = time.time()
+        self.__setup_worker('ticker')
+        # The timers inherited from init run in the reader process, this one only runs the ones created in tick
+        self.timers.reset()
+        self.timers.start()
+        self.__tick_loop()
+
+    def __tick_loop(self):
+        """
+        Ticks the node at its tick rate until it stops
+        """
+        node_clock = clock.get_clock()
+        last_tick = node_clock.now()
 
         while self.running:
-            current_time = time.time()
+            dt = 1.0 / self.tick_rate.value
+            current_time = node_clock.now()
             elapsed_time = current_time - last_tick
 
             if elapsed_time >= dt:
-                self.inner_node.tick(self)
-                sys.stdout.flush()
+                self.tick()
                 last_tick = current_time
             else:
-                time.sleep(dt - elapsed_time)
+                node_clock.sleep(dt - elapsed_time)
+
+
+class ProcessGroup:
+    """
+    Nodes that share a single worker process
+    @details
+    Every node of the group reads its topics and ticks from its own threads of the process, so the messages
+    they publish to each other skip the queues and are delivered by reference. The process is killed and
+    launched again as a whole when any of its nodes has to be restarted.
+    """
+
+    def __init__(self, name: str, nodes: List[EgoNode], runtime_dir: str) -> None:
+        """
+        Constructor for the ProcessGroup class
+        @param name: The name of the group
+        @param nodes: The initialized nodes of the group
+        @param runtime_dir: Runtime folder of the instance
+        """
+        self.name = name
+        self.nodes = nodes
+        self.runtime_dir = runtime_dir
+        self.handler: Optional[multiprocessing.Process] = None
+        self.lock = Lock()
+
+    def start(self) -> multiprocessing.Process:
+        """
+        Launches the worker process of the group (once, for the first node of the group that starts)
+        @return: The worker process
+        """
+        if self.handler is None:
+            for node in self.nodes:
+                node.running = True
+            self.handler = zygote.spawn_worker(self.__group_worker, f'{self.name}-group')
+        return self.handler
+
+    def restart(self):
+        """
+        Kills the worker process of the group and launches it again
+        @details Concurrent restarts (from any node of the group) are serialized
+        """
+        with self.lock:
+            if self.handler is not None:
+                self.handler.kill()
+                self.handler.join()
+                self.handler = None
+
+            log.warning(f'Restarting process group {self.name} (nodes {[node.config.name for node in self.nodes]})')
+            for node in self.nodes:
+                node.recover()
+            for node in self.nodes:
+                node.start()
+
+    def __group_worker(self):
+        """
+        Worker function running every node of the group
+        """
+        configs = [node.config for node in self.nodes]
+        if tracing.enabled:
+            tracing.start_worker(self.runtime_dir, f'{self.name} (group)')
+        # The address space limit of the process is shared by the nodes, it only applies if all of them set one
+        limits = [config.memory_limit for config in configs]
+        budgets = [config.memory_budget for config in configs if config.memory_budget is not None]
+        memory.apply_limits(
+            self.runtime_dir,
+            None if None in limits else sum(limits),
+            min(budgets) if budgets else None
+        )
+        if any(config.watchdog_timeout is not None for config in configs):
+            tickwatch.register_stack_dump(self.runtime_dir)
+
+        threads = [Thread(target=node.run_grouped, name=node.config.name) for node in self.nodes]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+
+        sys.stdout.flush()
@@ -0,0 +1,197 @@
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import time
+from .node import Criticality
+
+log = logging.getLogger('egoros')
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def read_cpu_times() -> Tuple[int, int]:
+    """
+    Reads the CPU time spent by the whole machine
+    @return: Busy and total time in clock ticks (0, 0 if they can't be read)
+    """
+    try:
+        with open('/proc/stat') as stat:
+            times = [int(value) for value in stat.readline().split()[1:]]
+    except (OSError, ValueError):
+        return 0, 0
+    total = sum(times[:8]) # Guest times are already counted as user time
+    idle = times[3] + (times[4] if len(times) > 4 else 0) # idle + iowait
+    return total - idle, total
+
+def read_process_cpu(pid: int) -> Optional[float]:
+    """
+    Reads the CPU time spent by a process
+    @param pid: Process id
+    @return: User and system time in seconds (None if the process does not exist)
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            # The name of the process may contain spaces, fields are read after its closing parenthesis
+            fields = stat.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Governor:
+    """
+    Adapts the tick rates of the nodes to the CPU load of the machine
+    @details
+    Every period the governor measures the CPU load and the CPU time spent by every tick of the nodes.
+    When the load is above high, the rates of the LOW nodes are lowered first (the most expensive ones
+    first), then the ones of the NORMAL nodes, until the CPU time they free brings the load down to
+    target. When the load is below low, the lowered rates are raised again, NORMAL nodes first.
+    Only nodes that tick at a fixed rate and set Configuration.min_tick_rate are governed, and the
+    rates always stay between min_tick_rate and tick_rate. CRITICAL nodes are never slowed down.
+    """
+
+    def __init__(
+            self,
+            nodes: List,
+            period: float = 1.0,
+            high: float = 0.85,
+            low: float = 0.6,
+            target: float = 0.75,
+            step: float = 0.25
+        ) -> None:
+        """
+        Constructor for the Governor class
+        @param nodes: The started EgoNodes
+        @param period: Seconds between measurements
+        @param high: CPU load (between 0 and 1) over which the machine is considered saturated
+        @param low: CPU load under which the lowered rates are raised again
+        @param target: CPU load the governor aims for when lowering rates
+        @param step: Fraction of the range of a node its rate is raised by every period
+        """
+        self.nodes = [
+            node for node in nodes
+            if node.config.min_tick_rate is not None
+            and node.config.criticality != Criticality.CRITICAL
+            and node.inner_node.is_tickable()
+            and not node.is_triggered()
+        ]
+        self.period = period
+        self.high = high
+        self.low = low
+        self.target = target
+        self.step = step
+        self.cpus = os.cpu_count() or 1
+        # Last CPU time of the ticker of every node, with the time it was read
+        self.usage: Dict[str, Tuple[float, float]] = {}
+        self.running = False
+
+        for node in self.nodes:
+            if not 0 < node.config.min_tick_rate <= node.config.tick_rate:
+                msg = f'''
+    Node {node.config.name} has a min_tick_rate of {node.config.min_tick_rate}, it has to be positive and at most its tick_rate ({node.config.tick_rate})
+                '''
+                log.error(msg)
+                raise ValueError(msg)
+
+    def start(self):
+        """
+        Starts governing the rates in a background thread
+        """
+        if not self.nodes:
+            return
+        self.running = True
+        Thread(target=self.__governor_worker, daemon=True).start()
+
+    def stop(self):
+        """
+        Stops governing the rates (the current rates are kept)
+        """
+        self.running = False
+
+    def tick_cost(self, node) -> Optional[float]:
+        """
+        Measures the CPU time spent by every tick of a node since the last measurement
+        @param node: The EgoNode
+        @return: CPU seconds per tick (None if it can't be measured yet)
+        """
+        handler = getattr(node, 'ticker_handler', None)
+        if handler is None or not handler.is_alive():
+            return None
+        cpu = read_process_cpu(handler.pid)
+        if cpu is None:
+            return None
+
+        now = time.monotonic()
+        previous = self.usage.get(node.config.name)
+        self.usage[node.config.name] = (now, cpu)
+        if previous is None or now <= previous[0] or cpu < previous[1]: # A restarted ticker starts from 0
+            return None
+        return (cpu - previous[1]) / (now - previous[0]) / node.get_tick_rate()
+
+    def __lower(self, costs: Dict[str, float], excess: float):
+        """
+        Lowers the rates of the nodes until the given CPU time is freed
+        @param costs: CPU seconds per tick of every node
+        @param excess: CPU seconds per second to free
+        """
+        candidates = sorted(
+            (node for node in self.nodes if node.config.name in costs),
+            key=lambda node: (-node.config.criticality.value, -costs[node.config.name] * node.get_tick_rate())
+        )
+        for node in candidates:
+            if excess <= 0:
+                break
+            cost = costs[node.config.name]
+            current = node.get_tick_rate()
+            if cost <= 0 or current <= node.config.min_tick_rate:
+                continue
+            rate = max(node.config.min_tick_rate, current - excess / cost)
+            excess -= (current - rate) * cost
+            self.__set_rate(node, rate)
+
+    def __raise(self):
+        """
+        Raises the lowered rates one step, the most critical nodes first
+        """
+        lowered = [node for node in self.nodes if node.get_tick_rate() < node.config.tick_rate]
+        if not lowered:
+            return
+        criticality = min(node.config.criticality.value for node in lowered)
+        for node in lowered:
+            if node.config.criticality.value == criticality:
+                step = self.step * (node.config.tick_rate - node.config.min_tick_rate)
+                self.__set_rate(node, min(node.config.tick_rate, node.get_tick_rate() + step))
+
+    def __set_rate(self, node, rate: float):
+        """
+        Changes the tick rate of a running node
+        @param node: The EgoNode
+        @param rate: The new tick rate
+        """
+        log.info(f'Tick rate of {node.config.name} changed from {node.get_tick_rate():.2f} to {rate:.2f} Hz')
+        node.tick_rate.value = rate
+
+    def __governor_worker(self):
+        """
+        Worker function that measures the load and adapts the rates
+        """
+        busy, total = read_cpu_times()
+        while self.running:
+            time.sleep(self.period)
+            costs = {}
+            for node in self.nodes:
+                cost = self.tick_cost(node)
+                if cost is not None:
+                    costs[node.config.name] = cost
+
+            previous_busy, previous_total = busy, total
+            busy, total = read_cpu_times()
+            if total <= previous_total:
+                continue
+            load = (busy - previous_busy) / (total - previous_total)
+
+            if load > self.high:
+                self.__lower(costs, (load - self.target) * self.cpus)
+            elif load < self.low:
+                self.__raise()
@@ -1,10 +1,33 @@
 import threading
-from typing import Any, Dict, List
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import Any, Callable, Dict, List, Optional
 from . import node
 from . import egonode
 import logging
+import os
+import platform
+import shutil
 from . import reloader
+from . import topology
+from . import clock
+from . import lockstep
+from . import pubsub
+from . import zygote
+from . import tracing
+from .tap import TapServer
+from . import utils
+from .arraytopic import ArrayTopic
+from .checkpoint import Checkpointer
+from .governor import Governor
+from .memory import MemoryMonitor
+from .offload import OffloadPool
+from .tickwatch import DIAGNOSTICS_TOPIC, Watchdog
+from .params import ParameterServer
 from .pubsub import Topic
+from .ring import SPSCRing, SUPPORTED as RINGS_SUPPORTED
+from .router import TopicRouter
 
 log = logging.getLogger('egoros')
 
@@ -12,38 +35,277 @@ class EgoInstance:
     '''
 
     '''
-    def __init__(self, node_filanames: List[str]) -> None:
+    def __init__(
+            self,
+            node_filanames: List[str],
+            preload: List[str] = [],
+            checkpoint_dir: Optional[str] = None,
+            trace: Optional[str] = None,
+            offload_workers: Optional[int] = None,
+            offload_timeout: Optional[float] = None
+        ) -> None:
+        # Heavy dependencies are imported once here, every node worker is forked with them already loaded
+        self.preloaded = zygote.preload(preload)
         # Open nodes
         self.nodes = [node.Node(file) for file in node_filanames]
-        self.topics: Dict[str, Topic] = {}
+        self.topics = TopicRouter()
         self.reload_server = None
+        self.runtime_dir = utils.get_runtime_dir()
+        self.stages: List[List[str]] = []
+        self.stop_event = threading.Event()
+        # Folder with the checkpoints of the nodes (None disables them)
+        self.checkpoint_dir = checkpoint_dir
+        # File where the trace of the run is written (None disables tracing)
+        self.trace = trace
+        # Shared memory rings of the single publisher subscriptions
+        self.rings: List[SPSCRing] = []
+        # Every created EgoNode, their services are closed when the instance is released
+        self.ego_nodes: List[egonode.EgoNode] = []
+        # Process pool for the CPU-bound work of the nodes (its workers are forked when the nodes start)
+        self.offload_pool = OffloadPool(self.runtime_dir, offload_workers, offload_timeout)
 
     def enable_hot_reloading(self) -> None:
         self.reload_server = reloader.enable_dynamic_reloads(self.nodes, self)
 
-    def spin(self) -> None:
-        running = True
+    def __init_nodes(self, dispatcher: Optional[Callable] = None) -> List[egonode.EgoNode]:
+        """
+        Creates and initializes the EgoNodes
+        @param dispatcher: Function that delivers the messages instead of the subscription queues (lockstep mode)
+        @return: The initialized nodes, ordered by pipeline stage
+        """
+        os.makedirs(self.runtime_dir, exist_ok=True)
+
+        self.parameters = ParameterServer(self.runtime_dir, os.getpid(), create=True)
+
+        # The tap server has to be running before the nodes start publishing (even in their init)
+        self.tap_server = TapServer(self.runtime_dir, os.getpid())
+        pubsub.observers.append(self.tap_server.publisher.offer)
+        self.tap_server.start(self.topics)
+
+        # Created before the nodes, so they can subscribe to it
+        self.topics[DIAGNOSTICS_TOPIC] = Topic(name=DIAGNOSTICS_TOPIC)
 
         # Create EgoNodes
-        nodes = [egonode.EgoNode(node, self.topics) for node in self.nodes]
+        nodes = [egonode.EgoNode(node, self.topics, self.runtime_dir, self.parameters) for node in self.nodes]
+        self.ego_nodes = nodes
+        for ego_node in nodes:
+            ego_node.dispatcher = dispatcher
+            ego_node.offload_pool = self.offload_pool
+            ego_node.directory = self.tap_server.directory
+
+        # Initialize all nodes before starting any of them, so every subscription exists when publishing starts.
+        # Nodes are initialized in parallel, except in lockstep mode where the order of the subscriptions matters
+        if dispatcher is None and len(nodes) > 1:
+            with ThreadPoolExecutor(max_workers=len(nodes), thread_name_prefix='egoros-init') as executor:
+                list(executor.map(lambda ego_node: ego_node.init(), nodes))
+        else:
+            [node.init() for node in nodes]
+
+        # Names identify the nodes (checkpoints, service sockets, logs...), they have to be unique
+        names = Counter(ego_node.config.name for ego_node in nodes if ego_node.config is not None)
+        duplicated = sorted(name for name, count in names.items() if count > 1)
+        if duplicated:
+            msg = f'''
+    Several nodes are named {duplicated}, node names have to be unique in an instance
+            '''
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.tap_server.describe = lambda: self.__describe_topics(nodes)
+
+        self.__restore_checkpoints(nodes, restore=dispatcher is None)
+
+        # Startup barrier: messages published during init are delivered once every node can receive them
+        [ego_node.flush_startup() for ego_node in nodes]
+
+        if dispatcher is None:
+            self.__connect_rings(nodes)
+            self.__group_processes(nodes)
+
+        # Declared outputs are created before forking, so wildcard subscriptions already match them
+        for ego_node in nodes:
+            for topic in ego_node.outputs():
+                if topic not in self.topics:
+                    self.topics[topic] = Topic(name=topic)
+
+        # Order the nodes by their topic dependencies. Stages are started from the last one
+        # so consumers are already reading when their producers start publishing
+        initialized = [node for node in nodes if node.config is not None]
+        graph = topology.build_dependency_graph(
+            inputs={node: node.inputs() for node in initialized},
+            outputs={node: node.outputs() for node in initialized}
+        )
+        stages = topology.pipeline_stages(graph, key=lambda node: node.config.name)
+        self.stages = [[node.config.name for node in stage] for stage in stages]
+        read = reduce(
+            lambda prev, stage: prev + '\t' + str(stage) + '\n',
+            self.stages,
+            ''
+        )
+        log.info(f'''
+    Pipeline stages:
+{read}
+        ''')
+
+        return [node for stage in stages for node in stage]
+
+    def __release(self):
+        """
+        Releases the resources shared by the nodes
+        """
+        # Listeners unlink their sockets when closed, before the runtime folder is removed
+        for ego_node in self.ego_nodes:
+            for service in ego_node.services.values():
+                service.close()
+        self.ego_nodes = []
+        self.parameters.close()
+        pubsub.observers.remove(self.tap_server.publisher.offer)
+        self.tap_server.close()
+        [topic.close() for topic in self.topics.values() if isinstance(topic, ArrayTopic)]
+        [ring.close() for ring in self.rings]
+        self.rings = []
+        shutil.rmtree(self.runtime_dir, ignore_errors=True)
+
+    def __restore_checkpoints(self, nodes: List[egonode.EgoNode], restore: bool = True):
+        """
+        Restores the nodes from their latest checkpoints (before any of them ticks)
+        @param nodes: The initialized nodes
+        @param restore: Whether the states are restored (lockstep runs only write checkpoints, so they stay reproducible)
+        """
+        for ego_node in nodes:
+            if ego_node.config is None or ego_node.config.checkpoint_period is None:
+                continue
+            if self.checkpoint_dir is None:
+                log.warning(f'Node {ego_node.config.name} is not checkpointed, checkpoints are disabled for the instance')
+                continue
+            if not ego_node.inner_node.has_state():
+                log.warning(f'''
+    Node {ego_node.config.name} sets a checkpoint period but it does not define get_state and set_state
+                ''')
+                continue
+
+            ego_node.checkpointer = Checkpointer(os.path.join(self.checkpoint_dir, f'{ego_node.config.name}.ckpt'))
+            if restore:
+                ego_node.restore()
+
+    def __connect_rings(self, nodes: List[egonode.EgoNode]):
+        """
+        Gives a shared memory ring to the subscriptions of the topics published by a single node
+        @param nodes: The initialized nodes
+        @details
+        The ring is taken by the first worker of the publisher that publishes, messages from any other
+        process (or too big for the ring) keep going through the queue of the subscription.
+        The messages flushed by the startup barrier are already queued, the reader takes them first
+        """
+        if not RINGS_SUPPORTED:
+            log.info(f'Shared memory rings are not supported on {platform.machine()}, subscriptions use their queues')
+            return
+
+        publishers: Dict[str, int] = {}
+        for ego_node in nodes:
+            for topic in set(ego_node.outputs()):
+                publishers[topic] = publishers.get(topic, 0) + 1
+
+        for ego_node in nodes:
+            for topic, subscription in ego_node.subscriptions.items():
+                if publishers.get(topic) != 1 or isinstance(self.topics[topic], ArrayTopic):
+                    continue
+                subscription.attach_ring(SPSCRing())
+                self.rings.append(subscription.ring)
+        log.info(f'{len(self.rings)} subscriptions use a shared memory ring')
+
+    def __group_processes(self, nodes: List[egonode.EgoNode]):
+        """
+        Gives a shared worker process to the nodes with the same process group
+        @param nodes: The initialized nodes
+        """
+        groups: Dict[str, List[egonode.EgoNode]] = {}
+        for ego_node in nodes:
+            if ego_node.config is not None and ego_node.config.process_group is not None:
+                groups.setdefault(ego_node.config.process_group, []).append(ego_node)
+
+        for name, members in groups.items():
+            group = egonode.ProcessGroup(name, members, self.runtime_dir)
+            for ego_node in members:
+                ego_node.group = group
+            log.info(f'Process group {name} runs nodes {[ego_node.config.name for ego_node in members]}')
+
+    def __describe_topics(self, nodes: List[egonode.EgoNode]) -> Dict[str, Dict[str, Any]]:
+        """
+        Describes the publishers and the subscribers of every topic (used by the topic info command)
+        @param nodes: The initialized nodes
+        @details
+        Topics and publishers come from the topics of this process, the declared outputs of the nodes and the
+        directory, where the workers record what they actually publish. Subscriptions are made before forking,
+        so they are all known by this process
+        """
+        described = {}
+        for name, topic in list(self.topics.items()):
+            described[name] = {
+                'type': None if topic.type is None else topic.type.__name__,
+                'publishers': [],
+                'subscribers': {}
+            }
+        for name, recorded in self.tap_server.directory.topics().items():
+            described.setdefault(name, {'type': None, 'publishers': [], 'subscribers': {}})
+            described[name]['type'] = described[name]['type'] or recorded['type']
+            described[name]['publishers'].extend(recorded['publishers'])
+        for ego_node in nodes:
+            if ego_node.config is None:
+                continue
+            for name in ego_node.outputs():
+                if ego_node.config.name not in described[name]['publishers']:
+                    described[name]['publishers'].append(ego_node.config.name)
+            for name, subscription in ego_node.subscriptions.items():
+                described[name]['subscribers'][ego_node.config.name] = subscription.depth()
+        return described
+
+    def spin(self, duration: Optional[float] = None) -> None:
+        """
+        Runs all the nodes until the instance is interrupted
+        @param duration: Seconds to run (None runs until interrupted)
+        """
+        running = True
+        if self.trace is not None:
+            tracing.enable()
+        nodes = self.__init_nodes()
 
         # Launch all nodes
-        joiners = [node.launch() for node in nodes]
+        zygote.freeze()
+        self.offload_pool.start()
+        joiners = [node.start() for node in reversed(nodes)]
+
+        # Nodes over their memory budget are restarted before the OOM killer picks a victim
+        monitor = MemoryMonitor(nodes, self.runtime_dir)
+        monitor.start()
+        watchdog = Watchdog(
+            nodes,
+            self.runtime_dir,
+            publish=self.topics[DIAGNOSTICS_TOPIC].publish,
+            escalate=self.stop_event.set
+        )
+        watchdog.start()
+        # Non-critical nodes are slowed down while the machine is saturated
+        governor = Governor(nodes)
+        governor.start()
 
-        ev = threading.Event()
         # Wait for all nodes to stop
         try:
             print(self.reload_server)
             if (self.reload_server != None):
                 self.reload_server.start()
-            ev.wait()
+            self.stop_event.wait(duration)
         except KeyboardInterrupt:
             msg = f'''
     Egoros interrupted by user, stopping all threads...
             '''
             log.warning(msg)
 
+        monitor.stop()
+        watchdog.stop()
+        governor.stop()
         [node.stop() for node in nodes]
+        self.offload_pool.stop()
 
         log.info(f'''
     Finishing EgoROS instance.
@@ -60,6 +322,36 @@ class EgoInstance:
             # TODO: abort nodes execution
             log.error('You dun goofed')
             raise e # FIXME: this is obviously a problem, but I don't want to fix it now
+        finally:
+            if self.trace is not None:
+                tracing.dump(tracing.trace_path(self.runtime_dir, os.getpid()))
+                tracing.merge(self.runtime_dir, self.trace)
+            self.__release()
+
+    def run_lockstep(self, duration: float, start: float = 0.0) -> None:
+        """
+        Runs all the nodes in lockstep with a simulated clock
+        @param duration: Simulated seconds to run
+        @param start: Initial time of the simulated clock (seconds since the epoch)
+        @details
+        Nodes run in the current process. The instance moves the simulated clock to the next tick
+        deadline, ticks the node and delivers every message published as a consequence before moving
+        forward again. Runs are deterministic and as fast as the machine allows.
+        """
+        # The clock must be in place before initializing, messages published in init are timestamped too
+        executor = lockstep.LockstepExecutor([], start)
+        previous_clock = clock.get_clock()
+        clock.set_clock(executor.clock)
+        try:
+            nodes = self.__init_nodes(dispatcher=executor.dispatch)
+            executor.attach(nodes)
+            log.info(f'''
+    Running {len(nodes)} nodes in lockstep for {duration} simulated seconds...
+            ''')
+            executor.run(duration)
+        finally:
+            clock.set_clock(previous_clock)
+            self.__release()
 
     def publish(self, topic: str, value: Any):
         pass
@@ -0,0 +1,87 @@
+from dataclasses import fields, is_dataclass
+from typing import Any, Dict
+import logging
+
+log = logging.getLogger('egoros')
+
+try:
+    import numpy as np
+except ImportError: # Arrays can't be frozen without numpy, but they can't be published either
+    np = None
+
+# Stamp of the token that tells a subscription worker to take the message from its local queue
+LOCAL_STAMP = -1
+LOCAL_TOKEN = (None, LOCAL_STAMP)
+
+# Frozen subclass of every dataclass delivered by reference
+frozen_classes: Dict[type, type] = {}
+
+
+def frozen_setattr(self, name: str, value: Any):
+    raise AttributeError(f'Message of type {type(self).__name__} is read-only (delivered by reference)')
+
+def frozen_delattr(self, name: str):
+    raise AttributeError(f'Message of type {type(self).__name__} is read-only (delivered by reference)')
+
+def frozen_class(cls: type) -> type:
+    """
+    Gets a subclass of a dataclass whose instances can't be modified
+    @param cls: The dataclass
+    """
+    if cls not in frozen_classes:
+        frozen_classes[cls] = type(cls.__name__, (cls,), {
+            '__setattr__': frozen_setattr,
+            '__delattr__': frozen_delattr,
+            '__module__': cls.__module__,
+            '__qualname__': cls.__qualname__
+        })
+    return frozen_classes[cls]
+
+def freeze(value: Any, dataclasses: bool = False) -> Any:
+    """
+    Protects a message delivered by reference from being modified by the subscribers
+    @param value: The published message
+    @param dataclasses: Also deliver dataclasses as frozen copies (their fields are frozen too)
+    @return: The message, with read-only views instead of arrays (tuples are frozen item by item)
+    @details
+    The publisher keeps its writable objects, only the subscribers get the read-only versions.
+    Other mutable objects (lists, dicts, ...) are delivered as they are.
+    """
+    if np is not None and isinstance(value, np.ndarray):
+        if not value.flags.writeable:
+            return value
+        view = value.view()
+        view.flags.writeable = False
+        return view
+
+    if type(value) is tuple:
+        return tuple(freeze(item, dataclasses) for item in value)
+
+    if dataclasses and is_dataclass(value) and not isinstance(value, type):
+        if type(value).__dataclass_params__.frozen or type(value) in frozen_classes.values():
+            return value
+        frozen = object.__new__(frozen_class(type(value)))
+        for field in fields(value):
+            object.__setattr__(frozen, field.name, freeze(getattr(value, field.name), dataclasses))
+        return frozen
+
+    return value
+
+
+if __name__ == "__main__":
+    from dataclasses import dataclass
+
+    @dataclass
+    class Pose:
+        x: float
+        covariance: Any
+
+    frame = np.zeros((2, 2))
+    delivered = freeze((frame, Pose(1.0, np.eye(2))), dataclasses=True)
+    frame[0, 0] = 1 # The publisher can still write
+    for attempt in [lambda: delivered[0].__setitem__((0, 0), 2), lambda: setattr(delivered[1], 'x', 2.0)]:
+        try:
+            attempt()
+        except (ValueError, AttributeError) as e:
+            print('Rejected:', e)
+    print(delivered[0][0, 0], isinstance(delivered[1], Pose), delivered[1])
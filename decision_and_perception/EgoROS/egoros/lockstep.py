@@ -0,0 +1,121 @@
+from collections import deque
+from typing import Any, Deque, List
+import heapq
+import logging
+from . import clock
+from . import pubsub
+from .egonode import EgoNode
+from .pubsub import Message, MessageContext
+
+log = logging.getLogger('egoros')
+
+
+class LockstepExecutor:
+    """
+    Runs the nodes of an instance in a single thread following a simulated clock
+    @details
+    Time jumps directly to the next tick or timer deadline. Messages published while ticking are delivered
+    (in publication order) before time moves forward again, including the ones published by the
+    callbacks themselves, so every run of the same nodes produces the same results regardless of
+    the speed of the machine.
+    Array topics are not delivered in lockstep mode.
+    """
+
+    def __init__(self, nodes: List[EgoNode], start: float = 0.0) -> None:
+        """
+        Constructor for the LockstepExecutor class
+        @param nodes: Initialized nodes to run (more can be added with attach)
+        @param start: Initial time of the simulated clock
+        """
+        self.nodes: List[EgoNode] = []
+        self.clock = clock.SimClock(start)
+        self.pending: Deque[Message] = deque()
+        self.attach(nodes)
+
+    def attach(self, nodes: List[EgoNode]):
+        """
+        Adds initialized nodes to the executor
+        @param nodes: The nodes to run (in this order when their deadlines are equal)
+        @details
+        The dispatcher of the nodes should be set before initializing them, so the messages published
+        during init are delivered once the run starts
+        """
+        for node in nodes:
+            node.dispatcher = self.dispatch
+            node.start_services()
+            self.nodes.append(node)
+
+    def dispatch(self, node: EgoNode, topic: str, msg: Any, ctx: MessageContext):
+        """
+        Queues the delivery of a message to a subscribed node
+        @param node: The subscribed node
+        @param topic: The topic of the message
+        @param msg: The message value
+        @param ctx: The message context
+        """
+        self.pending.append(pubsub.envelopes.acquire(topic, msg, ctx, node))
+
+    def run(self, duration: float):
+        """
+        Runs the nodes until the simulated clock reaches the given duration
+        @param duration: Simulated seconds to run
+        """
+        previous_clock = clock.get_clock()
+        clock.set_clock(self.clock)
+        try:
+            self.__drain()
+
+            end = self.clock.now() + duration
+            # Heap of (deadline, node index) pairs, the index keeps the order deterministic on ties
+            deadlines = [
+                (self.clock.now() + 1.0 / node.config.tick_rate, index)
+                for index, node in enumerate(self.nodes)
+                if node.inner_node.is_tickable() and not node.is_triggered()
+            ]
+            heapq.heapify(deadlines)
+
+            while True:
+                tick_deadline = deadlines[0][0] if deadlines else float('inf')
+                timer_deadline = min(
+                    (deadline for deadline in (node.timers.next_deadline() for node in self.nodes) if deadline is not None),
+                    default=float('inf')
+                )
+                if min(tick_deadline, timer_deadline) > end:
+                    break
+
+                # Timers run before the ticks with the same deadline
+                if timer_deadline <= tick_deadline:
+                    self.clock.advance_to(timer_deadline)
+                    for node in self.nodes:
+                        node.timers.run_due(timer_deadline)
+                        self.__drain()
+                    continue
+
+                deadline, index = heapq.heappop(deadlines)
+                node = self.nodes[index]
+                self.clock.advance_to(deadline)
+                node.tick()
+                self.__drain()
+                heapq.heappush(deadlines, (deadline + 1.0 / node.config.tick_rate, index))
+
+            self.clock.advance_to(max(end, self.clock.now()))
+        finally:
+            clock.set_clock(previous_clock)
+
+    def __drain(self):
+        """
+        Delivers all the pending messages (and the ones published while delivering them)
+        @details The parameter change callbacks run first, so they are triggered at a deterministic point
+        """
+        for node in self.nodes:
+            node.param_callbacks.dispatch()
+        while self.pending:
+            envelope = self.pending.popleft()
+            node = envelope.receiver
+            try:
+                node.deliver(envelope.topic, envelope.value, envelope.ctx)
+            finally:
+                pubsub.envelopes.release(envelope)
+            # Triggered nodes tick as soon as all their inputs have new data
+            if node.inner_node.is_tickable() and node.take_trigger():
+                node.tick()
@@ -0,0 +1,221 @@
+from collections import deque
+from threading import Thread
+from typing import Deque, Dict, List, Optional, Tuple
+import logging
+import os
+import resource
+import signal
+import time
+import tracemalloc
+
+log = logging.getLogger('egoros')
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+# Signal used to ask a worker for a tracemalloc snapshot
+SNAPSHOT_SIGNAL = signal.SIGUSR1
+
+
+def snapshot_path(runtime_dir: str, pid: int) -> str:
+    """
+    Gets the path where a worker dumps its tracemalloc snapshot
+    @param runtime_dir: Runtime folder of the instance
+    @param pid: Process id of the worker
+    """
+    return os.path.join(runtime_dir, f'memory-{pid}.snapshot')
+
+def apply_limits(runtime_dir: str, memory_limit: Optional[int], memory_budget: Optional[int]):
+    """
+    Applies the memory configuration of a node to the current worker process
+    @param runtime_dir: Runtime folder of the instance
+    @param memory_limit: Hard limit of the address space of the process in bytes (None for no limit)
+    @param memory_budget: Memory budget (PSS) of the node in bytes. If set, allocations are traced
+    so a snapshot can be dumped before the node is restarted
+    """
+    if memory_limit is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            memory_limit = min(memory_limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard))
+
+    if memory_budget is not None:
+        tracemalloc.start(16)
+        path = snapshot_path(runtime_dir, os.getpid())
+
+        def dump_snapshot(signum, frame):
+            snapshot = tracemalloc.take_snapshot()
+            snapshot.dump(path + '.tmp')
+            os.replace(path + '.tmp', path) # The monitor never reads a partial snapshot
+
+        signal.signal(SNAPSHOT_SIGNAL, dump_snapshot)
+
+def read_rss(pid: int) -> int:
+    """
+    Reads the resident memory of a process
+    @param pid: Process id
+    @return: Resident memory in bytes (0 if the process does not exist)
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def read_pss(pid: int) -> int:
+    """
+    Reads the proportional set size of a process
+    @param pid: Process id
+    @return: Proportional set size in bytes (0 if the process does not exist)
+    @details
+    Pages shared with other processes (like the copy-on-write pages of the forked workers) are divided
+    between them, so the PSS of several processes can be added without counting the shared pages several
+    times. Falls back to the resident memory if the kernel does not provide smaps_rollup
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as rollup:
+            for line in rollup:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        return read_rss(pid)
+    except (OSError, IndexError, ValueError):
+        pass
+    return 0
+
+def growth_rate(samples: Deque[Tuple[float, int]]) -> float:
+    """
+    Computes the growth rate of the memory with a least squares fit
+    @param samples: (time, memory) samples
+    @return: Slope of the fit in bytes per second
+    """
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_m = sum(m for _, m in samples) / n
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if variance == 0:
+        return 0.0
+    return sum((t - mean_t) * (m - mean_m) for t, m in samples) / variance
+
+
+class MemoryMonitor:
+    """
+    Tracks the memory of every node of the instance
+    @details
+    Every node keeps a window of samples of the proportional set size (PSS) of its workers, which only
+    counts their share of the pages inherited copy-on-write from the instance. A node is reported
+    as leaking when the growth slope over a full window is above leak_rate. A node whose PSS is
+    above its Configuration.memory_budget dumps a tracemalloc snapshot (logged with the biggest
+    allocation sites) and is restarted.
+    """
+
+    def __init__(
+            self,
+            nodes: List,
+            runtime_dir: str,
+            period: float = 1.0,
+            window: int = 60,
+            leak_rate: float = 64 * 1024
+        ) -> None:
+        """
+        Constructor for the MemoryMonitor class
+        @param nodes: The started EgoNodes
+        @param runtime_dir: Runtime folder of the instance
+        @param period: Seconds between samples
+        @param window: Number of samples used to compute the growth slope
+        @param leak_rate: Growth (in bytes per second) sustained over a whole window considered a leak
+        """
+        self.nodes = nodes
+        self.runtime_dir = runtime_dir
+        self.period = period
+        self.window = window
+        self.leak_rate = leak_rate
+        self.samples: Dict[str, Deque[Tuple[float, int]]] = {
+            node.config.name: deque(maxlen=window) for node in nodes
+        }
+        self.leaking: Dict[str, bool] = {node.config.name: False for node in nodes}
+        self.running = False
+
+    def start(self):
+        """
+        Starts sampling in a background thread
+        """
+        self.running = True
+        Thread(target=self.__monitor_worker, daemon=True).start()
+
+    def stop(self):
+        """
+        Stops sampling
+        """
+        self.running = False
+
+    def pss(self, node) -> int:
+        """
+        Gets the proportional set size of all the workers of a node
+        @param node: The EgoNode
+        @return: Proportional set size in bytes
+        @details
+        Adding the resident memory of the workers would count the pages they share several times
+        """
+        return sum(read_pss(pid) for pid in node.pids())
+
+    def __monitor_worker(self):
+        """
+        Worker function that samples the memory of the nodes
+        """
+        while self.running:
+            now = time.monotonic()
+            for node in self.nodes:
+                name = node.config.name
+                samples = self.samples[name]
+                pss = self.pss(node)
+                samples.append((now, pss))
+
+                if node.config.memory_budget is not None and pss > node.config.memory_budget:
+                    log.error(f'''
+    Node {name} is using {pss / 2**20:.1f} MiB (PSS), over its budget of {node.config.memory_budget / 2**20:.1f} MiB
+    Restarting the node...
+                    ''')
+                    self.__log_snapshots(node)
+                    node.restart()
+                    samples.clear()
+                    self.leaking[name] = False
+                    continue
+
+                if len(samples) == self.window:
+                    slope = growth_rate(samples)
+                    leaking = slope > self.leak_rate
+                    if leaking and not self.leaking[name]:
+                        log.warning(f'''
+    Node {name} may be leaking memory: it grew {slope * 60 / 2**20:.2f} MiB/min during the last {self.window * self.period:.0f} s
+    (currently using {pss / 2**20:.1f} MiB of PSS)
+                        ''')
+                    self.leaking[name] = leaking
+
+            time.sleep(self.period)
+
+    def __log_snapshots(self, node, timeout: float = 2.0):
+        """
+        Asks the workers of a node for a tracemalloc snapshot and logs the biggest allocation sites
+        @param node: The EgoNode
+        @param timeout: Seconds to wait for the snapshots
+        """
+        for pid in node.pids():
+            path = snapshot_path(self.runtime_dir, pid)
+            try:
+                os.kill(pid, SNAPSHOT_SIGNAL)
+            except ProcessLookupError:
+                continue
+
+            deadline = time.monotonic() + timeout
+            while not os.path.exists(path) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if not os.path.exists(path):
+                log.warning(f'Worker {pid} of node {node.config.name} did not dump its memory snapshot')
+                continue
+
+            stats = tracemalloc.Snapshot.load(path).statistics('lineno')[:10]
+            top = '\n'.join(f'\t{stat}' for stat in stats)
+            log.error(f'''
+    Biggest allocations of worker {pid} of node {node.config.name}:
+{top}
+    Snapshot stored in {path}
+            ''')
@@ -1,10 +1,11 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import importlib.abc
 import re
 from types import ModuleType
-from typing import Any, Callable, cast
+from typing import Any, Callable, Dict, List, Optional, cast
 import importlib.util
 import os.path
+import sys
 import inspect
 from enum import Enum
 import traceback
@@ -16,6 +17,15 @@ class NodeState(Enum):
     ACTIVE = 0
     CRASHED = 1
 
+class Criticality(Enum):
+    """
+    How important it is for a node to keep its tick rate when the machine is overloaded
+    @details The governor of the instance slows down the LOW nodes first, then the NORMAL ones. CRITICAL nodes are never slowed down
+    """
+    CRITICAL = 0
+    NORMAL = 1
+    LOW = 2
+
 @dataclass
 class Loader:
     """
@@ -42,9 +52,43 @@ class Configuration:
     Node configuration
     @name Public name of the node. This name will allow accessible features for every other node
     @tick_rate Target ticks per second for the node
+    @params Default values of the parameters used by the node (values already set are kept)
+    @triggered_by Input topics that trigger the ticks of the node. If any is provided, the node ticks as soon
+    as all of them have new data (instead of ticking at tick_rate)
+    @publishes Topics published by the node (used to order the nodes of a pipeline)
+    @min_tick_rate Lowest tick rate the governor can set when the machine is overloaded (None keeps tick_rate fixed)
+    @criticality How important it is for the node to keep its tick rate
+    @memory_limit Hard limit (in bytes) of the address space of every worker process of the node.
+    Allocations over the limit raise MemoryError inside the node instead of waking up the OOM killer
+    @memory_budget Memory budget (in bytes) of all the workers of the node, compared with the sum of their
+    proportional set size (PSS): pages shared with other processes only count their share. A node over its
+    budget is restarted by the instance, after logging where its memory was allocated
+    @tick_budget Seconds a tick is expected to take. Slower ticks are reported on egoros/diagnostics
+    @watchdog_timeout Seconds after which a tick is considered stuck (None disables the watchdog)
+    @watchdog_action What the instance does with a stuck node: "warn", "restart" it or "escalate" (stop the instance)
+    @freeze_dataclasses Dataclass messages delivered by reference (published from the process reading them)
+    are received as read-only copies. Arrays are always received as read-only views
+    @checkpoint_period Seconds between checkpoints of the state of the node (None disables them).
+    The node has to define the get_state and set_state methods
+    @process_group Nodes with the same process group run as threads of a single worker process, so the messages
+    they publish to each other are delivered by reference. The nodes of a group are restarted together, their
+    memory is measured for the whole process and the governor can't change their tick rate
     """
     name: str
     tick_rate: float = 10 
+    params: Dict[str, Any] = field(default_factory=dict)
+    triggered_by: List[str] = field(default_factory=list)
+    publishes: List[str] = field(default_factory=list)
+    min_tick_rate: Optional[float] = None
+    criticality: Criticality = Criticality.NORMAL
+    memory_limit: Optional[int] = None
+    memory_budget: Optional[int] = None
+    tick_budget: Optional[float] = None
+    watchdog_timeout: Optional[float] = None
+    watchdog_action: str = 'warn'
+    freeze_dataclasses: bool = False
+    checkpoint_period: Optional[float] = None
+    process_group: Optional[str] = None
 
 def normal_loader(path: str):
     """
@@ -63,7 +107,18 @@ def normal_loader(path: str):
 
     # Load and run module
     mod = importlib.util.module_from_spec(spec)
-    cast(importlib.abc.Loader, spec.loader).exec_module(mod)
+    # Registered so the functions and classes of the node can be pickled by reference (offloaded functions)
+    previous = sys.modules.get(spec.name)
+    sys.modules[spec.name] = mod
+    try:
+        cast(importlib.abc.Loader, spec.loader).exec_module(mod)
+    except BaseException:
+        # A module that failed to run is not left behind (a reload keeps the previous version)
+        if previous is None:
+            sys.modules.pop(spec.name, None)
+        else:
+            sys.modules[spec.name] = previous
+        raise
 
     return mod
 
@@ -112,6 +167,14 @@ OPTIONAL_REQUIREMENTS = [
     Requirement(
         name='tick', # Tick method
         condition=lambda e: callable(e[1]) and e[0] == 'tick'
+    ),
+    Requirement(
+        name='get_state', # Returns the state stored in the checkpoints
+        condition=lambda e: callable(e[1]) and e[0] == 'get_state'
+    ),
+    Requirement(
+        name='set_state', # Restores the state of a checkpoint
+        condition=lambda e: callable(e[1]) and e[0] == 'set_state'
     )
 ]
 
@@ -216,6 +279,40 @@ class Node:
         """
         return 'tick' in self.optional_requirements
 
+    def has_state(self) -> bool:
+        """
+        Checks if the node can be checkpointed
+        @details
+        A node can be checkpointed if it defines both the get_state and set_state methods
+        """
+        return 'get_state' in self.optional_requirements and 'set_state' in self.optional_requirements
+
+    def get_state(self, arg: Any) -> Any:
+        """
+        Gets the state of the node (stored in the checkpoints)
+        @param arg Argument that will be passed to the node's get_state method
+        @return The state of the node
+        """
+        return self.optional_requirements['get_state'](arg)
+
+    def set_state(self, arg: Any, state: Any) -> bool:
+        """
+        Restores the state of the node from a checkpoint
+        @param arg Argument that will be passed to the node's set_state method
+        @param state The state stored in the checkpoint
+        @return True if the state was restored, False if the node produced an exception
+        """
+        try:
+            self.optional_requirements['set_state'](arg, state)
+            return True
+        except Exception:
+            log.warning(f'''
+    Node {self.filename} could not restore its checkpoint
+    Exception:
+        {traceback.format_exc()}
+            ''')
+            return False
+
     def init(self, arg):
         """
         Initializes the node (returning it's configuration)
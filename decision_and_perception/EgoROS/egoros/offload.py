@@ -0,0 +1,447 @@
+from concurrent.futures import Future
+from dataclasses import dataclass
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import signal
+import time
+import traceback
+import weakref
+from . import zygote
+
+log = logging.getLogger('egoros')
+
+try:
+    import numpy as np
+except ImportError: # Without numpy every argument is pickled
+    np = None
+
+# Arrays from this size (in bytes) travel through shared memory instead of being pickled
+SHARED_ARRAY_THRESHOLD = 64 * 1024
+
+
+class OffloadError(Exception):
+    """
+    Raised when an offloaded function fails
+    """
+    pass
+
+
+class SharedArray:
+    """
+    Array copied into a shared memory block, only its description is pickled
+    """
+
+    __slots__ = ('name', 'shape', 'dtype')
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: str) -> None:
+        """
+        Constructor for the SharedArray class
+        @param name: Name of the shared memory block
+        @param shape: Shape of the array
+        @param dtype: Data type of the array
+        """
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def __reduce__(self):
+        return (SharedArray, (self.name, self.shape, self.dtype))
+
+
+def offload_address(runtime_dir: str, pid: int) -> str:
+    """
+    Gets the socket address where a process receives the results of its offloaded functions
+    @param runtime_dir: Runtime folder of the instance
+    @param pid: Process id
+    """
+    return os.path.join(runtime_dir, f'offload-{pid}.sock')
+
+def share(value: Any, blocks: List[SharedMemory]) -> Any:
+    """
+    Replaces the big arrays of a value by copies in shared memory
+    @param value: An argument or a result (tuples are shared item by item)
+    @param blocks: List where the created blocks are added (their creator unlinks them)
+    @return: The value, with SharedArray descriptions instead of the big arrays
+    """
+    if np is not None and isinstance(value, np.ndarray) and value.nbytes >= SHARED_ARRAY_THRESHOLD \
+            and not value.dtype.hasobject:
+        block = SharedMemory(create=True, size=value.nbytes)
+        np.copyto(np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf), value)
+        blocks.append(block)
+        return SharedArray(block.name, value.shape, value.dtype.str)
+
+    if type(value) is tuple:
+        return tuple(share(item, blocks) for item in value)
+
+    return value
+
+def attach(value: Any, blocks: List[SharedMemory], own: bool = False) -> Any:
+    """
+    Replaces the SharedArray descriptions of a value by the arrays
+    @param value: A shared argument or result
+    @param blocks: List where the attached blocks are added (they have to be closed once the arrays are not used)
+    @param own: Make the arrays own their blocks instead of adding them to blocks: the blocks are destroyed
+    right away (their memory stays mapped) and closed once the arrays are garbage collected
+    @return: The value with the arrays (views of the shared memory, they are not copied)
+    """
+    if isinstance(value, SharedArray):
+        block = SharedMemory(value.name)
+        array = np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=block.buf)
+        if not own:
+            blocks.append(block)
+            return array
+        block.unlink()
+        weakref.finalize(array, release, [block])
+        return array
+
+    if type(value) is tuple:
+        return tuple(attach(item, blocks, own) for item in value)
+
+    return value
+
+def release(blocks: List[SharedMemory], unlink: bool = False):
+    """
+    Closes shared memory blocks
+    @param blocks: The blocks
+    @param unlink: Also destroy the blocks (only their creator or their last user does it)
+    """
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            continue # An array still uses it, it's released when the process exits
+        if unlink:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+@dataclass
+class OffloadMetrics:
+    """
+    State of the offload pool of the instance
+    @param size Number of worker processes of the pool
+    @param queued Functions waiting for a free worker
+    @param running Functions being run
+    @param completed Functions that returned a result
+    @param failed Functions that raised an exception
+    """
+    size: int = 0
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+
+
+class OffloadPool:
+    """
+    Pool of worker processes shared by all the nodes of the instance for CPU-bound work
+    @details
+    Any process of the instance can submit functions. They are queued for the workers of the pool,
+    which send the results back to a socket of the submitting process, where a thread resolves the futures.
+    Functions and arguments are pickled (functions of the node modules are pickled by reference),
+    except the big arrays that are copied into shared memory blocks. The big arrays of the results are
+    received as views of their blocks, without another copy.
+    A monitor thread of the process that starts the pool replaces the workers that die or run a function
+    for longer than the timeout, failing the future of the function they were running.
+    """
+
+    def __init__(self, runtime_dir: str, size: Optional[int] = None, timeout: Optional[float] = None) -> None:
+        """
+        Constructor for the OffloadPool class
+        @param runtime_dir: Runtime folder of the instance
+        @param size: Number of worker processes (the number of CPUs by default)
+        @param timeout: Seconds a function can run before its worker is killed (None for no limit)
+        """
+        self.runtime_dir = runtime_dir
+        self.timeout = timeout
+        self.size = size if size is not None else (os.cpu_count() or 1)
+        if self.size < 1:
+            msg = f'''
+    Offload pool needs at least one worker (got {self.size})
+            '''
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.tasks: multiprocessing.Queue = zygote.context.Queue()
+        self.queued = multiprocessing.Value('l', 0)
+        self.running = multiprocessing.Value('l', 0)
+        self.completed = multiprocessing.Value('Q', 0)
+        self.failed = multiprocessing.Value('Q', 0)
+        self.workers: List[multiprocessing.Process] = []
+        # Function run by every worker: task id and submitting process (-1 when idle), and when it started
+        # (infinity until the start is recorded, so the monitor never times out a function too early)
+        self.slots = multiprocessing.Array('q', [-1] * (2 * self.size), lock=False)
+        self.started = multiprocessing.Array('d', [float('inf')] * self.size, lock=False)
+        self.workers_lock = Lock()
+        self.running_pool = False
+
+        # Submissions of the current process, reset in every forked process
+        self.lock = Lock()
+        self.pending: Dict[int, Tuple[Future, List[SharedMemory]]] = {}
+        self.ids = itertools.count()
+        self.listener: Optional[Listener] = None
+        self.listener_pid: Optional[int] = None
+
+    def start(self, period: float = 0.1):
+        """
+        Forks the worker processes of the pool and starts monitoring them
+        @param period: Seconds between checks of the workers
+        """
+        with self.workers_lock:
+            self.workers = [self.__spawn(index) for index in range(self.size)]
+            self.running_pool = True
+        Thread(target=self.__monitor_worker, args=[period], daemon=True).start()
+        log.info(f'Offload pool started with {self.size} workers')
+
+    def stop(self):
+        """
+        Terminates the worker processes of the pool (functions being run are lost)
+        """
+        with self.workers_lock:
+            self.running_pool = False
+            for worker in self.workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+
+    def metrics(self) -> OffloadMetrics:
+        """
+        Gets the size of the pool and the number of functions in every state
+        """
+        return OffloadMetrics(
+            size=self.size,
+            queued=self.queued.value,
+            running=self.running.value,
+            completed=self.completed.value,
+            failed=self.failed.value
+        )
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Runs a function in a worker of the pool
+        @param fn: The function (it must be picklable, for example a function defined at the top of a node module)
+        @param args: Positional arguments of the function
+        @param kwargs: Keyword arguments of the function
+        @return: A future resolved with the result of the function
+        """
+        future: Future = Future()
+        blocks: List[SharedMemory] = []
+        with self.lock:
+            self.__listen()
+            task_id = next(self.ids)
+            try:
+                # Pickled here, so the errors fail the future instead of being lost in the feeder thread of the queue
+                payload = pickle.dumps((
+                    fn,
+                    share(tuple(args), blocks),
+                    {name: share(value, blocks) for name, value in kwargs.items()}
+                ), pickle.HIGHEST_PROTOCOL)
+                self.pending[task_id] = (future, blocks)
+                with self.queued.get_lock():
+                    self.queued.value += 1
+                self.tasks.put((task_id, os.getpid(), payload))
+            except Exception as e:
+                self.pending.pop(task_id, None)
+                release(blocks, unlink=True)
+                future.set_exception(OffloadError(f'Could not offload {getattr(fn, "__name__", fn)}: {e}'))
+        return future
+
+    def __listen(self):
+        """
+        Opens the socket where the current process receives its results (once per process)
+        """
+        if self.listener is not None and self.listener_pid == os.getpid():
+            return
+        # Submissions inherited from the parent process are not answered to this one
+        self.pending = {}
+        self.listener = Listener(offload_address(self.runtime_dir, os.getpid()), family='AF_UNIX')
+        self.listener_pid = os.getpid()
+        Thread(target=self.__accept_worker, args=[self.listener], daemon=True).start()
+
+    def __accept_worker(self, listener: Listener):
+        """
+        Worker function that accepts the connections of the pool workers
+        @param listener: Socket of the current process
+        """
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                break
+            Thread(target=self.__result_worker, args=[conn], daemon=True).start()
+
+    def __result_worker(self, conn: Connection):
+        """
+        Worker function that resolves the futures with the results sent by a pool worker
+        @param conn: Connection with the pool worker
+        """
+        while True:
+            try:
+                task_id, ok, value = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            with self.lock:
+                entry = self.pending.pop(task_id, None)
+            if entry is None:
+                continue
+            future, blocks = entry
+            release(blocks, unlink=True)
+
+            if not ok:
+                future.set_exception(OffloadError(f'''
+    Offloaded function failed:
+{value}
+                '''))
+                continue
+
+            try:
+                # The arrays of the result are views of their blocks, which are closed once the arrays are collected
+                result = attach(value, [], own=True)
+            except Exception as e:
+                future.set_exception(OffloadError(f'Result of the offloaded function could not be read: {e}'))
+                continue
+            future.set_result(result)
+
+    def __spawn(self, index: int) -> multiprocessing.Process:
+        """
+        Forks a worker process of the pool
+        @param index: Index of the worker in the pool
+        """
+        self.slots[2 * index] = -1
+        self.started[index] = float('inf')
+        return zygote.spawn_worker(lambda: self.__pool_worker(index), f'offload-{index}')
+
+    def __monitor_worker(self, period: float):
+        """
+        Worker function that replaces the dead and the timed out workers of the pool
+        @param period: Seconds between checks of the workers
+        """
+        while True:
+            time.sleep(period)
+            with self.workers_lock:
+                if not self.running_pool:
+                    break
+                for index, worker in enumerate(self.workers):
+                    busy = self.slots[2 * index] >= 0
+                    if busy and self.timeout is not None and time.monotonic() - self.started[index] > self.timeout:
+                        worker.kill()
+                        worker.join()
+                        reason = f'Offloaded function did not finish in {self.timeout} s, its worker was killed'
+                    elif not worker.is_alive():
+                        worker.join()
+                        reason = f'Offload worker died (exit code {worker.exitcode}) while running the function'
+                    else:
+                        continue
+
+                    log.warning(f'Replacing offload worker {index}: {reason}')
+                    self.__fail_running(index, reason)
+                    self.workers[index] = self.__spawn(index)
+
+    def __fail_running(self, index: int, reason: str):
+        """
+        Fails the function a dead worker was running
+        @param index: Index of the worker in the pool
+        @param reason: Why the function failed
+        """
+        task_id, pid = self.slots[2 * index], self.slots[2 * index + 1]
+        if task_id < 0:
+            return
+        self.slots[2 * index] = -1
+        with self.running.get_lock():
+            self.running.value -= 1
+        with self.failed.get_lock():
+            self.failed.value += 1
+
+        try:
+            with Client(offload_address(self.runtime_dir, pid), family='AF_UNIX') as conn:
+                conn.send((task_id, False, reason))
+        except OSError:
+            pass # The submitting process is gone
+
+    def __pool_worker(self, index: int):
+        """
+        Worker function of the pool processes
+        @param index: Index of the worker in the pool
+        """
+        # Stopped by the instance, not by the interrupt of the terminal
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        connections: Dict[str, Connection] = {}
+
+        while True:
+            task_id, pid, payload = self.tasks.get()
+            # Recorded right away, the monitor fails the function if the worker dies from now on
+            self.slots[2 * index + 1] = pid
+            self.slots[2 * index] = task_id
+            self.started[index] = time.monotonic()
+            address = offload_address(self.runtime_dir, pid)
+            with self.queued.get_lock():
+                self.queued.value -= 1
+            with self.running.get_lock():
+                self.running.value += 1
+
+            blocks: List[SharedMemory] = []
+            result_blocks: List[SharedMemory] = []
+            try:
+                fn, args, kwargs = pickle.loads(payload)
+                value = fn(*attach(args, blocks), **{name: attach(item, blocks) for name, item in kwargs.items()})
+                reply = (task_id, True, share(value, result_blocks))
+                value = None # It may be a view of an argument, whose block is closed next
+                counter = self.completed
+            except Exception:
+                reply = (task_id, False, traceback.format_exc())
+                counter = self.failed
+            release(blocks)
+
+            # Idle before replying, the monitor must not fail a function that already finished if the worker dies
+            self.slots[2 * index] = -1
+            self.started[index] = float('inf')
+            with self.running.get_lock():
+                self.running.value -= 1
+            with counter.get_lock():
+                counter.value += 1
+            self.__reply(connections, address, reply, result_blocks)
+
+    def __reply(
+            self,
+            connections: Dict[str, Connection],
+            address: str,
+            reply: Tuple[int, bool, Any],
+            result_blocks: List[SharedMemory]
+        ):
+        """
+        Sends the result of a function to the process that submitted it
+        @param connections: Connections of the worker with the submitting processes
+        @param address: Socket of the submitting process
+        @param reply: The (task id, success, result or traceback) tuple
+        @param result_blocks: Shared memory blocks of the result
+        """
+        task_id = reply[0]
+        try:
+            if address not in connections:
+                connections[address] = Client(address, family='AF_UNIX')
+            try:
+                connections[address].send(reply)
+            except (OSError, ValueError):
+                raise
+            except Exception as e:
+                connections[address].send((task_id, False, f'Result could not be sent: {e}'))
+                release(result_blocks, unlink=True)
+                return
+            # The submitting process destroys the blocks of the result once it has attached them
+            release(result_blocks)
+        except (OSError, ValueError):
+            # The submitting process is gone, nobody will read the blocks
+            connections.pop(address, None)
+            release(result_blocks, unlink=True)
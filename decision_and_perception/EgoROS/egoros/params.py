@@ -0,0 +1,179 @@
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import os
+import time
+import traceback
+from .shmstore import SharedStore
+
+log = logging.getLogger('egoros')
+
+
+def parameters_name(pid: int) -> str:
+    """
+    Gets the name of the shared memory region holding the parameters of an instance
+    @param pid: Process id of the instance
+    """
+    return f'egoros-params-{pid}'
+
+
+class ParameterServer:
+    """
+    Parameters shared by all the nodes of an instance
+    @details
+    Parameters live in a shared memory region, reading them only costs checking the version of the
+    region (they are deserialized again only after an update). Updates replace the whole set of
+    parameters atomically and can be made from any process, including the command line.
+    """
+
+    def __init__(self, runtime_dir: str, pid: int, create: bool = False) -> None:
+        """
+        Constructor for the ParameterServer class
+        @param runtime_dir: Runtime folder of the instance
+        @param pid: Process id of the instance
+        @param create: Whether the parameters region has to be created (only done by the instance)
+        """
+        self.store = SharedStore(
+            name=parameters_name(pid),
+            lock_path=os.path.join(runtime_dir, 'params.lock'),
+            create=create
+        )
+
+    @property
+    def version(self) -> int:
+        """
+        Version of the parameters (increased with every update)
+        """
+        return self.store.state()
+
+    def get(self, name: str, default: Any = None) -> Any:
+        """
+        Gets the value of a parameter
+        @param name: The name of the parameter
+        @param default: The value returned if the parameter is not defined
+        """
+        return self.store.read()[1].get(name, default)
+
+    def items(self) -> Dict[str, Any]:
+        """
+        Gets a copy of all the parameters
+        """
+        return dict(self.store.read()[1])
+
+    def set(self, name: str, value: Any) -> int:
+        """
+        Sets the value of a parameter
+        @param name: The name of the parameter
+        @param value: The new value (it has to be picklable)
+        @return: The new version of the parameters
+        """
+        return self.update({name: value})
+
+    def update(self, values: Dict[str, Any]) -> int:
+        """
+        Sets the values of several parameters in a single update
+        @param values: Dictionary with the new values
+        @return: The new version of the parameters
+        """
+        def updater(params: Dict[str, Any]):
+            params.update(values)
+            return params
+        return self.store.update(updater)
+
+    def set_defaults(self, values: Dict[str, Any]) -> int:
+        """
+        Sets the values of the parameters that are not defined yet
+        @param values: Dictionary with the default values
+        @return: The new version of the parameters
+        """
+        def updater(params: Dict[str, Any]):
+            return {**values, **params}
+        return self.store.update(updater)
+
+    def close(self):
+        """
+        Closes the parameters region
+        """
+        self.store.close()
+
+
+class ParameterCallbacks:
+    """
+    Callbacks of a node triggered when the parameters change
+    @details
+    Every node keeps its own callbacks, they only run in the process of the node that dispatches them:
+    a watcher thread of the topic reader process, or the executor in lockstep mode.
+    """
+
+    def __init__(self, parameters: ParameterServer) -> None:
+        """
+        Constructor for the ParameterCallbacks class
+        @param parameters: Parameter server of the instance
+        """
+        self.parameters = parameters
+        self.callbacks: Dict[str, List[Callable[[Any], None]]] = {}
+        self.lock = Lock()
+        # Version and values the changes are detected against (None until the first dispatch)
+        self.version: Optional[int] = None
+        self.previous: Dict[str, Any] = {}
+        self.watcher_pid: Optional[int] = None
+
+    def add(self, name: str, callback: Callable[[Any], None]):
+        """
+        Registers a callback triggered when a parameter changes
+        @param name: The name of the parameter
+        @param callback: The callback function, it receives the new value
+        """
+        with self.lock:
+            self.callbacks.setdefault(name, []).append(callback)
+
+    def dispatch(self):
+        """
+        Runs the callbacks of the parameters changed since the last dispatch
+        @details The first dispatch only takes the current values as reference
+        """
+        if self.version is not None and self.parameters.store.state() == self.version:
+            return
+
+        version, current = self.parameters.store.read()
+        first = self.version is None
+        previous, self.version, self.previous = self.previous, version, current
+        if first:
+            return
+
+        with self.lock:
+            callbacks = {name: list(cbs) for name, cbs in self.callbacks.items()}
+
+        for name, cbs in callbacks.items():
+            if name in current and (name not in previous or previous[name] != current[name]):
+                for callback in cbs:
+                    try:
+                        callback(current[name])
+                    except Exception:
+                        log.warning(f'''
+    Callback for parameter "{name}" crashed
+    Exception:
+        {traceback.format_exc()}
+                        ''')
+
+    def watch(self, period: float = 0.05):
+        """
+        Starts the thread that dispatches the callbacks in the current process
+        @param period: Seconds between checks of the parameters version
+        """
+        # Threads don't survive forks, so every process needs its own watcher
+        if self.watcher_pid == os.getpid():
+            return
+
+        self.dispatch()
+        self.watcher_pid = os.getpid()
+        Thread(target=self.__watch_worker, args=[period], daemon=True).start()
+
+    def __watch_worker(self, period: float):
+        """
+        Worker function that detects changes in the parameters
+        @param period: Seconds between checks of the parameters version
+        """
+        while True:
+            time.sleep(period)
+            self.dispatch()
@@ -1,30 +1,206 @@
+from collections import deque
 import multiprocessing
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Deque, List, Optional
 import logging
+import os
+import time
 from dataclasses import dataclass, field
 from datetime import datetime
 import inspect
+from . import clock
+from .ring import SPSCRing
 
 log = logging.getLogger('egoros')
 
+# Functions called with (topic name, data, context) for every message published in the process
+observers: List[Callable[[str, Any, 'MessageContext'], None]] = []
+
 
-@dataclass
 class MessageContext:
     """
     Represents the context of a message with a timestamp.
+    @details
+    A single context is shared by all the subscribers of a publication, it must not be modified.
     """
 
-    timestamp: datetime
+    __slots__ = ('stamp', 'topic')
+
+    def __init__(self, stamp: int, topic: Optional[str] = None) -> None:
+        """
+        Constructor for the MessageContext class.
+        @param stamp: Publication time in nanoseconds since the epoch.
+        @param topic: Name of the topic the message was published to.
+        """
+        self.stamp = stamp
+        self.topic = topic
+
+    @property
+    def seconds(self) -> float:
+        """
+        Publication time in seconds since the epoch.
+        """
+        return self.stamp / 1e9
+
+    @property
+    def timestamp(self) -> datetime:
+        """
+        Publication time as a datetime.
+        """
+        return datetime.fromtimestamp(self.stamp / 1e9)
+
+    def __reduce__(self):
+        return (MessageContext, (self.stamp, self.topic))
+
+    def __repr__(self) -> str:
+        return f'MessageContext(stamp={self.stamp}, topic={self.topic!r})'
 
 
-@dataclass
 class Message:
     """
     Represents a message with its value and context.
+    @details
+    Envelopes are reused through a MessagePool, their fields are cleared once the message is delivered.
+    """
+
+    __slots__ = ('topic', 'value', 'ctx', 'receiver')
+
+    def __init__(self) -> None:
+        """
+        Constructor for the Message class.
+        """
+        self.topic: Optional[str] = None
+        self.value: Any = None
+        self.ctx: Optional[MessageContext] = None
+        self.receiver: Any = None
+
+
+class MessagePool:
+    """
+    Free list of message envelopes for the deliveries inside a process.
+    @details
+    Used by the local deliveries of the subscriptions and by the lockstep executor. Envelopes can be
+    acquired and released from any thread (list.pop and list.append are atomic).
+    """
+
+    def __init__(self, max_size: int = 1024) -> None:
+        """
+        Constructor for the MessagePool class.
+        @param max_size: Maximum number of free envelopes kept.
+        """
+        self.max_size = max_size
+        self.free: List[Message] = []
+
+    def acquire(self, topic: str, value: Any, ctx: MessageContext, receiver: Any = None) -> Message:
+        """
+        Gets an envelope from the pool.
+        @param topic: The topic of the message.
+        @param value: The message value.
+        @param ctx: The message context.
+        @param receiver: Object the message is delivered to.
+        @return: The filled envelope.
+        """
+        try:
+            msg = self.free.pop()
+        except IndexError:
+            msg = Message()
+        msg.topic = topic
+        msg.value = value
+        msg.ctx = ctx
+        msg.receiver = receiver
+        return msg
+
+    def release(self, msg: Message):
+        """
+        Returns a delivered envelope to the pool.
+        @param msg: The envelope (it must not be used anymore).
+        """
+        msg.value = msg.ctx = msg.receiver = None
+        if len(self.free) < self.max_size:
+            self.free.append(msg)
+
+
+# Envelopes of the current process
+envelopes = MessagePool()
+
+
+class FlowControl:
+    """
+    Credits given by a subscriber to the publishers of a topic.
+    @details
+    Every queued message takes one credit, given back once the subscriber has delivered it.
+    Publishers without credits can wait for them or drop the message. Publishers running in the process
+    of the reader never wait: the credits may only come back from the thread that is waiting.
+    """
+
+    def __init__(self, capacity: int, reader_pid: Any = None) -> None:
+        """
+        Constructor for the FlowControl class.
+        @param capacity: Maximum number of messages waiting in the queue of the subscriber.
+        @param reader_pid: Shared value with the process id of the reader of the subscriber (None if unknown).
+        """
+        self.capacity = capacity
+        self.reader_pid = reader_pid
+        self.credits = multiprocessing.BoundedSemaphore(capacity)
+        self.backlog = multiprocessing.Value('l', 0)
+        self.dropped = multiprocessing.Value('L', 0)
+
+    def reserve(self, block: bool = False, timeout: Optional[float] = None) -> bool:
+        """
+        Takes a credit to queue a message (the message is counted as dropped if there are none).
+        @param block: Wait for a credit if there are none.
+        @param timeout: Seconds to wait (None waits forever).
+        @return: True if the message can be queued.
+        """
+        if not self.credits.acquire(block and not self.local(), timeout):
+            with self.dropped.get_lock():
+                self.dropped.value += 1
+            return False
+
+        with self.backlog.get_lock():
+            self.backlog.value += 1
+        return True
+
+    def local(self) -> bool:
+        """
+        Checks if the subscriber is read by the current process.
+        """
+        return self.reader_pid is not None and self.reader_pid.value == os.getpid()
+
+    def consumed(self):
+        """
+        Gives back the credit of a delivered message.
+        """
+        with self.backlog.get_lock():
+            self.backlog.value -= 1
+        self.credits.release()
+
+    def credit(self) -> int:
+        """
+        Gets the number of messages that can be queued without waiting.
+        """
+        return self.capacity - self.backlog.value
+
+
+@dataclass
+class PublishStatus:
+    """
+    Represents the state of the subscribers of a topic after a publication.
+    @param dropped Subscribers that did not receive the message (they had no credits).
+    @param credit Messages that can be published before the slowest subscriber runs out of credits
+    (None if no subscriber limits its queue).
+    @param backlog Messages waiting in the most loaded subscriber queue.
     """
 
-    value: Any
-    ctx: MessageContext
+    dropped: int = 0
+    credit: Optional[int] = None
+    backlog: int = 0
+
+    @property
+    def accepted(self) -> bool:
+        """
+        Checks if every subscriber received the message.
+        """
+        return self.dropped == 0
 
 
 @dataclass
@@ -33,8 +209,105 @@ class Subscription:
     Represents a subscription with a message queue and callbacks.
     """
 
-    msg_queue: multiprocessing.Queue = multiprocessing.Queue()
+    msg_queue: multiprocessing.Queue = field(default_factory=multiprocessing.Queue)
     callbacks: List[Callable[[Any, MessageContext], None]] = field(default_factory=lambda: [])
+    flow: Optional[FlowControl] = None
+    # Process reading the queue, messages published from that same process skip the queue
+    reader_pid: Any = field(default_factory=lambda: multiprocessing.Value('i', 0, lock=False))
+    local: Deque[Message] = field(default_factory=deque)
+    # Messages older than max_age seconds are dropped by the reader before being unpickled
+    max_age: Optional[float] = None
+    stale: Any = field(default_factory=lambda: multiprocessing.Value('Q', 0, lock=False))
+    # Set by the instance when the topic has a single publisher, its messages skip the queue
+    ring: Optional[SPSCRing] = None
+    # Index of the wakeup of the subscription in its array topic (only for array topics)
+    array_reader: Optional[int] = None
+    # Messages put in the queue (without a ring). The reader waits on it, so it only takes the lock of the
+    # queue to get a message that is already there and a killed reader does not leave the lock taken
+    available: Any = field(default_factory=lambda: multiprocessing.Semaphore(0))
+    # Messages taken by the reader that have not been delivered yet
+    inflight: Any = field(default_factory=lambda: multiprocessing.Value('l', 0, lock=False))
+
+    def is_stale(self, stamp: int) -> bool:
+        """
+        Checks if a message is too old to be delivered, counting it as dropped if it is
+        @param stamp: Timestamp of the message (nanoseconds)
+        """
+        if self.max_age is None or clock.get_clock().stamp() - stamp <= self.max_age * 1e9:
+            return False
+        self.stale.value += 1
+        return True
+
+    def depth(self) -> Optional[int]:
+        """
+        Gets the number of messages waiting to be delivered (None if the platform can't count them).
+        """
+        if self.flow is not None:
+            return self.flow.backlog.value
+        try:
+            return self.msg_queue.qsize() + (0 if self.ring is None else self.ring.depth())
+        except NotImplementedError:
+            return None
+
+    def put(self, item: Any):
+        """
+        Puts an item in the queue and wakes up the reader
+        @param item: The (value, timestamp) pair or the token of a local message
+        @details With a ring, the item is diverted through it to keep the order of the messages
+        """
+        if self.ring is not None:
+            self.ring.divert(self.msg_queue, item)
+            return
+        self.msg_queue.put(item)
+        self.available.release()
+
+    def get(self) -> Any:
+        """
+        Waits for an item of the queue (only used by the reader, for subscriptions without a ring)
+        """
+        self.available.acquire()
+        return self.msg_queue.get()
+
+    def attach_ring(self, ring: SPSCRing):
+        """
+        Makes the subscription receive the messages of its publisher through a ring
+        @param ring: The ring
+        @details
+        Messages already in the queue (published while the nodes were initialized) are counted as diverted,
+        so the reader takes them before the ones pushed to the ring. Only safe before the reader starts.
+        """
+        waiting = 0
+        while self.available.acquire(False):
+            waiting += 1
+        with ring.diverted.get_lock():
+            ring.diverted.value += waiting
+        self.ring = ring
+
+    def reset_reader(self):
+        """
+        Fixes the accounting of the subscription once its reader process has been killed
+        @details
+        The credits of the messages the reader had taken but not delivered are given back. The queued
+        messages stay for the next reader, their count is taken again from the queue (the reader may
+        have been killed while getting one). Only safe once the reader process is dead.
+        """
+        if self.flow is not None:
+            for _ in range(self.inflight.value):
+                self.flow.consumed()
+        self.inflight.value = 0
+
+        try:
+            waiting = self.msg_queue.qsize()
+        except NotImplementedError:
+            return
+        if self.ring is not None:
+            with self.ring.diverted.get_lock():
+                self.ring.diverted.value = waiting
+            return
+        while self.available.acquire(False):
+            pass
+        for _ in range(waiting):
+            self.available.release()
 
 
 class Topic:
@@ -50,24 +323,44 @@ class Topic:
         self.type: Optional[type] = None
         self.name = name
         self.subscribers: List[Callable[[Any, MessageContext], None]] = []
+        # Flow control of every subscriber (None for the subscribers that don't limit their queue)
+        self.flows: List[Optional[FlowControl]] = []
 
-    def publish(self, data: Any):
+    def publish(
+            self,
+            data: Any,
+            block: bool = False,
+            timeout: Optional[float] = None,
+            stamp: Optional[int] = None
+        ) -> PublishStatus:
         """
         Publishes data to the topic, triggering the callbacks of all subscribers.
         @param data: The data to be published.
+        @param block: Wait for the subscribers without credits instead of dropping the message for them.
+        @param timeout: Seconds to wait for all the subscribers (None waits forever).
+        @param stamp: Publication time in nanoseconds since the epoch (the current time of the clock by default).
+        @return: The state of the subscribers after the publication.
         """
+        dropped = 0
         if self.type == None:
             self.__set_type(type(data))
 
         # Check if types are valid
         if self.type != None and self.type == type(data):
             # Create new MessageContext
-            ctx = MessageContext(
-                timestamp=datetime.now()
-            )
+            # One context for all the subscribers of this publication
+            ctx = MessageContext(clock.get_clock().stamp() if stamp is None else stamp, self.name)
+            deadline = None if timeout is None else time.monotonic() + timeout
             # Run all callbacks
-            for sub in self.subscribers:
+            for sub, flow in zip(self.subscribers, self.flows):
+                if flow is not None:
+                    remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    if not flow.reserve(block, remaining):
+                        dropped += 1
+                        continue
                 sub(data, ctx)
+            for observer in observers:
+                observer(self.name, data, ctx)
         elif self.type != None:
             # Invalid data was passed
             msg = f'''
@@ -77,10 +370,41 @@ class Topic:
             log.error(msg)
             raise TypeError(msg)
 
-    def subscribe(self, callback: Callable[[Any, MessageContext], None]):
+        status = self.status()
+        status.dropped = dropped
+        return status
+
+    def status(self) -> PublishStatus:
+        """
+        Gets the credits and the backlog of the subscribers of the topic.
+        """
+        flows = [flow for flow in self.flows if flow is not None]
+        return PublishStatus(
+            credit=min(flow.credit() for flow in flows) if flows else None,
+            backlog=max(flow.backlog.value for flow in flows) if flows else 0
+        )
+
+    def wait_for_credit(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every subscriber of the topic can receive a message.
+        @param timeout: Seconds to wait (None waits forever).
+        @return: False if the timeout expired (or a subscriber read by the current process is full).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for flow in self.flows:
+            if flow is None:
+                continue
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not flow.credits.acquire(not flow.local(), remaining):
+                return False
+            flow.credits.release()
+        return True
+
+    def subscribe(self, callback: Callable[[Any, MessageContext], None], flow: Optional[FlowControl] = None):
         """
         Subscribes to the topic with a callback function.
         @param callback: The callback function to be triggered when a message is received.
+        @param flow: Credits of the subscriber (None if the callback is never blocked).
         """
         # Get information about callback
         callback_spec = inspect.getfullargspec(callback)
@@ -119,6 +443,7 @@ class Topic:
 
         # Add callback to list
         self.subscribers.append(callback)
+        self.flows.append(flow)
 
     def __set_type(self, t: type):
         """
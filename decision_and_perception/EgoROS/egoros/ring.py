@@ -0,0 +1,350 @@
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Iterator, List, Optional, Tuple
+import logging
+import multiprocessing
+import os
+import platform
+import struct
+import time
+
+log = logging.getLogger('egoros')
+
+CACHE_LINE = 64
+# Counters of the ring, every one in its own cache line so the producer and the consumer don't share lines
+HEAD = 0 # Bytes written (producer)
+TAIL = CACHE_LINE # Bytes read (consumer)
+PUSHED = 2 * CACHE_LINE # Messages written (producer)
+POPPED = 3 * CACHE_LINE # Messages read (consumer)
+OWNER = 4 * CACHE_LINE # Process id of the producer
+DATA = 5 * CACHE_LINE
+COUNTER = struct.Struct('<Q')
+OWNER_PID = struct.Struct('<q')
+# Payload length and publication timestamp (ns) of every record
+RECORD = struct.Struct('<Qq')
+RECORD_ALIGNMENT = RECORD.size
+# Length of the record that tells the consumer to continue from the start of the ring
+WRAP = 2**64 - 1
+# Seconds a process rejected by a live producer waits before checking the producer again
+OWNER_CHECK_PERIOD = 1.0
+# Python can't emit memory fences, so the ring relies on the processor never reordering stores with
+# other stores nor loads with other loads (total store order). Other architectures (ARM, POWER...) don't
+SUPPORTED = platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686')
+
+
+def align(size: int) -> int:
+    """
+    Rounds a size up to the alignment of the records
+    @param size: Size in bytes
+    """
+    return -(-size // RECORD_ALIGNMENT) * RECORD_ALIGNMENT
+
+def process_exists(pid: int) -> bool:
+    """
+    Checks if a process is still running
+    @param pid: Process id
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Notifier:
+    """
+    Wakes up the consumer of a ring (an eventfd, or a pipe where eventfd is not available)
+    """
+
+    def __init__(self) -> None:
+        if hasattr(os, 'eventfd'):
+            self.read_fd = self.write_fd = os.eventfd(0, os.EFD_NONBLOCK)
+        else:
+            self.read_fd, self.write_fd = os.pipe()
+            os.set_blocking(self.read_fd, False)
+            os.set_blocking(self.write_fd, False)
+
+    def notify(self):
+        """
+        Wakes up the consumer (it never blocks the producer)
+        """
+        try:
+            if self.read_fd == self.write_fd:
+                os.eventfd_write(self.write_fd, 1)
+            else:
+                os.write(self.write_fd, b'\0')
+        except BlockingIOError:
+            pass # The consumer already has pending notifications
+
+    def clear(self):
+        """
+        Consumes the pending notifications
+        """
+        try:
+            if self.read_fd == self.write_fd:
+                os.eventfd_read(self.read_fd)
+            else:
+                os.read(self.read_fd, 4096)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        """
+        Closes the file descriptors
+        """
+        os.close(self.read_fd)
+        if self.write_fd != self.read_fd:
+            os.close(self.write_fd)
+
+
+class SPSCRing:
+    """
+    Single producer, single consumer queue of messages in a shared memory ring
+    @details
+    The producer and the consumer only write their own counter (bytes and messages written or read),
+    so the ring needs no locks. Every record has the length and the timestamp of the message followed
+    by its pickled value; a record that doesn't fit before the end of the ring is written at the start,
+    after a WRAP marker. The counter of a side is written after its data, the ring relies on the
+    processor keeping the order of the stores (only use it where SUPPORTED is True).
+    The first process that pushes becomes the producer. Other processes are rejected (push returns False)
+    while it's alive, so their messages have to take another way.
+    Messages that can't be pushed go through a queue with divert(). The ring rejects pushes until the
+    consumer has taken every diverted message, so the messages of the producer keep their order.
+    The consumer spins for a while before sleeping on the notifier, every push wakes it up.
+    """
+
+    def __init__(self, capacity: int = 1 << 20, spin: float = 50e-6) -> None:
+        """
+        Constructor for the SPSCRing class
+        @param capacity: Size of the ring in bytes (rounded up to a power of 2)
+        @param spin: Seconds the consumer polls the ring before sleeping (it never spins on a single CPU,
+        the producer would not run while it spins)
+        """
+        self.capacity = 1 << max(capacity - 1, RECORD_ALIGNMENT).bit_length()
+        self.mask = self.capacity - 1
+        self.spin = spin if (os.cpu_count() or 1) > 1 else 0.0
+        self.shm = SharedMemory(create=True, size=DATA + self.capacity)
+        self.buf = self.shm.buf
+        self.buf[:DATA] = bytes(DATA)
+        self.notifier = Notifier()
+        # Only taken to become the producer
+        self.owner_lock = multiprocessing.Lock()
+        self.producer_pid = 0
+        # Until then, the current process does not check again if the producer is alive
+        self.owner_check = 0.0
+        # Messages sent through the queue that the consumer has not taken yet
+        self.diverted = multiprocessing.Value('Q', 0)
+
+    def depth(self) -> int:
+        """
+        Gets the number of messages waiting in the ring
+        """
+        return COUNTER.unpack_from(self.buf, PUSHED)[0] - COUNTER.unpack_from(self.buf, POPPED)[0]
+
+    def __claim(self, pid: int) -> bool:
+        """
+        Makes the current process the producer of the ring, if there is no other producer alive
+        @param pid: Process id of the current process
+        @return: True if the current process is the producer
+        @details A rejected process only checks the producer again after OWNER_CHECK_PERIOD seconds
+        """
+        owner = OWNER_PID.unpack_from(self.buf, OWNER)[0]
+        if owner != pid and owner != 0:
+            now = time.monotonic()
+            if now < self.owner_check:
+                return False
+            self.owner_check = now + OWNER_CHECK_PERIOD
+
+        with self.owner_lock:
+            owner = OWNER_PID.unpack_from(self.buf, OWNER)[0]
+            if owner != pid and owner != 0 and process_exists(owner):
+                return False
+            OWNER_PID.pack_into(self.buf, OWNER, pid)
+        self.producer_pid = pid
+        return True
+
+    def push(self, payload: bytes, stamp: int) -> bool:
+        """
+        Writes a message into the ring and wakes up the consumer
+        @param payload: The pickled message
+        @param stamp: Timestamp of the message (nanoseconds)
+        @return: False if the message was not written (the ring is full, the message does not fit,
+        diverted messages are pending or the current process is not the producer of the ring)
+        """
+        if self.diverted.value:
+            return False
+        pid = os.getpid()
+        if pid != self.producer_pid and not self.__claim(pid):
+            return False
+
+        size = align(RECORD.size + len(payload))
+        head = COUNTER.unpack_from(self.buf, HEAD)[0]
+        free = self.capacity - (head - COUNTER.unpack_from(self.buf, TAIL)[0])
+        position = head & self.mask
+        until_end = self.capacity - position
+        wrap = size > until_end
+        if size + (until_end if wrap else 0) > free:
+            return False
+
+        if wrap:
+            RECORD.pack_into(self.buf, DATA + position, WRAP, 0)
+            head += until_end
+            position = 0
+
+        start = DATA + position + RECORD.size
+        self.buf[start:start + len(payload)] = payload
+        RECORD.pack_into(self.buf, DATA + position, len(payload), stamp)
+        # Counted before being visible, so the depth is never negative
+        COUNTER.pack_into(self.buf, PUSHED, COUNTER.unpack_from(self.buf, PUSHED)[0] + 1)
+        COUNTER.pack_into(self.buf, HEAD, head + size)
+        self.notifier.notify()
+        return True
+
+    def pop_all(self) -> Iterator[Tuple[bytes, int]]:
+        """
+        Reads the messages waiting in the ring
+        @return: Generator of (pickled message, timestamp) pairs, every message is removed from the ring once read
+        """
+        tail = COUNTER.unpack_from(self.buf, TAIL)[0]
+        popped = COUNTER.unpack_from(self.buf, POPPED)[0]
+        while tail != COUNTER.unpack_from(self.buf, HEAD)[0]:
+            position = tail & self.mask
+            length, stamp = RECORD.unpack_from(self.buf, DATA + position)
+            if length == WRAP:
+                tail += self.capacity - position
+                COUNTER.pack_into(self.buf, TAIL, tail)
+                continue
+
+            start = DATA + position + RECORD.size
+            payload = bytes(self.buf[start:start + length])
+            tail += align(RECORD.size + length)
+            popped += 1
+            # The space is given back before delivering, the payload has already been copied
+            COUNTER.pack_into(self.buf, TAIL, tail)
+            COUNTER.pack_into(self.buf, POPPED, popped)
+            yield payload, stamp
+
+    def divert(self, queue: Any, item: Any):
+        """
+        Sends a message that was not pushed through a queue, and wakes up the consumer
+        @param queue: The queue read by the consumer (a multiprocessing.Queue)
+        @param item: The message
+        @details Any process can divert messages, the consumer takes them with take_diverted()
+        """
+        # Counted before it's put, so the producer stops pushing right away
+        with self.diverted.get_lock():
+            self.diverted.value += 1
+        queue.put(item)
+        self.notifier.notify()
+
+    def take_diverted(self, queue: Any) -> Iterator[Any]:
+        """
+        Reads the diverted messages that were waiting when called
+        @param queue: The queue the messages were diverted to
+        @return: Generator of the messages, every message is discounted once read
+        """
+        for _ in range(self.diverted.value):
+            # Counted messages are always put, get() only waits for the feeder thread of the queue
+            item = queue.get()
+            with self.diverted.get_lock():
+                self.diverted.value -= 1
+            yield item
+
+    def ready(self) -> bool:
+        """
+        Checks if there are pushed or diverted messages waiting
+        """
+        return self.depth() > 0 or self.diverted.value > 0
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until the ring has pushed or diverted messages
+        @param timeout: Seconds to wait (None waits forever)
+        @return: False if the timeout expired
+        """
+        deadline = time.perf_counter() + self.spin
+        while time.perf_counter() < deadline:
+            if self.ready():
+                return True
+
+        self.notifier.clear()
+        # Pushed while clearing the notifications, the producer already woke up the notifier before
+        if self.ready():
+            return True
+        return len(wait([self.notifier.read_fd], timeout)) > 0
+
+    def close(self):
+        """
+        Releases the shared memory of the ring (only called by the process that created it)
+        """
+        self.buf.release()
+        self.shm.close()
+        self.shm.unlink()
+        self.notifier.close()
+
+
+if __name__ == "__main__":
+    import pickle
+    import statistics
+    import sys
+
+    # Round trip latency between two processes: a message goes one way and its echo comes back
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    value = (0, bytes(256))
+    context = multiprocessing.get_context('fork')
+
+    def run_queue() -> List[float]:
+        requests, replies = context.Queue(), context.Queue()
+
+        def echo():
+            for _ in range(messages):
+                replies.put(requests.get())
+
+        process = context.Process(target=echo)
+        process.start()
+        samples = []
+        for _ in range(messages):
+            start = time.perf_counter_ns()
+            requests.put((value, start))
+            replies.get()
+            samples.append((time.perf_counter_ns() - start) / 1e3)
+        process.join()
+        return samples
+
+    def run_ring() -> List[float]:
+        requests, replies = SPSCRing(), SPSCRing()
+
+        def echo():
+            received = 0
+            while received < messages:
+                requests.wait()
+                for message, stamp in requests.pop_all():
+                    replies.push(pickle.dumps(pickle.loads(message), pickle.HIGHEST_PROTOCOL), stamp)
+                    received += 1
+
+        process = context.Process(target=echo)
+        process.start()
+        samples = []
+        for _ in range(messages):
+            start = time.perf_counter_ns()
+            requests.push(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), start)
+            received = []
+            while not received:
+                replies.wait()
+                received = list(replies.pop_all())
+            pickle.loads(received[0][0])
+            samples.append((time.perf_counter_ns() - start) / 1e3)
+        process.join()
+        requests.close()
+        replies.close()
+        return samples
+
+    print(f'{"transport":>18} {"p50 us":>8} {"p90 us":>8} {"p99 us":>8} {"mean us":>8}')
+    for name, run in [('multiprocessing.Queue', run_queue), ('SPSCRing', run_ring)]:
+        samples = sorted(run())
+        print(
+            f'{name:>18} {samples[len(samples) // 2]:>8.1f} {samples[int(len(samples) * 0.9)]:>8.1f} '
+            f'{samples[int(len(samples) * 0.99)]:>8.1f} {statistics.fmean(samples):>8.1f}'
+        )
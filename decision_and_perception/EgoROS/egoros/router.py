@@ -0,0 +1,148 @@
+from threading import RLock
+from typing import Any, Callable, Dict, List
+import logging
+
+log = logging.getLogger('egoros')
+
+SEPARATOR = '/'
+# Matches exactly one level of the topic name
+SINGLE_LEVEL = '*'
+# Matches any number of levels (including none)
+MULTI_LEVEL = '**'
+
+
+def split(name: str) -> List[str]:
+    """
+    Splits a topic name in its levels
+    @param name: The topic name (for example /sensors/lidar/front)
+    """
+    return [level for level in name.split(SEPARATOR) if level]
+
+def normalize(name: str) -> str:
+    """
+    Gets the canonical name of a topic: its levels joined by "/" (without leading, trailing or repeated separators)
+    @param name: The topic name (for example /sensors//lidar/ is sensors/lidar)
+    """
+    return SEPARATOR.join(split(name))
+
+def is_pattern(name: str) -> bool:
+    """
+    Checks if a topic name contains wildcards
+    @param name: The topic name
+    """
+    return any(level in (SINGLE_LEVEL, MULTI_LEVEL) for level in split(name))
+
+
+class PatternTrie:
+    """
+    Trie of topic patterns, indexed by their levels
+    """
+
+    def __init__(self) -> None:
+        self.children: Dict[str, 'PatternTrie'] = {}
+        self.watchers: List[Callable[[str, Any], None]] = []
+
+    def insert(self, levels: List[str], watcher: Callable[[str, Any], None]):
+        """
+        Adds a pattern to the trie
+        @param levels: Levels of the pattern
+        @param watcher: Function called with the matching topics
+        """
+        node = self
+        for level in levels:
+            node = node.children.setdefault(level, PatternTrie())
+        node.watchers.append(watcher)
+
+    def match(self, levels: List[str], start: int = 0) -> List[Callable[[str, Any], None]]:
+        """
+        Finds the patterns matching a topic name
+        @param levels: Levels of the topic name
+        @param start: First level still to be matched
+        @return: Watchers of the matching patterns
+        """
+        matched = []
+        if start == len(levels):
+            matched.extend(self.watchers)
+        else:
+            for key in (levels[start], SINGLE_LEVEL):
+                child = self.children.get(key)
+                if child is not None:
+                    matched.extend(child.match(levels, start + 1))
+
+        child = self.children.get(MULTI_LEVEL)
+        if child is not None:
+            for end in range(start, len(levels) + 1):
+                matched.extend(child.match(levels, end))
+
+        # A pattern reached through several paths (for example /a/**/**) is only reported once
+        return list(dict.fromkeys(matched))
+
+
+class TopicRouter(Dict[str, Any]):
+    """
+    Dictionary of the topics of an instance that resolves wildcard subscriptions
+    @details
+    Topic names are split in levels by "/". Patterns can use "*" for exactly one level and "**" for any
+    number of levels. Patterns are matched once, when a topic is added, so publishing never depends on
+    the number of patterns.
+    Names are normalized (see normalize), so "/a/b" and "a/b" are the same topic.
+    Nodes initialized in parallel take the lock to create topics and subscribe to them.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.patterns = PatternTrie()
+        # Reentrant, the watchers of a new topic subscribe to it while it's being added
+        self.lock = RLock()
+
+    def __getitem__(self, name: str) -> Any:
+        return super().__getitem__(normalize(name))
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and super().__contains__(normalize(name))
+
+    def __delitem__(self, name: str):
+        super().__delitem__(normalize(name))
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return super().get(normalize(name), default)
+
+    def __setitem__(self, name: str, topic: Any):
+        name = normalize(name)
+        if is_pattern(name):
+            msg = f'''
+    Tried to create the topic "{name}", wildcards can only be used to subscribe
+            '''
+            log.error(msg)
+            raise ValueError(msg)
+
+        with self.lock:
+            created = name not in self
+            super().__setitem__(name, topic)
+            if created:
+                for watcher in self.patterns.match(split(name)):
+                    watcher(name, topic)
+
+    def watch(self, pattern: str, watcher: Callable[[str, Any], None]):
+        """
+        Registers a function called with every topic matching a pattern
+        @param pattern: The pattern (for example /sensors/*/image or /sensors/**)
+        @param watcher: Function called with the name and the topic, for the existing and the new topics
+        """
+        trie = PatternTrie()
+        trie.insert(split(pattern), watcher)
+        with self.lock:
+            existing = [(name, topic) for name, topic in self.items() if trie.match(split(name))]
+            self.patterns.insert(split(pattern), watcher)
+            for name, topic in existing:
+                watcher(name, topic)
+
+
+if __name__ == "__main__":
+    router = TopicRouter()
+    router['/sensors/lidar/front'] = 'front lidar'
+    router.watch('/sensors/**', lambda name, topic: print('** matched', name))
+    router.watch('/sensors/*/image', lambda name, topic: print('* matched', name))
+    router['/sensors/camera/image'] = 'camera'
+    router['/control/cmd'] = 'command'
+    print('control/cmd' in router, list(router))
@@ -0,0 +1,253 @@
+from concurrent.futures import Future, wait
+from multiprocessing.connection import Client, Connection, Listener
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import itertools
+import logging
+import os
+import time
+import traceback
+
+log = logging.getLogger('egoros')
+
+
+class ServiceError(Exception):
+    """
+    Raised when a service can not be reached or its handler fails
+    """
+    pass
+
+
+def service_address(runtime_dir: str, name: str) -> str:
+    """
+    Gets the socket address of a service
+    @param runtime_dir: Runtime folder of the instance
+    @param name: Name of the service
+    @return: The path of the unix socket
+    """
+    return os.path.join(runtime_dir, f'svc-{name.replace(os.sep, "_")}.sock')
+
+
+class ServiceServer:
+    """
+    Serves the requests of a service
+    @details
+    Every client keeps a single connection open, requests and replies travel through that same
+    connection so no queue or topic is involved when answering.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Any], address: str) -> None:
+        """
+        Constructor for the ServiceServer class
+        @param name: Name of the service
+        @param handler: Function that computes the response of a request
+        @param address: Path of the unix socket where the service listens
+        @details
+        The socket is bound when the server is created, so calls made before the server is started
+        wait in the backlog instead of failing
+        """
+        self.name = name
+        self.handler = handler
+        self.address = address
+        self.listener = Listener(address, family='AF_UNIX')
+
+    def start(self):
+        """
+        Starts accepting connections in a background thread
+        """
+        Thread(target=self.__accept_worker, daemon=True).start()
+
+    def close(self):
+        """
+        Stops accepting connections
+        """
+        self.listener.close()
+
+    def __accept_worker(self):
+        """
+        Worker function that accepts new client connections
+        """
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break # Listener was closed
+
+            Thread(target=self.__connection_worker, args=[conn], daemon=True).start()
+
+    def __connection_worker(self, conn: Connection):
+        """
+        Worker function that answers the requests of a client
+        @param conn: Connection with the client
+        """
+        while True:
+            try:
+                request_id, request = conn.recv()
+            except (EOFError, OSError):
+                break # Client disconnected
+
+            try:
+                reply = (request_id, True, self.handler(request))
+            except Exception:
+                log.warning(f'''
+    Service "{self.name}" failed handling a request
+    Exception:
+        {traceback.format_exc()}
+                ''')
+                reply = (request_id, False, traceback.format_exc())
+
+            try:
+                conn.send(reply)
+            except (OSError, ValueError):
+                break
+
+
+class ServiceChannel:
+    """
+    Client side of the connection with a service
+    """
+
+    def __init__(self, name: str, conn: Connection) -> None:
+        """
+        Constructor for the ServiceChannel class
+        @param name: Name of the service
+        @param conn: Connection with the service server
+        """
+        self.name = name
+        self.conn = conn
+        self.lock = Lock()
+        self.pending: Dict[int, Tuple[Future, Optional[float]]] = {}
+        self.ids = itertools.count()
+        self.closed = False
+        Thread(target=self.__reply_worker, daemon=True).start()
+
+    def call(self, request: Any, timeout: Optional[float]) -> Future:
+        """
+        Sends a request through the channel
+        @param request: The request value
+        @param timeout: Seconds to wait for the reply (None waits forever)
+        @return: Future that will be resolved with the reply
+        """
+        future: Future = Future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            if self.closed:
+                future.set_exception(ServiceError(f'Connection with service "{self.name}" was closed'))
+                return future
+
+            request_id = next(self.ids)
+            self.pending[request_id] = (future, deadline)
+            try:
+                self.conn.send((request_id, request))
+            except (OSError, ValueError) as e:
+                del self.pending[request_id]
+                future.set_exception(ServiceError(f'Could not send request to service "{self.name}": {e}'))
+
+        return future
+
+    def __reply_worker(self):
+        """
+        Worker function that resolves the futures with the received replies
+        """
+        while True:
+            try:
+                if self.conn.poll(0.05):
+                    request_id, ok, value = self.conn.recv()
+                    with self.lock:
+                        entry = self.pending.pop(request_id, None)
+                    if entry is not None:
+                        if ok:
+                            entry[0].set_result(value)
+                        else:
+                            entry[0].set_exception(ServiceError(f'''
+    Service "{self.name}" failed handling the request:
+{value}
+                            '''))
+            except (EOFError, OSError):
+                break
+
+            self.__expire()
+
+        # Fail every request still waiting for a reply
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for future, _ in pending.values():
+            future.set_exception(ServiceError(f'Connection with service "{self.name}" was lost'))
+
+    def __expire(self):
+        """
+        Fails the requests whose timeout has expired
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired = [
+                request_id for request_id, (_, deadline) in self.pending.items()
+                if deadline is not None and deadline <= now
+            ]
+            futures = [self.pending.pop(request_id)[0] for request_id in expired]
+
+        for future in futures:
+            future.set_exception(TimeoutError(f'Service "{self.name}" did not reply in time'))
+
+
+class ServiceClient:
+    """
+    Calls services of the instance, reusing a single connection per service
+    """
+
+    def __init__(self, runtime_dir: str) -> None:
+        """
+        Constructor for the ServiceClient class
+        @param runtime_dir: Runtime folder of the instance
+        """
+        self.runtime_dir = runtime_dir
+        self.channels: Dict[str, ServiceChannel] = {}
+        self.lock = Lock()
+
+    def call(self, name: str, request: Any, timeout: Optional[float] = None) -> Future:
+        """
+        Calls a service
+        @param name: Name of the service
+        @param request: The request value
+        @param timeout: Seconds to wait for the reply (None waits forever)
+        @return: Future that will be resolved with the reply
+        """
+        try:
+            channel = self.__channel(name)
+        except OSError as e:
+            future: Future = Future()
+            future.set_exception(ServiceError(f'Service "{name}" is not available: {e}'))
+            return future
+
+        return channel.call(request, timeout)
+
+    def __channel(self, name: str) -> ServiceChannel:
+        """
+        Gets the channel of a service, connecting to it if necessary
+        @param name: Name of the service
+        """
+        with self.lock:
+            channel = self.channels.get(name)
+            if channel is None or channel.closed:
+                conn = Client(service_address(self.runtime_dir, name), family='AF_UNIX')
+                channel = ServiceChannel(name, conn)
+                self.channels[name] = channel
+
+            return channel
+
+
+def wait_all(futures: Iterable[Future], timeout: Optional[float] = None) -> List[Any]:
+    """
+    Waits for several service calls
+    @param futures: Futures returned by the calls
+    @param timeout: Maximum time to wait for all of them (None waits forever)
+    @return: The replies, in the same order as the futures
+    @details The exception of the first failed call is raised
+    """
+    futures = list(futures)
+    _, not_done = wait(futures, timeout)
+    if not_done:
+        raise TimeoutError(f'{len(not_done)} out of {len(futures)} service calls did not finish in time')
+
+    return [future.result() for future in futures]
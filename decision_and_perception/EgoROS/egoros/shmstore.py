@@ -0,0 +1,133 @@
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Optional, Tuple
+import fcntl
+import logging
+import pickle
+import struct
+
+log = logging.getLogger('egoros')
+
+# The state word is the version of the store, its parity selects the active slot
+STATE = struct.Struct('<Q')
+SLOT_HEADER = struct.Struct('<Q')
+
+
+class SharedStore:
+    """
+    Dictionary stored in shared memory that can be read by any process without IPC
+    @details
+    The region holds a state word followed by two slots. Writers serialize the new dictionary into
+    the inactive slot and then increment the state word, which bumps the version and swaps the active
+    slot in a single aligned write. Readers copy the active slot and check that the state word did not
+    change meanwhile (retrying otherwise), so they never see a partially written dictionary.
+    Checking if the store changed only costs reading the state word.
+    """
+
+    def __init__(self, name: str, lock_path: str, size: int = 1 << 16, create: bool = False) -> None:
+        """
+        Constructor for the SharedStore class
+        @param name: Name of the shared memory region
+        @param lock_path: Path of the file used to serialize writers of different processes
+        @param size: Capacity of every slot in bytes (only used when creating the region)
+        @param create: Whether the region has to be created or attached to
+        """
+        self.name = name
+        self.lock_path = lock_path
+        if create:
+            self.shm = SharedMemory(name, create=True, size=STATE.size + 2 * size)
+        else:
+            self.shm = SharedMemory(name)
+            # Attaching processes must not destroy the region when they exit (it's owned by its creator)
+            resource_tracker.unregister(self.shm._name, 'shared_memory') # type: ignore
+        self.owner = create
+        # The region may be bigger than requested (it's rounded to pages)
+        self.slot_size = (self.shm.size - STATE.size) // 2
+
+        if create:
+            STATE.pack_into(self.shm.buf, 0, 0)
+            self.__write_slot(0, pickle.dumps({}))
+
+        # State word and dictionary of the last read, replaced together so concurrent readers never mix them
+        self.cached: Tuple[Optional[int], Dict[str, Any]] = (None, {})
+
+    def state(self) -> int:
+        """
+        Reads the state word of the store
+        @return: Integer that changes every time the store is written
+        """
+        return STATE.unpack_from(self.shm.buf, 0)[0]
+
+    def read(self) -> Tuple[int, Dict[str, Any]]:
+        """
+        Reads the stored dictionary
+        @return: The state word and the dictionary (the dictionary must not be modified)
+        """
+        state = self.state()
+        cached_state, cached_value = self.cached
+        if state == cached_state:
+            return state, cached_value
+
+        while True:
+            offset = self.__slot_offset(state & 1)
+            length = SLOT_HEADER.unpack_from(self.shm.buf, offset)[0]
+            data = bytes(self.shm.buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length])
+            current = self.state()
+            if current == state:
+                break
+            state = current # A writer swapped the slots while reading, retry
+
+        value = pickle.loads(data)
+        self.cached = (state, value)
+        return state, value
+
+    def update(self, updater: Callable[[Dict[str, Any]], Dict[str, Any]]) -> int:
+        """
+        Atomically replaces the stored dictionary
+        @param updater: Function that receives a copy of the current dictionary and returns the new one
+        @return: The new state word
+        """
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state, value = self.read()
+                data = pickle.dumps(updater(dict(value)))
+                self.__write_slot(1 - (state & 1), data)
+                STATE.pack_into(self.shm.buf, 0, state + 1)
+                return state + 1
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def close(self):
+        """
+        Closes the store (the creator also destroys the shared memory region)
+        """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __slot_offset(self, slot: int) -> int:
+        """
+        Gets the offset of a slot inside the region
+        @param slot: Index of the slot (0 or 1)
+        """
+        return STATE.size + slot * self.slot_size
+
+    def __write_slot(self, slot: int, data: bytes):
+        """
+        Writes serialized data into a slot
+        @param slot: Index of the slot (0 or 1)
+        @param data: Serialized dictionary
+        """
+        capacity = self.slot_size - SLOT_HEADER.size
+        if len(data) > capacity:
+            msg = f'''
+    Tried to store {len(data)} bytes in the shared store "{self.name}"
+    The capacity of the store is {capacity} bytes
+            '''
+            log.error(msg)
+            raise ValueError(msg)
+
+        offset = self.__slot_offset(slot)
+        SLOT_HEADER.pack_into(self.shm.buf, offset, len(data))
+        self.shm.buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
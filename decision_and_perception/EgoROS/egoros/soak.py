@@ -0,0 +1,284 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import array
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from .memory import read_rss
+
+log = logging.getLogger('egoros')
+
+# Source of every synthetic node, filled with its parameters
+NODE_TEMPLATE = '''
+import array
+import json
+import os
+import time
+from egoros.node import Configuration
+
+NAME = {name!r}
+PUBLISHES = {publishes!r}
+SUBSCRIBES = {subscribes!r}
+PAYLOAD = bytes({payload})
+RESULTS = {results!r}
+QUEUE_SIZE = {queue_size!r}
+# Messages published while warming up are not measured
+MEASURE_FROM = {measure_from!r}
+
+stats = {{'received': 0, 'gaps': 0, 'publish_drops': 0}}
+expected = {{}}
+latencies = array.array('d')
+seq = [0]
+
+def on_message(msg, ctx):
+    if ctx.stamp < MEASURE_FROM:
+        expected[ctx.topic] = msg[0]
+        return
+    latencies.append((time.time_ns() - ctx.stamp) / 1e6)
+    stats['received'] += 1
+    last = expected.get(ctx.topic)
+    if last is not None and msg[0] > last + 1:
+        stats['gaps'] += msg[0] - last - 1
+    expected[ctx.topic] = msg[0]
+
+def flush():
+    path = os.path.join(RESULTS, f'{{NAME}}-{{os.getpid()}}')
+    with open(path + '.lat', 'ab') as output:
+        latencies.tofile(output)
+    del latencies[:]
+    with open(path + '.tmp', 'w') as output:
+        json.dump(stats, output)
+    os.replace(path + '.tmp', path + '.json')
+
+def init(node):
+    for topic in SUBSCRIBES:
+        node.subscribe(topic, on_message, QUEUE_SIZE)
+    node.create_timer(0.5, flush)
+    return Configuration(name=NAME, tick_rate={tick_rate}, publishes=PUBLISHES)
+
+def tick(node):
+    seq[0] += 1
+    for topic in PUBLISHES:
+        status = node.publish(topic, (seq[0], PAYLOAD))
+        stats['publish_drops'] += status.dropped
+    if seq[0] % {flush_ticks} == 0:
+        flush()
+'''
+
+
+@dataclass
+class FleetConfig:
+    """
+    Shape of a synthetic node fleet
+    @param tick_rate Ticks per second of every node (every tick publishes on all the topics of the node)
+    @param fan_in Topics every node subscribes to
+    @param fan_out Topics every node publishes
+    @param payload Bytes of payload of every message
+    @param queue_size Queue size of the subscriptions (None for unbounded queues)
+    """
+    tick_rate: float = 10
+    fan_in: int = 2
+    fan_out: int = 1
+    payload: int = 1024
+    queue_size: Optional[int] = None
+
+
+@dataclass
+class SoakReport:
+    """
+    Measurements of a fleet run
+    @param dropped Messages that never reached a subscriber (gaps in the sequences it received)
+    @param publish_drops Messages dropped by the publishers for subscribers without credits (with a queue size),
+    they are also counted as dropped by the subscribers that missed them
+    """
+    nodes: int
+    processes: int = 0
+    threads: int = 0
+    rss: int = 0
+    received: int = 0
+    dropped: int = 0
+    publish_drops: int = 0
+    latencies: Dict[str, float] = field(default_factory=dict)
+
+
+def generate_fleet(folder: str, results: str, size: int, config: FleetConfig, measure_from: int = 0):
+    """
+    Writes the sources of a fleet of synthetic nodes
+    @param folder: Folder where the nodes are written
+    @param results: Folder where the nodes write their measurements
+    @param size: Number of nodes
+    @param config: Shape of the fleet
+    @param measure_from: Time (ns since the epoch) of the first publication measured
+    """
+    topics = [f'/soak/n{index}/out{output}' for index in range(size) for output in range(config.fan_out)]
+    for index in range(size):
+        # Every node reads the outputs of the next nodes, so the fan out of all the topics is similar
+        own = topics[index * config.fan_out:(index + 1) * config.fan_out]
+        others = [topic for topic in topics if topic not in own] or own
+        start = (index + 1) * config.fan_out
+        subscribes = [others[(start + offset) % len(others)] for offset in range(min(config.fan_in, len(others)))]
+
+        with open(os.path.join(folder, f'n{index}.py'), 'w') as source:
+            source.write(NODE_TEMPLATE.format(
+                name=f'n{index}',
+                publishes=own,
+                subscribes=subscribes,
+                payload=config.payload,
+                results=results,
+                queue_size=config.queue_size,
+                tick_rate=config.tick_rate,
+                measure_from=measure_from,
+                flush_ticks=max(1, int(config.tick_rate))
+            ))
+
+def process_tree(pid: int) -> List[int]:
+    """
+    Gets a process and all its descendants
+    @param pid: Process id of the root
+    """
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The name of the process may contain spaces, fields are read after its closing parenthesis
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    tree = [pid]
+    for current in tree:
+        tree.extend(children.get(current, []))
+    return tree
+
+def count_threads(pid: int) -> int:
+    """
+    Gets the number of threads of a process
+    @param pid: Process id
+    """
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+    Gets a percentile of some sorted values
+    @param ordered: The values, sorted
+    @param fraction: The percentile (between 0 and 1)
+    """
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_instance(folder: str, duration: float):
+    """
+    Runs an instance with the nodes of a folder (target of the instance process)
+    @param folder: Folder with the nodes
+    @param duration: Seconds to run
+    """
+    from . import instance
+    from . import utils
+    os.chdir(folder)
+    # The output of the instance would be mixed with the report
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    utils.configure_logger()
+    instance.EgoInstance(utils.get_node_filenames_from_path('nodes')).spin(duration)
+
+def read_results(results: str, report: SoakReport) -> List[float]:
+    """
+    Adds the measurements written by the nodes to a report
+    @param results: Folder where the nodes wrote their measurements
+    @param report: The report, its counters are increased
+    @return: The latencies of the received messages in milliseconds
+    """
+    latencies: List[float] = []
+    for entry in os.listdir(results):
+        path = os.path.join(results, entry)
+        if entry.endswith('.json'):
+            with open(path) as stats:
+                counters = json.load(stats)
+            report.received += counters['received']
+            # Publisher drops show up as gaps in the subscribers, they are only counted once
+            report.dropped += counters['gaps']
+            report.publish_drops += counters['publish_drops']
+        elif entry.endswith('.lat'):
+            values = array.array('d')
+            with open(path, 'rb') as samples:
+                values.frombytes(samples.read())
+            latencies.extend(values)
+    return latencies
+
+def soak(size: int, config: FleetConfig, duration: float, warmup: float = 2.0) -> SoakReport:
+    """
+    Runs a fleet of synthetic nodes and measures the instance
+    @param size: Number of nodes
+    @param config: Shape of the fleet
+    @param duration: Seconds the fleet runs after warming up
+    @param warmup: Seconds ignored after starting the fleet
+    @return: The measurements of the run
+    """
+    folder = tempfile.mkdtemp(prefix=f'egoros-soak-{size}-')
+    nodes = os.path.join(folder, 'nodes')
+    results = os.path.join(folder, 'results')
+    os.makedirs(nodes)
+    os.makedirs(results)
+    generate_fleet(nodes, results, size, config, time.time_ns() + int(warmup * 1e9))
+
+    report = SoakReport(nodes=size)
+    process = multiprocessing.get_context('fork').Process(target=run_instance, args=(folder, warmup + duration))
+    process.start()
+    try:
+        # Resources are sampled in the middle of the measured period
+        time.sleep(warmup + duration / 2)
+        tree = process_tree(process.pid)
+        report.processes = len(tree)
+        report.threads = sum(count_threads(pid) for pid in tree)
+        report.rss = sum(read_rss(pid) for pid in tree)
+        process.join(duration / 2 + 30)
+    finally:
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    latencies = read_results(results, report)
+    if latencies:
+        latencies.sort()
+        report.latencies = {
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+            'mean': statistics.fmean(latencies)
+        }
+
+    shutil.rmtree(folder, ignore_errors=True)
+    return report
+
+def format_report(report: SoakReport) -> str:
+    """
+    Formats the measurements of a run as a row of the report table
+    @param report: The measurements
+    """
+    latency = report.latencies
+    return (
+        f'{report.nodes:>5} {report.processes:>6} {report.threads:>8} {report.rss / 2**20:>10.1f} '
+        f'{report.received:>10} {report.dropped:>8} {report.publish_drops:>10} '
+        + ' '.join(f'{latency.get(key, float("nan")):>8.2f}' for key in ['p50', 'p90', 'p99', 'max'])
+    )
+
+REPORT_HEADER = (
+    f'{"nodes":>5} {"procs":>6} {"threads":>8} {"RSS (MiB)":>10} {"received":>10} {"dropped":>8} {"pub drops":>10} '
+    f'{"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}'
+)
@@ -0,0 +1,106 @@
+from bisect import insort
+from threading import Lock
+from typing import Any, Callable, List, Sequence, Tuple
+import logging
+from .pubsub import MessageContext
+
+log = logging.getLogger('egoros')
+
+
+class ApproximateTimeSynchronizer:
+    """
+    Matches messages from several topics by their timestamp.
+    @details
+    Every topic has its own time-sorted buffer, bounded to queue_size messages (the oldest message
+    is discarded when the buffer is full). A set is emitted once every buffer has a candidate and
+    the spread between the oldest and the newest candidate is within the slop. Candidates that can
+    never be part of a set are discarded as soon as they are detected, so matching is O(topics).
+    """
+
+    def __init__(
+            self,
+            topics: Sequence[str],
+            callback: Callable[[Tuple[Any, ...], Tuple[MessageContext, ...]], None],
+            slop: float,
+            queue_size: int = 10
+        ) -> None:
+        """
+        Constructor for the ApproximateTimeSynchronizer class
+        @param topics: Names of the synchronized topics (the order is kept in the emitted tuples)
+        @param callback: Callback triggered with the tuple of matched values and the tuple of their contexts
+        @param slop: Maximum time difference (in seconds) between the messages of a matched set
+        @param queue_size: Maximum number of messages buffered per topic
+        """
+        if len(topics) < 2:
+            msg = f'''
+    At least two topics are needed to synchronize messages (got {list(topics)})
+            '''
+            log.error(msg)
+            raise ValueError(msg)
+
+        if queue_size < 1:
+            msg = f'''
+    Invalid queue size {queue_size} for synchronized topics {list(topics)}
+            '''
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.topics = list(topics)
+        self.callback = callback
+        self.slop = slop
+        self.queue_size = queue_size
+        # Buffers contain (timestamp, arrival order, value, context) tuples sorted by timestamp
+        self.buffers: List[List[Tuple[float, int, Any, MessageContext]]] = [[] for _ in self.topics]
+        self.arrivals = 0
+        self.lock = Lock()
+
+    def add(self, index: int, value: Any, ctx: MessageContext):
+        """
+        Adds a message to the buffer of a topic and emits all the sets that can be matched
+        @param index: Index of the topic (in the list provided to the constructor)
+        @param value: The message value
+        @param ctx: The message context
+        """
+        matched = []
+        with self.lock:
+            buffer = self.buffers[index]
+            # The arrival counter avoids comparing values when two timestamps are equal
+            insort(buffer, (ctx.seconds, self.arrivals, value, ctx))
+            self.arrivals += 1
+            if len(buffer) > self.queue_size:
+                del buffer[0]
+
+            while all(self.buffers):
+                match = self.__match()
+                if match is None:
+                    continue
+                matched.append(match)
+
+        # Callbacks are run outside of the lock so other topics can keep buffering
+        for values, contexts in matched:
+            self.callback(values, contexts)
+
+    def __match(self):
+        """
+        Tries to match the heads of all buffers
+        @return The (values, contexts) tuples if a set was matched. Otherwise None, after discarding
+        the message that can not be matched anymore
+        """
+        pivot = max(buffer[0][0] for buffer in self.buffers)
+
+        # A head is dominated if the next message is still not newer than the pivot (it is closer to it)
+        for buffer in self.buffers:
+            while len(buffer) > 1 and buffer[1][0] <= pivot:
+                del buffer[0]
+
+        oldest = min(self.buffers, key=lambda buffer: buffer[0][0])
+        if pivot - oldest[0][0] > self.slop:
+            # Every other candidate is at least as new as the pivot, so the oldest message can't match
+            del oldest[0]
+            return None
+
+        heads = [buffer.pop(0) for buffer in self.buffers]
+        return (
+            tuple(head[2] for head in heads),
+            tuple(head[3] for head in heads)
+        )
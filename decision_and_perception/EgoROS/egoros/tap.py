@@ -0,0 +1,444 @@
+from dataclasses import dataclass, field
+from multiprocessing.connection import Client, Connection, Listener
+from threading import Condition, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import time
+import traceback
+from . import utils
+from .pubsub import MessageContext
+from .router import normalize
+from .shmstore import SharedStore
+
+log = logging.getLogger('egoros')
+
+
+def tap_address(runtime_dir: str) -> str:
+    """
+    Gets the socket address of the tap server of an instance
+    @param runtime_dir: Runtime folder of the instance
+    """
+    return os.path.join(runtime_dir, 'tap.sock')
+
+def project(value: Any, fields: List[str]) -> Dict[str, Any]:
+    """
+    Extracts some fields of a message
+    @param value: The message value
+    @param fields: Paths of the fields, with dots separating the levels (for example "pose.x" or "ranges.0")
+    @return: Dictionary with the value of every field (None if the field does not exist)
+    """
+    projected = {}
+    for path in fields:
+        current = value
+        for key in path.split('.'):
+            try:
+                if isinstance(current, dict):
+                    current = current[key]
+                elif key.isdigit() and hasattr(current, '__getitem__'):
+                    current = current[int(key)]
+                else:
+                    current = getattr(current, key)
+            except (KeyError, IndexError, AttributeError, ValueError, TypeError):
+                current = None
+                break
+        projected[path] = current
+    return projected
+
+
+class TapPublisher:
+    """
+    Publisher side of the tap, it hands the messages of tapped topics to the tap server
+    @details
+    The set of tapped topics lives in shared memory, so checking if a message has to be tapped only
+    costs a memory read while the set does not change. Messages are handed through a bounded queue,
+    publishers never wait for the server (messages are dropped if it falls behind).
+    """
+
+    def __init__(self, store: SharedStore, max_pending: int) -> None:
+        """
+        Constructor for the TapPublisher class
+        @param store: Shared store with the tapped topics
+        @param max_pending: Maximum number of messages waiting for the server
+        """
+        self.store = store
+        self.queue: multiprocessing.Queue = multiprocessing.Queue(max_pending)
+        self.dropped = multiprocessing.Value('L', 0, lock=False)
+
+    def offer(self, topic: str, value: Any, ctx: MessageContext):
+        """
+        Hands a published message to the tap server if its topic is tapped
+        @param topic: The topic of the message
+        @param value: The message value
+        @param ctx: The message context
+        """
+        if topic not in self.store.read()[1]:
+            return
+
+        try:
+            # Pickled right away, the publisher may reuse the message (array topics overwrite their slots)
+            self.queue.put_nowait((topic, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ctx.seconds))
+        except queue.Full:
+            self.dropped.value += 1
+
+
+class TopicDirectory:
+    """
+    Topics published by the nodes of every process of the instance, with their type and publishers
+    @details
+    Topics created after the workers are forked only exist in the process that created them, so every
+    process records the topics it publishes in shared memory (used by the topic list and info commands).
+    The store is only written the first time a node publishes a topic from a process.
+    """
+
+    def __init__(self, store: SharedStore) -> None:
+        """
+        Constructor for the TopicDirectory class
+        @param store: Shared store with the recorded topics
+        """
+        self.store = store
+        # Topics and publishers already recorded by this process (forked workers inherit the ones of their parent)
+        self.recorded: Set[Tuple[str, str]] = set()
+
+    def record(self, topic: str, publisher: str, data_type: type):
+        """
+        Records that a node publishes a topic
+        @param topic: The topic
+        @param publisher: Name of the node
+        @param data_type: Type of the published messages
+        """
+        if (topic, publisher) in self.recorded:
+            return
+        self.recorded.add((topic, publisher))
+
+        def updater(topics: Dict[str, Any]) -> Dict[str, Any]:
+            recorded = topics.get(topic, {'type': data_type.__name__, 'publishers': []})
+            if publisher not in recorded['publishers']:
+                recorded = {'type': recorded['type'], 'publishers': recorded['publishers'] + [publisher]}
+            topics[topic] = recorded
+            return topics
+
+        try:
+            self.store.update(updater)
+        except ValueError:
+            log.warning(f'Topic {topic} could not be recorded for the tap: {traceback.format_exc()}')
+
+    def topics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Gets the recorded topics
+        @return: Dictionary indexed by topic with its "type" and "publishers" (it must not be modified)
+        """
+        return self.store.read()[1]
+
+
+@dataclass
+class TapSubscription:
+    """
+    Subscription of a tap client to a topic
+    @param decimation Only one out of every decimation messages is sent
+    @param max_rate Maximum messages per second sent (None for no limit)
+    @param fields Fields sent to the client (None sends the whole message)
+    """
+    decimation: int = 1
+    max_rate: Optional[float] = None
+    fields: Optional[List[str]] = None
+    received: int = 0
+    last_sent: float = 0.0
+
+
+@dataclass
+class TapSession:
+    """
+    Connection of a tap client
+    @param conn Connection with the client
+    @param subscriptions Subscriptions of the client, indexed by topic
+    @param outgoing Messages waiting to be sent (the oldest are dropped if the client is too slow)
+    """
+    conn: Connection
+    subscriptions: Dict[str, TapSubscription] = field(default_factory=dict)
+    outgoing: List[Tuple] = field(default_factory=list)
+    condition: Condition = field(default_factory=Condition)
+    closed: bool = False
+
+
+class TapServer:
+    """
+    Lets external processes subscribe to the topics of a running instance through a unix socket
+    @details
+    Decimation and field projection are applied by the server, so clients only receive what they need
+    and publishers only pay for handing the tapped messages to the server.
+    """
+
+    def __init__(self, runtime_dir: str, pid: int, max_pending: int = 1024, max_outgoing: int = 256) -> None:
+        """
+        Constructor for the TapServer class
+        @param runtime_dir: Runtime folder of the instance
+        @param pid: Process id of the instance
+        @param max_pending: Maximum number of messages waiting for the server
+        @param max_outgoing: Maximum number of messages waiting to be sent to every client
+        """
+        self.store = SharedStore(
+            name=f'egoros-tap-{pid}',
+            lock_path=os.path.join(runtime_dir, 'tap.lock'),
+            size=1 << 14,
+            create=True
+        )
+        self.publisher = TapPublisher(self.store, max_pending)
+        self.directory = TopicDirectory(SharedStore(
+            name=f'egoros-topics-{pid}',
+            lock_path=os.path.join(runtime_dir, 'topics.lock'),
+            size=1 << 16,
+            create=True
+        ))
+        self.listener = Listener(tap_address(runtime_dir), family='AF_UNIX')
+        self.max_outgoing = max_outgoing
+        self.sessions: List[TapSession] = []
+        self.lock = Lock()
+        self.topics: Dict[str, Any] = {}
+        # Returns the publishers, subscribers and queue depths of every topic (set by the instance)
+        self.describe: Callable[[], Dict[str, Dict[str, Any]]] = lambda: {}
+
+    def start(self, topics: Dict[str, Any]):
+        """
+        Starts serving clients in background threads
+        @param topics: Topics of the instance process (listed to the clients with the ones in the directory)
+        """
+        self.topics = topics
+        Thread(target=self.__accept_worker, daemon=True).start()
+        Thread(target=self.__dispatch_worker, daemon=True).start()
+
+    def close(self):
+        """
+        Stops the server
+        """
+        self.listener.close()
+        with self.lock:
+            for session in self.sessions:
+                session.conn.close()
+        self.store.close()
+        self.directory.store.close()
+
+    def __update_tapped(self):
+        """
+        Publishes the set of topics tapped by any client
+        """
+        with self.lock:
+            tapped = {topic: True for session in self.sessions for topic in session.subscriptions}
+        self.store.update(lambda _: tapped)
+
+    def __accept_worker(self):
+        """
+        Worker function that accepts new clients
+        """
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break # Listener was closed
+
+            session = TapSession(conn)
+            with self.lock:
+                self.sessions.append(session)
+            Thread(target=self.__request_worker, args=[session], daemon=True).start()
+            Thread(target=self.__send_worker, args=[session], daemon=True).start()
+
+    def __request_worker(self, session: TapSession):
+        """
+        Worker function that handles the requests of a client
+        @param session: The client session
+        """
+        while True:
+            try:
+                request = session.conn.recv()
+            except (EOFError, OSError):
+                break # Client disconnected
+
+            action = request.get('action')
+            if action == 'subscribe':
+                session.subscriptions[normalize(request['topic'])] = TapSubscription(
+                    decimation=max(1, request.get('decimation', 1)),
+                    max_rate=request.get('max_rate'),
+                    fields=request.get('fields')
+                )
+                self.__update_tapped()
+            elif action == 'unsubscribe':
+                session.subscriptions.pop(normalize(request['topic']), None)
+                self.__update_tapped()
+            elif action == 'list':
+                # Topics created after forking are only in the directory
+                topics = set(self.topics.keys()) | set(self.directory.topics().keys())
+                self.__queue(session, ('topics', sorted(topics)))
+            elif action == 'info':
+                self.__queue(session, ('info', self.describe()))
+
+        with self.lock:
+            self.sessions.remove(session)
+        with session.condition:
+            session.closed = True
+            session.condition.notify()
+        self.__update_tapped()
+
+    def __dispatch_worker(self):
+        """
+        Worker function that decimates, projects and distributes the tapped messages
+        """
+        while True:
+            try:
+                topic, pickled, timestamp = self.publisher.queue.get()
+            except (EOFError, OSError):
+                break
+            value = pickle.loads(pickled)
+
+            with self.lock:
+                sessions = list(self.sessions)
+
+            now = time.monotonic()
+            for session in sessions:
+                subscription = session.subscriptions.get(topic)
+                if subscription is None:
+                    continue
+
+                subscription.received += 1
+                if (subscription.received - 1) % subscription.decimation != 0:
+                    continue
+                if subscription.max_rate is not None and now - subscription.last_sent < 1.0 / subscription.max_rate:
+                    continue
+                subscription.last_sent = now
+
+                sent = value if subscription.fields is None else project(value, subscription.fields)
+                self.__queue(session, ('message', topic, sent, timestamp))
+
+    def __queue(self, session: TapSession, item: Tuple):
+        """
+        Queues an item to be sent to a client
+        @param session: The client session
+        @param item: The item to send
+        """
+        with session.condition:
+            if len(session.outgoing) >= self.max_outgoing:
+                del session.outgoing[0]
+            session.outgoing.append(item)
+            session.condition.notify()
+
+    def __send_worker(self, session: TapSession):
+        """
+        Worker function that sends the queued items to a client
+        @param session: The client session
+        """
+        while True:
+            with session.condition:
+                session.condition.wait_for(lambda: session.outgoing or session.closed)
+                if session.closed:
+                    break
+                items, session.outgoing = session.outgoing, []
+
+            try:
+                for item in items:
+                    session.conn.send(item)
+            except (OSError, ValueError):
+                break
+
+
+class TapClient:
+    """
+    Client of the tap server of a running instance
+    """
+
+    def __init__(self, pid: Optional[int] = None) -> None:
+        """
+        Constructor for the TapClient class
+        @param pid: Process id of the instance (default: the latest running instance)
+        """
+        if pid is None:
+            pid = utils.find_instance_pid()
+        self.conn = Client(tap_address(utils.get_runtime_dir(pid)), family='AF_UNIX')
+        self.pending: List[Tuple] = []
+
+    def subscribe(
+            self,
+            topic: str,
+            decimation: int = 1,
+            max_rate: Optional[float] = None,
+            fields: Optional[List[str]] = None
+        ):
+        """
+        Subscribes to a topic
+        @param topic: The topic to subscribe to
+        @param decimation: Only one out of every decimation messages is received
+        @param max_rate: Maximum messages per second received (None for no limit)
+        @param fields: Paths of the received fields, with dots separating levels (None receives the whole message)
+        """
+        self.conn.send({
+            'action': 'subscribe',
+            'topic': topic,
+            'decimation': decimation,
+            'max_rate': max_rate,
+            'fields': fields
+        })
+
+    def unsubscribe(self, topic: str):
+        """
+        Unsubscribes from a topic
+        @param topic: The topic
+        """
+        self.conn.send({'action': 'unsubscribe', 'topic': topic})
+
+    def list_topics(self, timeout: float = 1.0) -> List[str]:
+        """
+        Lists the topics of the instance
+        @param timeout: Seconds to wait for the reply
+        """
+        return self.__request('list', 'topics', timeout)
+
+    def info(self, timeout: float = 1.0) -> Dict[str, Dict[str, Any]]:
+        """
+        Gets the publishers, the subscribers and the queue depths of the topics of the instance
+        @param timeout: Seconds to wait for the reply
+        @return: Dictionary indexed by topic with its "type", "publishers" and "subscribers" (node name to queue depth)
+        """
+        return self.__request('info', 'info', timeout)
+
+    def __request(self, action: str, reply: str, timeout: float) -> Any:
+        """
+        Sends a request to the server and waits for its reply (messages received meanwhile are kept)
+        @param action: The requested action
+        @param reply: Kind of the reply item
+        @param timeout: Seconds to wait for the reply
+        @return: The content of the reply
+        """
+        self.conn.send({'action': action})
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                raise TimeoutError(f'Tap server did not reply to "{action}" in time')
+            item = self.conn.recv()
+            if item[0] == reply:
+                return item[1]
+            self.pending.append(item)
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Tuple[str, Any, float]]:
+        """
+        Receives the next message of the subscribed topics
+        @param timeout: Seconds to wait (None waits forever)
+        @return: The (topic, value, timestamp) tuple, or None if the timeout expired
+        """
+        while True:
+            if self.pending:
+                item = self.pending.pop(0)
+            elif self.conn.poll(timeout):
+                item = self.conn.recv()
+            else:
+                return None
+
+            if item[0] == 'message':
+                return item[1], item[2], item[3]
+
+    def close(self):
+        """
+        Closes the connection with the server
+        """
+        self.conn.close()
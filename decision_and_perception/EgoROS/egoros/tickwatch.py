@@ -0,0 +1,312 @@
+from dataclasses import dataclass
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import faulthandler
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+log = logging.getLogger('egoros')
+
+# Topic where the instance publishes the Diagnostic messages
+DIAGNOSTICS_TOPIC = 'egoros/diagnostics'
+# Signal used to ask a worker for the stack of its threads
+STACK_SIGNAL = signal.SIGUSR2
+ACTIONS = ['warn', 'restart', 'escalate']
+
+# Fields of the shared tick state
+STARTED = 0
+LAST_DURATION = 1
+OVERRUNS = 2
+PID = 3
+TICKS = 4
+
+
+def stack_path(runtime_dir: str, pid: int) -> str:
+    """
+    Gets the path where a worker dumps the stack of its threads
+    @param runtime_dir: Runtime folder of the instance
+    @param pid: Process id of the worker
+    """
+    return os.path.join(runtime_dir, f'stack-{pid}.txt')
+
+def register_stack_dump(runtime_dir: str):
+    """
+    Makes the current worker dump the stack of all its threads when it receives STACK_SIGNAL
+    @param runtime_dir: Runtime folder of the instance
+    @details The stack is dumped by faulthandler, so it works even if the stuck thread never releases the GIL
+    """
+    dump = open(stack_path(runtime_dir, os.getpid()), 'w')
+    faulthandler.register(STACK_SIGNAL, file=dump, all_threads=True)
+
+
+@dataclass
+class Diagnostic:
+    """
+    Diagnostic published by the instance about a node
+    @param node Name of the node
+    @param level Severity of the diagnostic ("warning" or "error")
+    @param kind What happened ("overrun" when a tick ran over budget, "stall" when a tick missed the watchdog timeout)
+    @param message Human readable description
+    @param duration Seconds the tick took (or has been running for, if it's stalled)
+    @param stack Stack of the threads of the stuck worker (only for stalls)
+    """
+    node: str
+    level: str
+    kind: str
+    message: str
+    duration: float
+    stack: Optional[str] = None
+
+
+class TickState:
+    """
+    Progress of the ticks of a node, shared between its worker and the instance
+    """
+
+    def __init__(self) -> None:
+        # A single worker writes the state, the instance only reads it
+        self.values = multiprocessing.Array('d', 5, lock=False)
+
+    def begin(self):
+        """
+        Marks the start of a tick in the current worker
+        """
+        self.values[PID] = os.getpid()
+        self.values[STARTED] = time.monotonic()
+
+    def end(self, budget: Optional[float]):
+        """
+        Marks the end of a tick in the current worker
+        @param budget: Seconds the tick was allowed to take (None for no budget)
+        """
+        duration = time.monotonic() - self.values[STARTED]
+        self.values[LAST_DURATION] = duration
+        self.values[STARTED] = 0.0
+        self.values[TICKS] += 1
+        if budget is not None and duration > budget:
+            self.values[OVERRUNS] += 1
+
+    def reset(self):
+        """
+        Forgets the tick being run (used when the worker is killed)
+        """
+        self.values[STARTED] = 0.0
+
+    def running_for(self) -> Optional[float]:
+        """
+        Gets the seconds the current tick has been running (None if the node is not ticking)
+        """
+        started = self.values[STARTED]
+        return None if started == 0.0 else time.monotonic() - started
+
+
+class Watchdog:
+    """
+    Watches the ticks of the nodes of the instance
+    @details
+    Ticks over the Configuration.tick_budget of their node are reported on DIAGNOSTICS_TOPIC. Ticks running
+    for longer than Configuration.watchdog_timeout are reported with the stack of the stuck worker, and
+    then Configuration.watchdog_action is applied:
+    - warn: only reports the stall
+    - restart: restarts the node. A node restarted from its checkpoint may stall again right away, so
+    consecutive restarts (without a completed tick in between) wait twice as long as the previous one,
+    and the node is left stalled after max_restarts of them
+    - escalate: stops the whole instance
+    """
+
+    def __init__(
+            self,
+            nodes: List,
+            runtime_dir: str,
+            publish: Callable[[Diagnostic], Any],
+            escalate: Callable[[], None],
+            period: float = 0.1,
+            backoff: float = 1.0,
+            max_restarts: int = 5
+        ) -> None:
+        """
+        Constructor for the Watchdog class
+        @param nodes: The started EgoNodes
+        @param runtime_dir: Runtime folder of the instance
+        @param publish: Function that publishes the diagnostics
+        @param escalate: Function that stops the instance
+        @param period: Seconds between checks
+        @param backoff: Seconds the second consecutive restart of a node waits (doubled for every following one)
+        @param max_restarts: Consecutive restarts after which a stalled node is not restarted anymore
+        """
+        for node in nodes:
+            if node.config.watchdog_action not in ACTIONS:
+                msg = f'''
+    Node {node.config.name} has an unknown watchdog action "{node.config.watchdog_action}".
+    Valid actions are: {', '.join(ACTIONS)}
+                '''
+                log.error(msg)
+                raise ValueError(msg)
+
+        self.nodes = nodes
+        self.runtime_dir = runtime_dir
+        self.publish = publish
+        self.escalate = escalate
+        self.period = period
+        self.backoff = backoff
+        self.max_restarts = max_restarts
+        self.overruns: Dict[str, int] = {node.config.name: 0 for node in nodes}
+        # Start of the last stalled tick of every node (so every stall is only handled once)
+        self.stalled: Dict[str, float] = {node.config.name: 0.0 for node in nodes}
+        # Consecutive restarts of every node, with the time of the last one and its completed ticks by then
+        self.restarts: Dict[str, int] = {node.config.name: 0 for node in nodes}
+        self.restarted: Dict[str, Tuple[float, float]] = {}
+        self.stack_offsets: Dict[int, int] = {}
+        self.running = False
+
+    def start(self):
+        """
+        Starts watching in a background thread
+        """
+        self.running = True
+        Thread(target=self.__watch_worker, daemon=True).start()
+
+    def stop(self):
+        """
+        Stops watching
+        """
+        self.running = False
+
+    def __watch_worker(self):
+        """
+        Worker function that checks the ticks of the nodes
+        """
+        while self.running:
+            for node in self.nodes:
+                self.__check_budget(node)
+                self.__check_stall(node)
+                self.__check_restart(node)
+            time.sleep(self.period)
+
+    def __check_budget(self, node):
+        """
+        Reports the ticks of a node that ran over budget since the last check
+        @param node: The EgoNode
+        """
+        name = node.config.name
+        overruns = int(node.tick_state.values[OVERRUNS])
+        if overruns == self.overruns[name]:
+            return
+
+        missed = overruns - self.overruns[name]
+        self.overruns[name] = overruns
+        duration = node.tick_state.values[LAST_DURATION]
+        self.publish(Diagnostic(
+            node=name,
+            level='warning',
+            kind='overrun',
+            message=f'{missed} tick(s) over the budget of {node.config.tick_budget * 1000:.1f} ms',
+            duration=duration
+        ))
+
+    def __check_stall(self, node):
+        """
+        Handles a node whose tick missed the watchdog timeout
+        @param node: The EgoNode
+        """
+        name = node.config.name
+        timeout = node.config.watchdog_timeout
+        running_for = node.tick_state.running_for()
+        if timeout is None or running_for is None or running_for < timeout:
+            return
+        started = node.tick_state.values[STARTED]
+        if started == self.stalled[name]:
+            return
+        self.stalled[name] = started
+
+        stack = self.__capture_stack(int(node.tick_state.values[PID]))
+        message = f'Tick has been running for {running_for:.2f} s (watchdog timeout is {timeout:.2f} s)'
+        log.error(f'''
+    Node {name} is stuck: {message}
+    Applying watchdog action "{node.config.watchdog_action}". Stack of the worker:
+{stack}
+        ''')
+        self.publish(Diagnostic(
+            node=name,
+            level='error',
+            kind='stall',
+            message=message,
+            duration=running_for,
+            stack=stack
+        ))
+
+        if node.config.watchdog_action == 'restart':
+            self.__check_restart(node)
+        elif node.config.watchdog_action == 'escalate':
+            log.critical(f'Stopping the instance, node {name} is stuck')
+            self.escalate()
+
+    def __check_restart(self, node):
+        """
+        Restarts a stalled node once its backoff has passed
+        @param node: The EgoNode
+        """
+        name = node.config.name
+        if node.config.watchdog_action != 'restart':
+            return
+        ticks = node.tick_state.values[TICKS]
+        if name in self.restarted and ticks != self.restarted[name][1]:
+            # The node ticked since its last restart, it recovered
+            self.restarts[name] = 0
+            del self.restarted[name]
+
+        started = node.tick_state.values[STARTED]
+        if started == 0.0 or started != self.stalled[name]:
+            return # Not stalled, or the stall was not reported yet
+        if self.restarts[name] >= self.max_restarts:
+            return
+
+        if name in self.restarted:
+            wait = self.backoff * 2 ** (self.restarts[name] - 1)
+            if time.monotonic() - self.restarted[name][0] < wait:
+                return
+
+        self.restarts[name] += 1
+        node.restart()
+        self.restarted[name] = (time.monotonic(), node.tick_state.values[TICKS])
+        if self.restarts[name] == self.max_restarts:
+            message = f'Restarted {self.max_restarts} times in a row without completing a tick, it won\'t be restarted again'
+            log.critical(f'Node {name}: {message}')
+            self.publish(Diagnostic(
+                node=name,
+                level='error',
+                kind='stall',
+                message=message,
+                duration=0.0
+            ))
+
+    def __capture_stack(self, pid: int, timeout: float = 1.0) -> Optional[str]:
+        """
+        Asks a worker for the stack of its threads
+        @param pid: Process id of the worker
+        @param timeout: Seconds to wait for the dump
+        @return: The dumped stacks (None if the worker did not dump them)
+        """
+        path = stack_path(self.runtime_dir, pid)
+        offset = self.stack_offsets.get(pid, 0)
+        try:
+            os.kill(pid, STACK_SIGNAL)
+        except ProcessLookupError:
+            return None
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            try:
+                with open(path) as dump:
+                    dump.seek(offset)
+                    stack = dump.read()
+            except FileNotFoundError:
+                continue
+            if stack:
+                self.stack_offsets[pid] = offset + len(stack)
+                return stack
+        return None
@@ -0,0 +1,163 @@
+from threading import Condition, Thread
+from typing import Callable, List, Optional, Tuple
+import heapq
+import itertools
+import logging
+import os
+import traceback
+from . import clock
+from . import tracing
+
+log = logging.getLogger('egoros')
+
+
+class Timer:
+    """
+    Callback run periodically (or once) by a TimerQueue
+    """
+
+    def __init__(self, period: float, callback: Callable[[], None], oneshot: bool = False) -> None:
+        """
+        Constructor for the Timer class
+        @param period: Seconds between runs (or before the only run of a oneshot timer)
+        @param callback: Function to run
+        @param oneshot: Run the callback only once
+        """
+        if period <= 0:
+            msg = f'''
+    Timer period has to be positive (got {period})
+            '''
+            log.error(msg)
+            raise ValueError(msg)
+
+        self.period = period
+        self.callback = callback
+        self.oneshot = oneshot
+        self.cancelled = False
+        self.deadline = 0.0
+
+    def cancel(self):
+        """
+        Stops running the timer (it's removed from its queue on its next deadline)
+        """
+        self.cancelled = True
+
+
+class TimerQueue:
+    """
+    Runs all the timers of a worker from a single thread, ordered in a heap by their deadlines
+    @details
+    Callbacks run one after another, a slow callback delays the rest of the timers of the worker.
+    Periodic timers keep their rate, but skip the runs they missed if they fall more than a period behind.
+    A callback that raises is logged, the rest of the timers keep running.
+    """
+
+    def __init__(self) -> None:
+        self.heap: List[Tuple[float, int, Timer]] = []
+        self.condition = Condition()
+        # Breaks the ties between equal deadlines, keeping the creation order
+        self.counter = itertools.count()
+        # Process that runs the timers, and process where the thread was launched
+        self.worker_pid: Optional[int] = None
+        self.thread_pid: Optional[int] = None
+
+    def add(self, timer: Timer) -> Timer:
+        """
+        Schedules a timer, its first run is one period from now
+        @param timer: The timer
+        @return: The scheduled timer
+        """
+        with self.condition:
+            timer.deadline = clock.get_clock().now() + timer.period
+            heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+            self.condition.notify()
+        # Timers created after the queue was started (for example from a tick) need the thread of the process
+        if self.worker_pid == os.getpid() and self.thread_pid != os.getpid():
+            self.__launch()
+        return timer
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        Gets the earliest deadline of the queue (None if it's empty)
+        """
+        with self.condition:
+            return self.heap[0][0] if self.heap else None
+
+    def run_due(self, now: float):
+        """
+        Runs the timers whose deadline has been reached
+        @param now: The current time
+        """
+        due = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap)[2])
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                if tracing.enabled:
+                    tracing.begin(getattr(timer.callback, '__name__', 'timer'), 'timer')
+                    try:
+                        timer.callback()
+                    finally:
+                        tracing.end(getattr(timer.callback, '__name__', 'timer'), 'timer')
+                else:
+                    timer.callback()
+            except Exception:
+                log.warning(f'''
+    Timer callback {getattr(timer.callback, '__name__', timer.callback)} crashed
+    Exception:
+        {traceback.format_exc()}
+                ''')
+            if timer.oneshot or timer.cancelled:
+                continue
+            timer.deadline += timer.period
+            if timer.deadline <= now:
+                timer.deadline = now + timer.period
+            with self.condition:
+                heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+
+    def start(self):
+        """
+        Starts running the timers in a background thread of the current process
+        @details The thread is launched with the first timer, processes without timers don't pay for it
+        """
+        self.worker_pid = os.getpid()
+        if self.next_deadline() is not None:
+            self.__launch()
+
+    def reset(self):
+        """
+        Removes every timer of the queue (used by a process that doesn't run the timers it inherited)
+        """
+        self.heap = []
+        self.condition = Condition()
+        self.worker_pid = None
+        self.thread_pid = None
+
+    def __launch(self):
+        """
+        Launches the thread of the queue in the current process (once)
+        """
+        with self.condition:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread_pid = os.getpid()
+        Thread(target=self.__timer_worker, daemon=True).start()
+
+    def __timer_worker(self):
+        """
+        Worker function that sleeps until the next deadline and runs the due timers
+        """
+        timer_clock = clock.get_clock()
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.heap) > 0)
+                remaining = self.heap[0][0] - timer_clock.now()
+                if remaining > 0:
+                    # New timers wake the thread up, their deadline may be earlier
+                    self.condition.wait(remaining)
+                    continue
+            self.run_due(timer_clock.now())
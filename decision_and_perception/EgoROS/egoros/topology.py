@@ -0,0 +1,63 @@
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Set, TypeVar
+import logging
+
+log = logging.getLogger('egoros')
+
+# Nodes of the graph, any hashable object (node names or the nodes themselves)
+N = TypeVar('N', bound=Hashable)
+
+
+def build_dependency_graph(inputs: Dict[N, Iterable[str]], outputs: Dict[N, Iterable[str]]) -> Dict[N, Set[N]]:
+    """
+    Builds the dependency graph between nodes from the topics they use
+    @param inputs: Topics read by every node (indexed by node)
+    @param outputs: Topics published by every node (indexed by node)
+    @return: Nodes that consume the data of every node (indexed by node)
+    """
+    readers: Dict[str, Set[N]] = {}
+    for name, topics in inputs.items():
+        for topic in topics:
+            readers.setdefault(topic, set()).add(name)
+
+    graph: Dict[N, Set[N]] = {name: set() for name in {*inputs.keys(), *outputs.keys()}}
+    for name, topics in outputs.items():
+        for topic in topics:
+            graph[name] |= readers.get(topic, set()) - {name}
+
+    return graph
+
+def pipeline_stages(graph: Dict[N, Set[N]], key: Callable[[N], Any] = str) -> List[List[N]]:
+    """
+    Orders the nodes of a dependency graph in pipeline stages
+    @param graph: Dependency graph (as returned by build_dependency_graph)
+    @param key: Function used to sort the nodes of every stage (so the order does not depend on hashes)
+    @return: List of stages, every node only depends on nodes of previous stages
+    @details
+    Nodes that are part of a cycle can't be ordered, they are placed together in the last stage
+    """
+    pending = {name: 0 for name in graph}
+    for consumers in graph.values():
+        for consumer in consumers:
+            pending[consumer] += 1
+
+    stages: List[List[N]] = []
+    current = sorted((name for name, count in pending.items() if count == 0), key=key)
+    while current:
+        stages.append(current)
+        following: List[N] = []
+        for name in current:
+            for consumer in graph[name]:
+                pending[consumer] -= 1
+                if pending[consumer] == 0:
+                    following.append(consumer)
+        current = sorted(following, key=key)
+
+    ordered = {name for stage in stages for name in stage}
+    cyclic = sorted((name for name in graph if name not in ordered), key=key)
+    if cyclic:
+        log.warning(f'''
+    Nodes {[key(name) for name in cyclic]} have cyclic dependencies between their topics, they can't be ordered in stages
+        ''')
+        stages.append(cyclic)
+
+    return stages
@@ -0,0 +1,107 @@
+from collections import deque
+from typing import Deque, List, Tuple
+import glob
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+log = logging.getLogger('egoros')
+
+# Set before forking the workers, so every process records its events
+enabled = False
+# Events of the current process: (phase, name, category, monotonic ns, thread id)
+events: Deque[Tuple[str, str, str, int, int]] = deque(maxlen=1 << 16)
+process_name = 'egoros'
+
+
+def trace_path(runtime_dir: str, pid: int) -> str:
+    """
+    Gets the path where a process dumps its events
+    @param runtime_dir: Runtime folder of the instance
+    @param pid: Process id
+    """
+    return os.path.join(runtime_dir, f'trace-{pid}.json')
+
+def enable(buffer_size: int = 1 << 16):
+    """
+    Starts recording events in the current process (and in the processes forked from it)
+    @param buffer_size: Maximum number of events kept by every process (the oldest are overwritten)
+    """
+    global enabled, events
+    enabled = True
+    events = deque(maxlen=buffer_size)
+
+def begin(name: str, category: str):
+    """
+    Records the start of an event
+    @param name: Name of the event (for example the topic)
+    @param category: Kind of the event (tick, callback, publish, wait, timer)
+    """
+    events.append(('B', name, category, time.monotonic_ns(), threading.get_native_id()))
+
+def end(name: str, category: str):
+    """
+    Records the end of an event
+    @param name: Name of the event
+    @param category: Kind of the event
+    """
+    events.append(('E', name, category, time.monotonic_ns(), threading.get_native_id()))
+
+def start_worker(runtime_dir: str, name: str):
+    """
+    Prepares the tracing of a worker process, its events are dumped when it's stopped
+    @param runtime_dir: Runtime folder of the instance
+    @param name: Name of the process shown in the trace
+    """
+    global process_name
+    process_name = name
+    events.clear() # Events inherited from the parent process are dumped by the parent
+
+    def dump_and_exit(signum, frame):
+        dump(trace_path(runtime_dir, os.getpid()))
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, dump_and_exit)
+    signal.signal(signal.SIGINT, dump_and_exit)
+
+def dump(path: str):
+    """
+    Writes the events of the current process as Chrome trace events
+    @param path: Path of the file
+    """
+    pid = os.getpid()
+    threads = {thread.native_id: thread.name for thread in threading.enumerate()}
+    trace = [{'ph': 'M', 'name': 'process_name', 'pid': pid, 'tid': 0, 'args': {'name': process_name}}]
+    trace.extend(
+        {'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+        for tid, name in threads.items()
+    )
+    trace.extend(
+        {'ph': phase, 'name': name, 'cat': category, 'ts': stamp / 1000, 'pid': pid, 'tid': tid}
+        for phase, name, category, stamp, tid in list(events)
+    )
+    with open(path, 'w') as output:
+        json.dump(trace, output)
+
+def merge(runtime_dir: str, output: str) -> int:
+    """
+    Merges the events dumped by all the processes into a trace that Perfetto (or chrome://tracing) can open
+    @param runtime_dir: Runtime folder of the instance
+    @param output: Path of the merged trace
+    @return: Number of events in the trace
+    """
+    trace: List[dict] = []
+    for path in glob.glob(os.path.join(runtime_dir, 'trace-*.json')):
+        try:
+            with open(path) as dumped:
+                trace.extend(json.load(dumped))
+        except (OSError, ValueError):
+            log.warning(f'Trace of {path} could not be read')
+
+    with open(output, 'w') as merged:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, merged)
+    log.info(f'Trace with {len(trace)} events written to {output}')
+    return len(trace)
@@ -1,5 +1,6 @@
 import os
-from typing import List
+import tempfile
+from typing import List, Optional
 import logging
 
 def get_node_filenames_from_path(path: str):
@@ -45,6 +46,45 @@ def get_node_filenames_from_path(path: str):
     paths = [os.path.abspath(e) for e in paths] 
     return paths
 
+def get_runtime_dir(pid: Optional[int] = None) -> str:
+    """
+    Gets the runtime folder of an EgoROS instance
+    @param pid Process id of the instance (defaults to the current process)
+    @details
+    The runtime folder holds the sockets and files used to reach a running instance
+    @return str with the path of the folder (it may not exist)
+    """
+    if pid is None:
+        pid = os.getpid()
+    return os.path.join(tempfile.gettempdir(), 'egoros', str(pid))
+
+def find_instance_pid() -> int:
+    """
+    Finds a running EgoROS instance
+    @details
+    Instances are discovered through their runtime folders. If several instances are running,
+    the most recently started one is returned
+    @return int with the process id of the instance
+    """
+    root = os.path.dirname(get_runtime_dir())
+    candidates: List[os.DirEntry] = []
+    if os.path.isdir(root):
+        for entry in os.scandir(root):
+            if not entry.name.isdigit():
+                continue
+            try:
+                os.kill(int(entry.name), 0) # Check if the process is still alive
+            except ProcessLookupError:
+                continue
+            except PermissionError:
+                pass
+            candidates.append(entry)
+
+    if not candidates:
+        raise FileNotFoundError(f'No running EgoROS instance found in "{root}"')
+
+    return int(max(candidates, key=lambda e: e.stat().st_mtime).name)
+
 def configure_logger(
         path: str = 'egoros.log',
         level: int = logging.INFO
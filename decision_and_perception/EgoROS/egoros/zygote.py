@@ -0,0 +1,53 @@
+from typing import Callable, List, Optional
+import gc
+import importlib
+import logging
+import multiprocessing
+import time
+
+log = logging.getLogger('egoros')
+
+# Workers are always forked: other start methods (spawn, forkserver) would import every module again
+context = multiprocessing.get_context('fork')
+
+
+def preload(modules: List[str]) -> List[str]:
+    """
+    Imports modules in the current process so the node workers inherit them already loaded
+    @param modules: Names of the modules to import (for example numpy or cv2)
+    @return: Names of the modules that were loaded
+    """
+    loaded = []
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            log.warning(f'''
+    Could not preload module "{name}": {e}
+            ''')
+            continue
+        loaded.append(name)
+        log.info(f'Preloaded module "{name}" in {(time.perf_counter() - start) * 1000:.1f} ms')
+    return loaded
+
+def freeze():
+    """
+    Moves every object of the current process to the permanent generation of the garbage collector
+    @details
+    Called right before forking the workers. The collector of the workers won't visit the inherited
+    objects, so their memory pages are not written and stay shared copy-on-write between all the workers
+    """
+    gc.collect()
+    gc.freeze()
+
+def spawn_worker(target: Callable[[], None], name: Optional[str] = None) -> multiprocessing.Process:
+    """
+    Forks a worker process from the current (preloaded) process
+    @param target: Function run by the worker
+    @param name: Name of the worker process (shown in the logs)
+    @return: The started process
+    """
+    process = context.Process(target=target, name=name)
+    process.start()
+    return process
@@ -0,0 +1,81 @@
+import multiprocessing
+import numpy as np
+import pytest
+from egoros import pubsub
+from egoros.arraytopic import ArrayTopic
+
+context = multiprocessing.get_context('fork')
+
+
+@pytest.fixture
+def topic():
+    topic = ArrayTopic('camera/image', (4,), np.uint8, slots=2)
+    yield topic
+    topic.close()
+
+
+def publish_and_wait(topic, value, published, done):
+    topic.publish(np.full(4, value, np.uint8))
+    published.set()
+    done.wait(10)
+
+def try_publish(topic, result):
+    try:
+        topic.publish(np.zeros(4, np.uint8))
+        result.put('published')
+    except RuntimeError:
+        result.put('rejected')
+
+
+def test_second_publisher_process_is_rejected(topic):
+    published, done = context.Event(), context.Event()
+    owner = context.Process(target=publish_and_wait, args=(topic, 1, published, done))
+    owner.start()
+    try:
+        assert published.wait(10)
+        result = context.Queue()
+        second = context.Process(target=try_publish, args=(topic, result))
+        second.start()
+        assert result.get(timeout=10) == 'rejected'
+        second.join()
+    finally:
+        done.set()
+        owner.join()
+
+    # Once the owner exited (a restarted node) another process can publish
+    result = context.Queue()
+    restarted = context.Process(target=try_publish, args=(topic, result))
+    restarted.start()
+    assert result.get(timeout=10) == 'published'
+    restarted.join()
+
+
+def test_observers_see_frames(topic):
+    observed = []
+    observer = lambda name, value, ctx: observed.append((name, value.copy(), ctx.topic))
+    pubsub.observers.append(observer)
+    try:
+        topic.publish(np.full(4, 7, np.uint8))
+    finally:
+        pubsub.observers.remove(observer)
+    assert len(observed) == 1
+    name, value, ctx_topic = observed[0]
+    assert name == ctx_topic == 'camera/image'
+    assert value.tolist() == [7] * 4
+
+
+def test_dropped_frames_are_shared(topic):
+    reader = topic.add_reader()
+    frames = topic.frames(reader, timeout=0.01)
+    assert next(frames) is None # Starts reading from the current frame
+    for value in range(5):
+        topic.publish(np.full(4, value, np.uint8))
+    # Only the last two frames fit in the ring
+    received = [next(frames)[0].array[0] for _ in range(2)]
+    assert received == [3, 4]
+
+    counted = context.Queue()
+    process = context.Process(target=lambda: counted.put(topic.dropped_frames(reader)))
+    process.start()
+    assert counted.get(timeout=10) == 3
+    process.join()
@@ -0,0 +1,37 @@
+import pytest
+from egoros import checkpoint
+from egoros.checkpoint import Checkpointer
+
+BIG = list(range(100000))
+
+
+def test_restart_restores_a_checkpoint_written_after_growing(tmp_path):
+    path = str(tmp_path / 'node.ckpt')
+    # The instance and the worker of the node map the file separately
+    instance, worker = Checkpointer(path), Checkpointer(path)
+    worker.save({'x': 1})
+    assert instance.load() == (True, {'x': 1})
+
+    worker.save({'x': 2, 'map': BIG})
+    assert instance.load()[1]['x'] == 2
+    worker.save({'x': 3, 'map': BIG})
+    assert instance.load()[1]['x'] == 3
+
+
+def test_crash_while_growing_keeps_the_previous_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'node.ckpt')
+    Checkpointer(path).save({'x': 1})
+
+    def crash(source, destination):
+        raise OSError('crashed before replacing the file')
+    monkeypatch.setattr(checkpoint.os, 'replace', crash)
+    crashed = Checkpointer(path)
+    with pytest.raises(OSError):
+        crashed.save({'x': 2, 'map': BIG})
+    monkeypatch.undo()
+    assert Checkpointer(path).load() == (True, {'x': 1})
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == ['node.ckpt']
+
+    # The process keeps writing to the old file
+    crashed.save({'x': 3})
+    assert Checkpointer(path).load() == (True, {'x': 3})
@@ -0,0 +1,17 @@
+import multiprocessing
+import os
+from egoros import memory
+
+
+def test_pss_divides_shared_pages():
+    # Pages inherited by a forked child are shared, so the PSS of both is below their resident memory
+    ready = multiprocessing.get_context('fork').Event()
+    child = multiprocessing.get_context('fork').Process(target=ready.wait)
+    child.start()
+    try:
+        for pid in [os.getpid(), child.pid]:
+            assert 0 < memory.read_pss(pid) < memory.read_rss(pid)
+    finally:
+        ready.set()
+        child.join()
+    assert memory.read_pss(child.pid) == 0
@@ -0,0 +1,23 @@
+import os
+import pytest
+from egoros.offload import OffloadError, OffloadPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = OffloadPool(str(tmp_path), size=1)
+    pool.start(period=0.05)
+    yield pool
+    pool.stop()
+
+
+def test_dead_worker_fails_only_its_function(pool):
+    assert pool.submit(pow, 2, 3).result(10) == 8
+    with pytest.raises(OffloadError, match='died'):
+        pool.submit(os._exit, 3).result(10)
+    # The replaced worker keeps running functions
+    assert pool.submit(pow, 3, 2).result(10) == 9
+
+    # Workers are idle before replying, so the counters are exact once the futures are resolved
+    metrics = pool.metrics()
+    assert (metrics.completed, metrics.failed, metrics.running, metrics.queued) == (2, 1, 0, 0)
@@ -0,0 +1,36 @@
+import re
+import pytest
+from egoros import ring
+
+PUBLISHER = '''
+from egoros.node import Configuration
+
+def init(node):
+    node.publish('a/b', 0)
+    return Configuration(name='publisher', tick_rate=20, publishes=['a/b'])
+
+def tick(node):
+    count = getattr(node, 'count', 0) + 1
+    node.count = count
+    if count <= 10:
+        node.publish('a/b', count)
+'''
+
+SUBSCRIBER = '''
+from egoros.node import Configuration
+
+def init(node):
+    def on_message(msg, ctx):
+        print(f"received {msg} {node.subscriptions['a/b'].ring is not None}", flush=True)
+    node.subscribe('a/b', on_message)
+    return Configuration(name='subscriber', tick_rate=1)
+'''
+
+
+@pytest.mark.skipif(not ring.SUPPORTED, reason='shared memory rings are not supported on this machine')
+def test_ring_keeps_startup_messages(run_nodes):
+    output = run_nodes({'publisher.py': PUBLISHER, 'subscriber.py': SUBSCRIBER})
+    # Other processes may write in the middle of a line
+    received = re.findall(r'received (\d+) (True|False)', '\n'.join(output))
+    # The message published in init was queued before the ring was attached
+    assert received == [(str(count), 'True') for count in range(11)]
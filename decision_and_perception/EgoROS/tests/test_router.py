@@ -0,0 +1,25 @@
+from egoros.router import TopicRouter, normalize
+
+
+def test_names_are_normalized():
+    assert normalize('/sensors//lidar/') == 'sensors/lidar'
+    router = TopicRouter()
+    router['/a/b'] = 'topic'
+    assert 'a/b' in router and router['a/b/'] == 'topic'
+    router['a/b'] = 'topic'
+    assert list(router) == ['a/b']
+
+
+def test_patterns_match_existing_and_new_topics():
+    router = TopicRouter()
+    matched = []
+    router['/sensors/lidar/front'] = 'lidar'
+    router.watch('sensors/**', lambda name, topic: matched.append(('**', name)))
+    router.watch('/sensors/*/image', lambda name, topic: matched.append(('*', name)))
+    router['sensors/camera/image'] = 'camera'
+    router['control/cmd'] = 'command'
+    assert sorted(matched) == [
+        ('*', 'sensors/camera/image'),
+        ('**', 'sensors/camera/image'),
+        ('**', 'sensors/lidar/front')
+    ]
@@ -0,0 +1,27 @@
+import time
+from egoros import soak
+from egoros.pubsub import MessageContext
+
+
+def test_soak_counts_publisher_drops_once(tmp_path):
+    nodes = tmp_path / 'nodes'
+    results = tmp_path / 'results'
+    nodes.mkdir()
+    results.mkdir()
+    soak.generate_fleet(str(nodes), str(results), 2, soak.FleetConfig(queue_size=1))
+
+    # Runs the callbacks of a generated node without an instance
+    node = {}
+    exec((nodes / 'n0.py').read_text(), node)
+    topic = node['SUBSCRIBES'][0]
+    # The publisher dropped message 3 for this subscriber, which sees a gap
+    for seq in [1, 2, 4, 5]:
+        node['on_message']((seq, b''), MessageContext(time.time_ns(), topic))
+    node['stats']['publish_drops'] += 1
+    node['flush']()
+
+    report = soak.SoakReport(nodes=2)
+    latencies = soak.read_results(str(results), report)
+    assert report.received == 4 and len(latencies) == 4
+    assert report.dropped == 1
+    assert report.publish_drops == 1
@@ -0,0 +1,43 @@
+import json
+import re
+
+PUBLISHER = '''
+from egoros.node import Configuration
+
+def init(node):
+    return Configuration(name='publisher', tick_rate=20)
+
+def tick(node):
+    # Not declared, the topic is created in the ticker process after launching
+    node.publish('late/topic', 1.5)
+'''
+
+INSPECTOR = '''
+import json
+import os
+from egoros.node import Configuration
+from egoros.tap import TapClient
+
+def init(node):
+    return Configuration(name='inspector', tick_rate=2)
+
+def tick(node):
+    node.ticks = getattr(node, 'ticks', 0) + 1
+    if node.ticks != 2:
+        return
+    client = TapClient(os.getppid())
+    info = client.info()
+    print('tap ' + json.dumps({'topics': client.list_topics(), 'info': info.get('late/topic')}), flush=True)
+    client.close()
+'''
+
+
+def test_tap_lists_topics_created_after_launch(run_nodes):
+    output = run_nodes({'publisher.py': PUBLISHER, 'inspector.py': INSPECTOR})
+    # Other processes may write in the middle of a line
+    replies = re.findall(r'tap (\{.*\})', '\n'.join(output))
+    assert len(replies) == 1
+    reply = json.loads(replies[0])
+    assert 'late/topic' in reply['topics']
+    assert reply['info']['type'] == 'float'
+    assert reply['info']['publishers'] == ['publisher']
@@ -0,0 +1,33 @@
+import re
+
+PUBLISHER = '''
+from egoros.node import Configuration
+
+def init(node):
+    node.publish('/s/early', 0)
+    return Configuration(name='publisher', tick_rate=20)
+
+def tick(node):
+    count = getattr(node, 'count', 0) + 1
+    node.count = count
+    # Created in the ticker process, after the subscriber was launched
+    node.publish('s/late/', count)
+'''
+
+SUBSCRIBER = '''
+from egoros.node import Configuration
+
+def init(node):
+    node.subscribe('/s/*', lambda msg, ctx: print(f'received {ctx.topic} {msg}', flush=True))
+    return Configuration(name='subscriber', tick_rate=1)
+'''
+
+
+def test_wildcard_receives_topics_created_after_launch(run_nodes):
+    output = run_nodes({'publisher.py': PUBLISHER, 'subscriber.py': SUBSCRIBER})
+    # Other processes may write in the middle of a line
+    received = re.findall(r'received (s/\w+) (\d+)', '\n'.join(output))
+    assert ('s/early', '0') in received
+    late = [int(value) for topic, value in received if topic == 's/late']
+    assert len(late) > 10 and late == list(range(1, len(late) + 1))
+    assert not any('Traceback' in line for line in output)